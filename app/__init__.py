@@ -23,14 +23,15 @@ from app.settings.database import engine, Base
 from app.models.serial_config import SerialConfig
 from app.models.register_log import RegisterLog
 from app.models.saved_register import SavedRegister
+from app.models.port_tuning import PortTuning
 from app.api import v1_router
-from app.utils.serial_helper import SerialHelper
 from app.utils.port_monitor import PortMonitor
-from app.ws_manager import WebSocketManager
+from app.core.state import (
+    serial_helper, ws_manager, serial_hub, serial_capture, block_tuning, register_watcher, batch_jobs
+)
+from app.serial_hub import STREAM_MODE_JSON, STREAM_MODE_BINARY
 
 # 全局实例
-serial_helper = SerialHelper()
-ws_manager = WebSocketManager()
 port_monitor = PortMonitor(ws_manager)
 from fastapi.responses import HTMLResponse
 
@@ -152,14 +153,29 @@ async def on_startup() -> None:
     Base.metadata.create_all(bind=engine)
     
     # 初始化时无需打开串口，按需通过 API 打开
+    # 绑定事件循环，串口在线程池路由中打开时也能直接注册到该循环
+    serial_helper.attach_loop(asyncio.get_running_loop())
     # 启动串口监听
     port_monitor.start_monitoring()
+    # 开启滚动回看时串口读取任务常驻，没有 /ws 连接时也持续记录历史行
+    if serial_hub.scrollback is not None:
+        serial_hub.start()
+    if os.getenv("SERIAL_CAPTURE_DIR"):
+        await serial_capture.start(os.getenv("SERIAL_CAPTURE_DIR"))
 
 
 @app.on_event("shutdown")
 async def on_shutdown() -> None:
     # 停止串口监听
     port_monitor.stop_monitoring()
+    # 停止串口事务调度，未完成的请求立即失败
+    serial_helper.scheduler.stop()
+    serial_hub.stop()
+    await serial_capture.stop()
+    register_watcher.stop()
+    batch_jobs.stop()
+    # 写回尚未保存的块大小/超时调优参数
+    await block_tuning.flush()
 
 
 @app.get("/api/ping")
@@ -201,26 +217,121 @@ def custom_swagger_ui_html():
 
 @app.websocket("/ws")
 async def websocket_endpoint(websocket: WebSocket):
+    # 握手时通过查询参数选择串口数据流格式：
+    #   mode=json（默认，兼容旧版）每段数据一条 {"type":"serial","payload":text}
+    #   mode=binary 按 window_ms / max_bytes 合并后以二进制帧发送（帧格式见 app/serial_hub.py）
+    # since=<seq> 先回放滚动缓冲区中该序号之后的历史行（负数表示最近 N 行），再切换到实时数据
+    params = websocket.query_params
+    mode = params.get("mode", STREAM_MODE_JSON)
+    if mode not in (STREAM_MODE_JSON, STREAM_MODE_BINARY):
+        await websocket.close(code=1008, reason=f"unsupported mode: {mode}")
+        return
+    try:
+        window_ms = min(max(float(params.get("window_ms", 16)), 1.0), 1000.0)
+        max_bytes = min(max(int(params.get("max_bytes", 64 * 1024)), 256), 1024 * 1024)
+        since = int(params["since"]) if "since" in params else None
+    except ValueError:
+        await websocket.close(code=1008, reason="invalid window_ms, max_bytes or since")
+        return
+
     await ws_manager.connect(websocket)
+    # 串口数据由共享的 serial_hub 统一读取并扇出，这里只注册订阅
+    client = websocket.client
+    name = f"{client.host}:{client.port}" if client else f"ws-{id(websocket)}"
+    subscriber = serial_hub.subscribe(
+        name, lambda message: ws_manager.send_to(websocket, message),
+        mode=mode, window=window_ms / 1000.0, max_bytes=max_bytes, since=since)
+
+    async def handle_control(message: dict) -> bool:
+        # {"type":"triggers","triggers":[{"id":"err","pattern":"ERROR","regex":false}],"filtered":false}
+        if message.get("type") != "triggers":
+            return False
+        try:
+            count = serial_hub.set_triggers(
+                subscriber, list(message.get("triggers") or []), bool(message.get("filtered", False)))
+        except (ValueError, TypeError, AttributeError) as e:
+            ws_manager.send_to(websocket, {"type": "error", "message": str(e)})
+        else:
+            ws_manager.send_to(websocket, {"type": "triggers_ack", "count": count,
+                                           "filtered": subscriber.filtered})
+        return True
+
     try:
-        # 同时处理：
-        # 1) 来自客户端的消息（写串口）
-        # 2) 来自串口的消息（广播给所有 WS 客户端）
-        recv_task = asyncio.create_task(
-            ws_manager.receive_from_client(websocket))
-        serial_task = asyncio.create_task(
-            serial_helper.start_reading(ws_manager.broadcast))
-
-        done, pending = await asyncio.wait(
-            {recv_task, serial_task},
-            return_when=asyncio.FIRST_EXCEPTION,
-        )
-
-        for task in pending:
-            task.cancel()
+        # 处理来自客户端的消息（触发规则在此处理，其余写串口）
+        await ws_manager.receive_from_client(websocket, handle_control)
+    except WebSocketDisconnect:
+        pass
+    except Exception as e:
+        print(f"WebSocket 错误: {e}")
+    finally:
+        serial_hub.unsubscribe(subscriber)
+        await ws_manager.disconnect(websocket)
+
 
+@app.websocket("/ws/registers")
+async def register_watch_websocket(websocket: WebSocket):
+    """寄存器监视：客户端登记监视集合，服务端按节拍合并读取并只推送变化的寄存器"""
+    await ws_manager.connect_direct(websocket)
+    send = lambda message: ws_manager.send_to(websocket, message)
+    try:
+        while True:
+            # {"type":"watch","id":"w1","addresses":["0x20470c04"],"names":["CTRL"],"size":4,"interval_ms":200}
+            # {"type":"unwatch","id":"w1"} / {"type":"resync","id":"w1"}（id 省略表示全部）
+            message = await websocket.receive_json()
+            if not isinstance(message, dict):
+                send({"type": "error", "message": "消息必须为 JSON 对象"})
+                continue
+            kind = message.get("type")
+            watch_id = message.get("id")
+            try:
+                if kind == "watch":
+                    send(register_watcher.watch(
+                        websocket, watch_id if watch_id is not None else "default", send,
+                        addresses=list(message.get("addresses") or []),
+                        names=list(message.get("names") or []),
+                        size=message.get("size", 4),
+                        interval_ms=float(message.get("interval_ms", 1000))))
+                elif kind == "unwatch":
+                    send({"type": "unwatch_ack", "id": watch_id,
+                          "count": register_watcher.unwatch(websocket, watch_id)})
+                elif kind == "resync":
+                    send({"type": "resync_ack", "id": watch_id,
+                          "count": register_watcher.resync(websocket, watch_id)})
+                else:
+                    send({"type": "error", "message": f"未知的消息类型: {kind}"})
+            except (ValueError, TypeError) as e:
+                send({"type": "error", "id": watch_id, "message": str(e)})
     except WebSocketDisconnect:
         pass
+    except Exception as e:
+        print(f"寄存器监视 WebSocket 错误: {e}")
+    finally:
+        register_watcher.unwatch(websocket)
+        await ws_manager.disconnect(websocket)
+
+
+@app.websocket("/ws/jobs/{job_id}")
+async def batch_job_websocket(websocket: WebSocket, job_id: str):
+    """批量任务进度：推送已有及新完成的结果段与进度，任务结束后发送 end 并关闭"""
+    job = batch_jobs.get(job_id)
+    if job is None:
+        await websocket.close(code=1008, reason=f"job not found: {job_id}")
+        return
+    try:
+        offset = int(websocket.query_params.get("offset", 0))
+    except ValueError:
+        await websocket.close(code=1008, reason="invalid offset")
+        return
+    await ws_manager.connect_direct(websocket)
+    try:
+        async for event in job.follow(max(0, offset)):
+            if not ws_manager.send_to(websocket, event):
+                break
+        # 等发送队列清空后再关闭
+        while ws_manager.pending(websocket):
+            await asyncio.sleep(0.01)
+    except Exception as e:
+        print(f"批量任务 WebSocket 错误: {e}")
     finally:
         await ws_manager.disconnect(websocket)
 
@@ -231,8 +342,9 @@ async def serial_ports_websocket(websocket: WebSocket):
     await ws_manager.connect_serial_ports(websocket)
     
     # 发送当前可用串口列表
+    # 与串口变化广播共用同一发送队列，避免两个协程同时写同一连接
     current_ports = port_monitor.get_current_ports()
-    await websocket.send_json({
+    ws_manager.send_to(websocket, {
         "type": "ports_update",
         "ports": current_ports
     })
@@ -249,14 +361,14 @@ async def serial_ports_websocket(websocket: WebSocket):
                     if message.get("type") == "get_ports":
                         # 客户端请求获取串口列表
                         current_ports = port_monitor.get_current_ports()
-                        await websocket.send_json({
+                        ws_manager.send_to(websocket, {
                             "type": "ports_update",
                             "ports": current_ports
                         })
                 except json.JSONDecodeError:
                     # 处理非JSON消息（如心跳）
                     if data == "ping":
-                        await websocket.send_text("pong")
+                        ws_manager.send_to(websocket, "pong")
                         
             except WebSocketDisconnect:
                 break
@@ -8,9 +8,11 @@ Description:
 from fastapi import APIRouter
 from .registers import router as _routes
 from .saved_registers import router as _saved_routes
+from .jobs import router as _job_routes
 
 registers_router = APIRouter(prefix="/api/register", tags=["registers"])
 registers_router.include_router(_routes)
 registers_router.include_router(_saved_routes, prefix="/saved", tags=["saved-registers"])
+registers_router.include_router(_job_routes, prefix="/jobs", tags=["batch-jobs"])
 
 __all__ = ["registers_router"]
@@ -0,0 +1,76 @@
+'''
+Author: nll
+Date: 2026-10-17
+Description: 批量任务API路由：提交后立即返回任务ID，进度与结果另行查询或流式获取
+'''
+from fastapi import APIRouter, Query
+from fastapi.responses import StreamingResponse
+
+from app.schemas.register_schemas import BatchRegisterReadRequest, BatchRegisterWriteRequestPipelined
+from app.controllers.batch_job_controller import BatchJobController
+from app.core.state import batch_jobs
+from app.api.registers.registers import register_controller
+
+router = APIRouter()
+batch_job_controller = BatchJobController(register_controller, batch_jobs)
+
+
+@router.post("/batch-read")
+async def submit_batch_read_job(request: BatchRegisterReadRequest):
+    """提交批量读取任务"""
+    return batch_job_controller.submit_batch_read(request)
+
+
+@router.post("/batch-write")
+async def submit_batch_write_job(request: BatchRegisterWriteRequestPipelined):
+    """提交批量写入任务"""
+    return batch_job_controller.submit_batch_write(request)
+
+
+@router.get("")
+def list_jobs():
+    """列出保留中的任务"""
+    return batch_job_controller.list_jobs()
+
+
+@router.get("/{job_id}")
+def get_job(job_id: str):
+    """任务状态与进度"""
+    return batch_job_controller.get_job(job_id).summary()
+
+
+@router.get("/{job_id}/results")
+def get_job_results(job_id: str, offset: int = Query(0, ge=0), limit: int = Query(None, ge=1)):
+    """已完成部分的结果"""
+    return batch_job_controller.get_results(job_id, offset, limit)
+
+
+@router.get("/{job_id}/stream")
+async def stream_job(job_id: str, offset: int = Query(0, ge=0, description="从第几个结果开始")):
+    """NDJSON 流：先输出 offset 之后已有的结果，再随任务推进输出结果与进度，任务结束时关闭"""
+    job = batch_job_controller.get_job(job_id)
+    return StreamingResponse(batch_job_controller.stream_ndjson(job, offset), media_type="application/x-ndjson")
+
+
+@router.post("/{job_id}/pause")
+async def pause_job(job_id: str):
+    """暂停任务（当前段完成后生效）"""
+    return batch_job_controller.control(job_id, "pause")
+
+
+@router.post("/{job_id}/resume")
+async def resume_job(job_id: str):
+    """继续已暂停的任务"""
+    return batch_job_controller.control(job_id, "resume")
+
+
+@router.post("/{job_id}/cancel")
+async def cancel_job(job_id: str):
+    """取消任务（当前段完成后生效，已完成的结果保留）"""
+    return batch_job_controller.control(job_id, "cancel")
+
+
+@router.delete("/{job_id}")
+async def delete_job(job_id: str):
+    """删除任务记录"""
+    return batch_job_controller.delete_job(job_id)
@@ -6,7 +6,8 @@ LastEditTime: 2025-10-10 15:14:13
 FilePath: \python_back\app\api\registers\registers.py
 Description: 这是默认设置,请设置`customMade`, 打开koroFileHeader查看配置 进行设置: https://github.com/OBKoro1/koro1FileHeader/wiki/%E9%85%8D%E7%BD%AE
 '''
-from fastapi import APIRouter, HTTPException, UploadFile, File
+from fastapi import APIRouter, HTTPException, UploadFile, File, Query
+from fastapi.responses import Response, StreamingResponse
 from pydantic import BaseModel
 from typing import Optional, List, Dict, Any, Tuple
 import openpyxl
@@ -16,20 +17,38 @@ import pandas as pd
 
 from app.schemas.register_schemas import (
     RegisterReadRequest, RegisterWriteRequest, SerialConnectionRequest, RegisterAccessResponse,
-    BatchRegisterReadRequest, BatchRegisterWriteRequest, BatchRegisterWriteRequestV2, BatchRegisterResponse
+    BatchRegisterReadRequest, BatchRegisterWriteRequest, BatchRegisterWriteRequestV2,
+    BatchRegisterWriteRequestPipelined, BatchRegisterResponse
+)
+from app.core.state import (
+    serial_helper, block_tuning, batch_write_window, register_cache, read_flights, register_watcher
 )
-from app.utils.serial_helper import SerialHelper
 from app.controllers.register_controller import RegisterController
+from app.utils.fast_response import FastJSONResponse
 
 router = APIRouter()
-serial_helper = SerialHelper()
-register_controller = RegisterController(serial_helper)
+register_controller = RegisterController(serial_helper, block_tuning, write_window=batch_write_window,
+                                         register_cache=register_cache, read_flights=read_flights)
+# 寄存器监视经控制器读取，与 HTTP 读取共用分块规划、单飞合并与缓存
+register_watcher.attach(register_controller.read_addresses, register_controller.resolve_register_names)
+
+NDJSON_MEDIA_TYPE = "application/x-ndjson"
+
+
+def _ndjson_response(stream) -> StreamingResponse:
+    return StreamingResponse(stream, media_type=NDJSON_MEDIA_TYPE)
+
+
+def _check_stream_verify(response_format: str, verify: bool) -> None:
+    # 回读校验需要全部写入结果，不能与流式输出同时使用
+    if response_format == "ndjson" and verify:
+        raise HTTPException(status_code=400, detail="format=ndjson 不支持 verify=true")
 
 
 @router.post("/read", response_model=RegisterAccessResponse)
-def read_register(request: RegisterReadRequest):
+async def read_register(request: RegisterReadRequest):
     """读取寄存器值"""
-    return register_controller.read_register_direct(request)
+    return await register_controller.read_register_direct(request)
 
 
 @router.get("/test")
@@ -57,6 +76,8 @@ def connect_serial(request: SerialConnectionRequest):
             port=request.com_num,
             baudrate=request.baud
         )
+        # 重新连接后设备状态未知，丢弃该端口的影子缓存
+        register_cache.clear(request.com_num)
         
         return {
             "status": 200,
@@ -90,8 +111,17 @@ async def write_register(request: RegisterWriteRequest):
 
 
 @router.post("/batch-read", response_model=BatchRegisterResponse)
-async def batch_read_registers(request: dict):
-    """批量读取寄存器 (手动验证)"""
+async def batch_read_registers(
+    request: dict,
+    response_format: str = Query("json", alias="format", pattern="^(json|raw|ndjson|columnar)$"),
+):
+    """批量读取寄存器 (手动验证)
+
+    format=raw 时返回打包的小端二进制（地址 u32 数组、值数组、状态数组），布局见 app/utils/register_values.py
+    format=ndjson 时每读完一块就输出该块寄存器的结果行，末行为汇总
+    format=columnar 时结果为列式（addresses / values / status 数组），适合上万个寄存器的批量读取
+    json 与 columnar 响应直接编码，不经过 response_model 的逐项校验
+    """
     # 手动验证
     addresses = request.get("addresses")
     size = request.get("size")
@@ -102,21 +132,143 @@ async def batch_read_registers(request: dict):
     if not isinstance(size, int):
         raise HTTPException(status_code=422, detail="Invalid 'size' field. Expected an integer.")
 
+    profile = request.get("profile")
+    if profile is not None and not isinstance(profile, str):
+        raise HTTPException(status_code=422, detail="Invalid 'profile' field. Expected a string.")
+
+    max_age = request.get("max_age")
+    if max_age is not None and (not isinstance(max_age, (int, float)) or max_age < 0):
+        raise HTTPException(status_code=422, detail="Invalid 'max_age' field. Expected a non-negative number.")
+
     # 构造一个符合 Pydantic 模型的对象，然后传递给控制器
-    validated_request = BatchRegisterReadRequest(addresses=addresses, size=size)
-    return await register_controller.batch_read_registers(validated_request)
+    validated_request = BatchRegisterReadRequest(addresses=addresses, size=size, profile=profile, max_age=max_age)
+    if response_format == "ndjson":
+        return _ndjson_response(register_controller.stream_batch_read(validated_request))
+    if response_format == "raw":
+        result = await register_controller.batch_read_registers_typed(validated_request)
+        return Response(
+            content=result.to_raw(),
+            media_type="application/octet-stream",
+            headers={
+                "X-Successful-Operations": str(result.successful),
+                "X-Failed-Operations": str(result.failed),
+                "X-Retries": str(result.retries),
+                "X-Recovery-Time-Ms": f"{result.recovery_time * 1000:.3f}",
+                "X-Shared-Round-Trips": str(result.shared_round_trips),
+            },
+        )
+    result = await register_controller.batch_read_registers_typed(validated_request)
+    return FastJSONResponse(register_controller.batch_read_content(result, columnar=response_format == "columnar"))
+
+
+@router.post("/read-plan")
+def get_read_plan(request: BatchRegisterReadRequest):
+    """查看批量读取的分块方案（不访问串口）"""
+    return register_controller.get_read_plan(request)
+
+
+@router.get("/device-profiles")
+def get_device_profiles():
+    """列出可用的设备读取配置"""
+    return [p.to_dict() for p in register_controller.device_profiles.values()]
+
+
+@router.get("/cache")
+def get_register_cache_stats():
+    """影子缓存命中/未命中等统计"""
+    return register_cache.stats()
+
+
+@router.delete("/cache")
+def clear_register_cache():
+    """清空影子缓存"""
+    register_cache.clear()
+    return {"status": 200, "message": "寄存器缓存已清空"}
+
+
+@router.get("/read-flights")
+def get_read_flights():
+    """同时进行的读取合并统计（共享的寄存器数、省去的设备往返次数）"""
+    return read_flights.stats()
+
+
+@router.get("/watches")
+def get_register_watches():
+    """寄存器监视（/ws/registers）的订阅数、节拍与推送统计"""
+    return register_watcher.stats()
+
+
+@router.get("/scheduler")
+def get_scheduler_stats():
+    """串口事务调度器计数、队列深度与各优先级的延迟分位数"""
+    return serial_helper.scheduler.stats()
+
+
+@router.get("/tuning")
+async def get_block_tuning():
+    """查看各端口学到的块大小、超时与吞吐（在事件循环中读取，与调节器的更新不并发）"""
+    return block_tuning.stats()
+
+
+@router.delete("/tuning")
+async def reset_block_tuning():
+    """清除当前端口学到的参数，下次批量读取从设备配置重新开始"""
+    await block_tuning.reset()
+    return {"status": 200, "message": "调优参数已清除"}
 
 
 @router.post("/batch-write", response_model=BatchRegisterResponse)
-async def batch_write_registers(request: BatchRegisterWriteRequest):
-    """批量写入寄存器"""
-    return await register_controller.batch_write_registers(request)
+async def batch_write_registers(
+    request: BatchRegisterWriteRequest,
+    verify: bool = Query(False, description="写入后回读校验"),
+    verify_retries: int = Query(2, ge=0, le=10, description="校验不一致时的最大重写轮数"),
+    response_format: str = Query("json", alias="format", pattern="^(json|ndjson)$"),
+):
+    """批量写入寄存器，verify=true 时写入后按连续块回读校验，format=ndjson 时按行输出结果"""
+    _check_stream_verify(response_format, verify)
+    if response_format == "ndjson":
+        return _ndjson_response(register_controller.stream_batch_write(request))
+    response = await register_controller.batch_write_registers(request)
+    if verify:
+        response = await register_controller.verify_batch_write(response, verify_retries)
+    return response
 
 
 @router.post("/batch-write-v2", response_model=BatchRegisterResponse)
-async def batch_write_registers_v2(request: BatchRegisterWriteRequestV2):
-    """批量写入寄存器V2（使用嵌套模型验证）"""
-    return await register_controller.batch_write_registers_v2(request)
+async def batch_write_registers_v2(
+    request: BatchRegisterWriteRequestV2,
+    verify: bool = Query(False, description="写入后回读校验"),
+    verify_retries: int = Query(2, ge=0, le=10, description="校验不一致时的最大重写轮数"),
+    response_format: str = Query("json", alias="format", pattern="^(json|ndjson)$"),
+):
+    """批量写入寄存器V2（使用嵌套模型验证），verify=true 时写入后回读校验，format=ndjson 时每确认一个输出一行"""
+    _check_stream_verify(response_format, verify)
+    if response_format == "ndjson":
+        return _ndjson_response(register_controller.stream_batch_write_v2(request))
+    response = await register_controller.batch_write_registers_v2(request)
+    if verify:
+        response = await register_controller.verify_batch_write(response, verify_retries)
+    return response
+
+
+@router.post("/batch-write-pipelined", response_model=BatchRegisterResponse)
+async def batch_write_registers_pipelined(
+    request: BatchRegisterWriteRequestPipelined,
+    verify: bool = Query(False, description="写入后回读校验"),
+    verify_retries: int = Query(2, ge=0, le=10, description="校验不一致时的最大重写轮数"),
+    response_format: str = Query("json", alias="format", pattern="^(json|ndjson)$"),
+):
+    """流水线批量写入（最多 window 条同时等待确认，每个操作的结果以实际确认为准），verify=true 时回读校验
+
+    format=ndjson 时确认陆续到达即分批输出结果行
+    """
+    _check_stream_verify(response_format, verify)
+    if response_format == "ndjson":
+        return _ndjson_response(register_controller.stream_batch_write_pipelined(request))
+    response = await register_controller.batch_write_registers_pipelined(request)
+    if verify:
+        response = await register_controller.verify_batch_write(response, verify_retries)
+    return response
 
 
 @router.post("/send-command")
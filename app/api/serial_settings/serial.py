@@ -1,13 +1,18 @@
+import os
+
 from fastapi import APIRouter, Depends, HTTPException
+from fastapi.responses import StreamingResponse
 from sqlalchemy.orm import Session
-from typing import List
+from typing import List, Optional
 
 from app.settings.database import get_db
 from app.schemas.serial_schemas import (
     SerialConfigCreate, SerialConfigUpdate, SerialConfigResponse,
-    SerialConfigList, SerialOpenRequest, SerialWriteRequest, SerialStatusResponse
+    SerialConfigList, SerialOpenRequest, SerialWriteRequest, SerialStatusResponse,
+    CaptureStartRequest, CaptureReplayRequest
 )
 from app.controllers.serial_controller import SerialController
+from app.core.state import serial_hub, ws_manager, serial_capture
 
 router = APIRouter()
 serial_controller = SerialController()
@@ -70,4 +75,87 @@ def get_status():
 @router.post("/write")
 def write_data(request: SerialWriteRequest):
     """写入数据"""
-    return serial_controller.write_data(request)
\ No newline at end of file
+    return serial_controller.write_data(request)
+
+
+@router.get("/stream-stats")
+def get_stream_stats():
+    """获取串口数据扇出状态：每个 /ws 订阅者的投递计数与每个连接的发送队列指标"""
+    return {
+        "hub": serial_hub.stats(),
+        "connections": ws_manager.stats(),
+    }
+
+
+def _to_us(seconds: Optional[float]) -> Optional[int]:
+    return None if seconds is None else int(seconds * 1_000_000)
+
+
+@router.get("/capture")
+def get_capture_status():
+    """获取抓包状态与分段列表"""
+    return serial_capture.stats()
+
+
+def _capture_directory(name: Optional[str]) -> str:
+    """把请求中的目录解析到抓包根目录（SERIAL_CAPTURE_DIR，缺省 captures）之下，
+    拒绝绝对路径和跳出根目录的路径，避免客户端在任意位置创建、写入或淘汰删除文件"""
+    root = os.path.realpath(os.getenv("SERIAL_CAPTURE_DIR") or "captures")
+    if not name:
+        return root
+    if os.path.isabs(name) or os.path.splitdrive(name)[0] or ".." in name.replace("\\", "/").split("/"):
+        raise HTTPException(status_code=400, detail="directory 只能是抓包根目录下的相对路径")
+    directory = os.path.realpath(os.path.join(root, name))
+    # 根目录内的符号链接也可能指向外部
+    if os.path.commonpath([root, directory]) != root:
+        raise HTTPException(status_code=400, detail="directory 只能是抓包根目录下的相对路径")
+    return directory
+
+
+@router.post("/capture/start")
+async def start_capture(request: CaptureStartRequest):
+    """开始把原始接收数据写入磁盘分段（目录限定在抓包根目录下）"""
+    directory = _capture_directory(request.directory)
+    try:
+        await serial_capture.start(directory)
+    except OSError as e:
+        raise HTTPException(status_code=500, detail=f"无法创建抓包目录: {e}")
+    return {"success": True, "directory": os.path.abspath(directory)}
+
+
+@router.post("/capture/stop")
+async def stop_capture():
+    """停止抓包并封存当前分段"""
+    await serial_capture.stop()
+    return {"success": True}
+
+
+@router.get("/capture/range")
+async def fetch_capture_range(start: Optional[float] = None, end: Optional[float] = None):
+    """以字节流返回时间范围内的原始数据（start/end 为 Unix 秒，按索引点向外取整）
+
+    分段列表与已写入长度在事件循环中确定并打开映射，之后的写入、封存与淘汰不影响本次读取。
+    """
+    if serial_capture.store is None:
+        raise HTTPException(status_code=404, detail="抓包未启用")
+    views = serial_capture.open_range(_to_us(start), _to_us(end))
+    return StreamingResponse(
+        serial_capture.stream_range(views),
+        media_type="application/octet-stream",
+    )
+
+
+@router.post("/capture/replay")
+async def start_capture_replay(request: CaptureReplayRequest):
+    """把时间范围内的抓包数据回放到 /ws 数据流"""
+    try:
+        serial_capture.start_replay(_to_us(request.start), _to_us(request.end), request.speed)
+    except ValueError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    return {"success": True}
+
+
+@router.delete("/capture/replay")
+async def cancel_capture_replay():
+    """取消正在进行的回放"""
+    return {"success": serial_capture.cancel_replay()}
@@ -0,0 +1,257 @@
+'''
+Author: nll
+Date: 2026-10-17
+Description: 批量任务引擎：批量读写在后台分段执行，可查询进度、流式获取结果、暂停/继续/取消
+'''
+import asyncio
+import logging
+import time
+import uuid
+from datetime import datetime
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, List, Optional, Sequence
+
+
+# 任务状态
+JOB_QUEUED = "queued"
+JOB_RUNNING = "running"
+JOB_PAUSED = "paused"
+JOB_COMPLETED = "completed"
+JOB_CANCELLED = "cancelled"
+JOB_FAILED = "failed"
+FINISHED_STATES = (JOB_COMPLETED, JOB_CANCELLED, JOB_FAILED)
+
+# execute(一段操作) -> 该段每个操作的结果字典（含 success 字段），顺序与输入一致
+ChunkExecutor = Callable[[Sequence[Any]], Awaitable[List[dict]]]
+
+
+class BatchJob:
+    """一个批量任务：待执行的操作、已完成的结果与状态。
+
+    结果按完成顺序追加到 results，流式读取方用偏移量续读；每次状态或结果变化
+    都会唤醒等待中的读取方。暂停与取消在两段之间生效，正在执行的一段会先完成；
+    暂停的任务不占并发名额，继续后如名额已满则回到 queued 等待。
+    """
+
+    def __init__(self, kind: str, items: Sequence[Any], execute: ChunkExecutor, chunk_size: int,
+                 meta: Optional[dict] = None):
+        self.job_id = uuid.uuid4().hex
+        self.kind = kind
+        self.meta = meta or {}
+        self.state = JOB_QUEUED
+        self.error: Optional[str] = None
+        self.results: List[dict] = []
+        self.successful = 0
+        self.failed = 0
+        self.created_at = datetime.now().isoformat()
+        self.started_at: Optional[str] = None
+        self.finished_at: Optional[str] = None
+        self.finished_monotonic: Optional[float] = None
+        self._items = items
+        self._execute = execute
+        self._chunk_size = max(1, chunk_size)
+        self._cancel = False
+        self._resume = asyncio.Event()
+        self._resume.set()
+        self._changed = asyncio.Event()
+        self._started = 0.0
+        self._elapsed = 0.0
+        self.task: Optional[asyncio.Task] = None
+
+    @property
+    def total(self) -> int:
+        return len(self._items)
+
+    @property
+    def finished(self) -> bool:
+        return self.state in FINISHED_STATES
+
+    def summary(self) -> dict:
+        elapsed = self._elapsed + (time.monotonic() - self._started if self.state == JOB_RUNNING else 0.0)
+        return {
+            "job_id": self.job_id,
+            "kind": self.kind,
+            "state": self.state,
+            "total": self.total,
+            "done": len(self.results),
+            "successful": self.successful,
+            "failed": self.failed,
+            "progress": round(len(self.results) / self.total, 4) if self.total else 1.0,
+            "elapsed_ms": round(elapsed * 1000, 3),
+            "error": self.error,
+            "created_at": self.created_at,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+            **self.meta,
+        }
+
+    def pause(self) -> None:
+        if self.state in (JOB_QUEUED, JOB_RUNNING):
+            self._resume.clear()
+            if self.state == JOB_RUNNING:
+                self._set_state(JOB_PAUSED)
+
+    def resume(self) -> None:
+        self._resume.set()
+        if self.state == JOB_PAUSED:
+            self._set_state(JOB_RUNNING)
+
+    def cancel(self) -> None:
+        if self.finished:
+            return
+        self._cancel = True
+        # 暂停中的任务也要醒来才能结束
+        self._resume.set()
+        if self.state == JOB_QUEUED:
+            self._finish(JOB_CANCELLED)
+
+    async def follow(self, offset: int = 0, max_items: int = 1000) -> AsyncIterator[dict]:
+        """依次产出从 offset 起的结果段与进度，任务结束时以 end 消息结束"""
+        last_progress = None
+        while True:
+            changed = self._changed
+            if offset < len(self.results):
+                chunk = self.results[offset:offset + max_items]
+                yield {"type": "results", "job_id": self.job_id, "offset": offset, "results": chunk}
+                offset += len(chunk)
+                continue
+            summary = self.summary()
+            if self.finished:
+                yield {"type": "end", **summary}
+                return
+            progress = (summary["state"], summary["done"])
+            if progress != last_progress:
+                last_progress = progress
+                yield {"type": "progress", **summary}
+            await changed.wait()
+
+    async def run(self, slots: asyncio.Semaphore) -> None:
+        """占用一个并发名额执行任务；暂停期间让出名额，排队中的任务可以先执行，继续时重新排队"""
+        holding = False
+        try:
+            await slots.acquire()
+            holding = True
+            if self._cancel:
+                self._finish(JOB_CANCELLED)
+                return
+            self.started_at = datetime.now().isoformat()
+            self._set_state(JOB_RUNNING)
+            for start in range(0, self.total, self._chunk_size):
+                if not self._resume.is_set():
+                    self._set_state(JOB_PAUSED)
+                    slots.release()
+                    holding = False
+                    await self._resume.wait()
+                    if not self._cancel:
+                        if slots.locked():
+                            self._set_state(JOB_QUEUED)
+                        await slots.acquire()
+                        holding = True
+                if self._cancel:
+                    self._finish(JOB_CANCELLED)
+                    return
+                if self.state != JOB_RUNNING:
+                    self._set_state(JOB_RUNNING)
+                chunk = self._items[start:start + self._chunk_size]
+                results = await self._execute(chunk)
+                ok = sum(1 for item in results if item.get("success"))
+                self.successful += ok
+                self.failed += len(results) - ok
+                self.results.extend(results)
+                self._notify()
+            self._finish(JOB_COMPLETED)
+        except asyncio.CancelledError:
+            self.error = "任务被中止"
+            self._finish(JOB_CANCELLED)
+        except Exception as e:
+            self.error = getattr(e, "detail", None) or str(e)
+            logging.warning(f"批量任务 {self.job_id} 失败: {self.error}")
+            self._finish(JOB_FAILED)
+        finally:
+            if holding:
+                slots.release()
+
+    def _set_state(self, state: str) -> None:
+        if self.state == JOB_RUNNING:
+            self._elapsed += time.monotonic() - self._started
+        if state == JOB_RUNNING:
+            self._started = time.monotonic()
+        self.state = state
+        self._notify()
+
+    def _finish(self, state: str) -> None:
+        if self.finished:
+            return
+        self._set_state(state)
+        self.finished_at = datetime.now().isoformat()
+        self.finished_monotonic = time.monotonic()
+        # 结束后不再需要待执行的操作
+        self._items = self._items[:len(self.results)]
+        self._notify()
+
+    def _notify(self) -> None:
+        self._changed.set()
+        self._changed = asyncio.Event()
+
+
+class BatchJobManager:
+    """批量任务注册表。
+
+    同时执行的任务数不超过 max_concurrent，其余排队；任务按 chunk_size 个操作一段提交给
+    串口调度器（批量优先级），段与段之间响应暂停与取消。已结束的任务保留 retention 秒，
+    总数超过 max_jobs 时先清理最早结束的任务。
+    """
+
+    def __init__(self, max_concurrent: int = 1, chunk_size: int = 256, retention: float = 3600.0,
+                 max_jobs: int = 100):
+        self.max_concurrent = max(1, max_concurrent)
+        self.chunk_size = max(1, chunk_size)
+        self.retention = retention
+        self.max_jobs = max(1, max_jobs)
+        self._jobs: Dict[str, BatchJob] = {}
+        self._slots: Optional[asyncio.Semaphore] = None
+
+    def submit(self, kind: str, items: Sequence[Any], execute: ChunkExecutor,
+               chunk_size: Optional[int] = None, meta: Optional[dict] = None) -> BatchJob:
+        """登记并启动任务（需在事件循环中调用）"""
+        self.prune()
+        if self._slots is None:
+            self._slots = asyncio.Semaphore(self.max_concurrent)
+        job = BatchJob(kind, items, execute, chunk_size or self.chunk_size, meta)
+        self._jobs[job.job_id] = job
+        job.task = asyncio.create_task(job.run(self._slots))
+        return job
+
+    def get(self, job_id: str) -> Optional[BatchJob]:
+        return self._jobs.get(job_id)
+
+    def list(self) -> List[BatchJob]:
+        self.prune()
+        return list(self._jobs.values())
+
+    def remove(self, job_id: str) -> bool:
+        job = self._jobs.pop(job_id, None)
+        if job is None:
+            return False
+        job.cancel()
+        return True
+
+    def prune(self) -> None:
+        now = time.monotonic()
+        finished = sorted((j for j in self._jobs.values() if j.finished),
+                          key=lambda j: j.finished_monotonic or 0.0)
+        for job in finished:
+            if now - (job.finished_monotonic or now) > self.retention:
+                del self._jobs[job.job_id]
+        excess = len(self._jobs) - self.max_jobs
+        for job in finished:
+            if excess <= 0:
+                break
+            if job.job_id in self._jobs:
+                del self._jobs[job.job_id]
+                excess -= 1
+
+    def stop(self) -> None:
+        """中止所有未结束的任务（应用关闭时）"""
+        for job in self._jobs.values():
+            if job.task is not None and not job.task.done():
+                job.task.cancel()
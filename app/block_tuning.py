@@ -0,0 +1,167 @@
+'''
+Author: nll
+Date: 2026-10-17
+Description: 按端口管理块大小/超时调节器，并按串口配置持久化学到的参数
+'''
+import asyncio
+import logging
+import time
+from typing import Dict, List, Optional, Tuple
+
+from app.settings.database import SessionLocal
+from app.models.port_tuning import PortTuning
+from app.utils.block_tuner import BlockTuner
+from app.utils.serial_helper import SerialHelper
+
+
+class BlockTuning:
+    """当前串口的调节器注册表。
+
+    调节器按端口名缓存；端口通过串口配置打开时（active_config_id），
+    首次使用从 port_tunings 表加载上次学到的参数，之后有变化时最多每 save_interval 秒写回一次。
+    数据库读写都在线程池中进行，不阻塞事件循环：加载完成前先用默认参数，
+    写回时在事件循环中取参数快照，由后台任务写入（同一时间只有一个写回任务）。
+    enabled 为 False 时返回固定参数的调节器（不学习、不持久化）。
+    """
+
+    def __init__(self, serial_helper: SerialHelper, enabled: bool = True, save_interval: float = 10.0,
+                 **tuner_options):
+        self._serial_helper = serial_helper
+        self.enabled = enabled
+        self.save_interval = save_interval
+        self._tuner_options = tuner_options
+        self._tuners: Dict[str, BlockTuner] = {}
+        self._config_ids: Dict[str, Optional[int]] = {}
+        self._saved_at: Dict[str, float] = {}
+        self._flush_task: Optional[asyncio.Task] = None
+
+    def _port(self) -> str:
+        serial = self._serial_helper._serial
+        return serial.port if serial is not None and serial.port else ""
+
+    def get(self, block_regs: int = 32) -> BlockTuner:
+        """取当前端口的调节器，block_regs 为没有历史参数时的起始块大小"""
+        if not self.enabled:
+            return BlockTuner(block_regs=block_regs, min_regs=block_regs, max_regs=block_regs,
+                              **{k: v for k, v in self._tuner_options.items() if k not in ("min_regs", "max_regs")})
+        port = self._port()
+        config_id = self._serial_helper.get_status().get("active_config_id")
+        tuner = self._tuners.get(port)
+        if tuner is None or self._config_ids.get(port) != config_id:
+            tuner = BlockTuner(block_regs=block_regs, **self._tuner_options)
+            self._tuners[port] = tuner
+            self._config_ids[port] = config_id
+            if config_id is not None:
+                self._start_load(port, tuner, config_id)
+        return tuner
+
+    def _start_load(self, port: str, tuner: BlockTuner, config_id: int) -> None:
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            # 没有事件循环（独立脚本）时直接加载
+            self._apply(port, tuner, self._load(config_id))
+            return
+        task = loop.create_task(asyncio.to_thread(self._load, config_id))
+        task.add_done_callback(lambda t: self._apply(port, tuner, t.result() if not t.cancelled() else None))
+
+    def _apply(self, port: str, tuner: BlockTuner, state: Optional[dict]) -> None:
+        # 加载期间已学到新参数或调节器已被替换时不再覆盖
+        if state and self._tuners.get(port) is tuner and not tuner.dirty:
+            tuner.load_state(state)
+
+    def _load(self, config_id: int) -> Optional[dict]:
+        try:
+            with SessionLocal() as db:
+                row = db.query(PortTuning).filter(PortTuning.serial_config_id == config_id).first()
+                if row is None:
+                    return None
+                return {field: getattr(row, field) for field in PortTuning.STATE_FIELDS}
+        except Exception as e:
+            logging.warning(f"加载串口调优参数失败: {e}")
+            return None
+
+    def save(self, force: bool = False) -> None:
+        """把有变化的调节器写回数据库（只保存通过串口配置打开的端口）。
+
+        在事件循环中调用时只取快照并交给后台任务写入，立即返回；上一次写回未完成时跳过，
+        参数仍标记为有变化，由之后的调用写回。
+        """
+        if self._flush_task is not None and not self._flush_task.done():
+            return
+        pending = self._collect(force)
+        if not pending:
+            return
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            self._write(pending)
+            return
+        self._flush_task = loop.create_task(asyncio.to_thread(self._write, pending))
+
+    async def flush(self) -> None:
+        """等待进行中的写回，并写回全部有变化的参数（应用关闭时）"""
+        if self._flush_task is not None:
+            await asyncio.gather(self._flush_task, return_exceptions=True)
+            self._flush_task = None
+        pending = self._collect(force=True)
+        if pending:
+            await asyncio.to_thread(self._write, pending)
+
+    def _collect(self, force: bool) -> List[Tuple[str, BlockTuner, int, dict]]:
+        """在事件循环中取需要写回的参数快照，并先清除变化标记"""
+        now = time.monotonic()
+        pending = []
+        for port, tuner in self._tuners.items():
+            config_id = self._config_ids.get(port)
+            if config_id is None or not tuner.dirty:
+                continue
+            if not force and now - self._saved_at.get(port, 0.0) < self.save_interval:
+                continue
+            pending.append((port, tuner, config_id, tuner.to_state()))
+            tuner.dirty = False
+            self._saved_at[port] = now
+        return pending
+
+    def _write(self, pending: List[Tuple[str, BlockTuner, int, dict]]) -> None:
+        """（线程池中）写入参数快照，失败的调节器重新标记为有变化"""
+        for port, tuner, config_id, state in pending:
+            try:
+                with SessionLocal() as db:
+                    row = db.query(PortTuning).filter(PortTuning.serial_config_id == config_id).first()
+                    if row is None:
+                        row = PortTuning(serial_config_id=config_id)
+                        db.add(row)
+                    for field, value in state.items():
+                        setattr(row, field, value)
+                    db.commit()
+            except Exception as e:
+                tuner.dirty = True
+                logging.warning(f"保存串口调优参数失败: {e}")
+
+    async def reset(self) -> None:
+        """丢弃当前端口的调节器与已保存的参数（在事件循环中调用，删除在线程池中进行）"""
+        port = self._port()
+        self._tuners.pop(port, None)
+        self._saved_at.pop(port, None)
+        config_id = self._config_ids.pop(port, None)
+        if config_id is None:
+            return
+        # 等进行中的写回结束，避免它在删除之后又写回旧参数
+        if self._flush_task is not None:
+            await asyncio.gather(self._flush_task, return_exceptions=True)
+        await asyncio.to_thread(self._delete, config_id)
+
+    def _delete(self, config_id: int) -> None:
+        with SessionLocal() as db:
+            db.query(PortTuning).filter(PortTuning.serial_config_id == config_id).delete()
+            db.commit()
+
+    def stats(self) -> dict:
+        return {
+            "enabled": self.enabled,
+            "ports": {
+                port: {"config_id": self._config_ids.get(port), **tuner.stats()}
+                for port, tuner in self._tuners.items()
+            },
+        }
@@ -0,0 +1,93 @@
+'''
+Author: nll
+Date: 2026-10-17
+Description: 批量任务控制器：把批量读写提交为后台任务，查询进度与结果、暂停/继续/取消
+'''
+import json
+from array import array
+from typing import AsyncIterator, List, Optional, Sequence
+
+from fastapi import HTTPException
+
+from app.batch_jobs import BatchJob, BatchJobManager
+from app.controllers.register_controller import RegisterController
+from app.schemas.register_schemas import BatchRegisterReadRequest, BatchRegisterWriteRequestPipelined
+from app.utils.register_values import parse_addresses
+from app.utils.serial_scheduler import PRIORITY_BULK
+
+
+class BatchJobController:
+    """批量任务控制器"""
+
+    def __init__(self, register_controller: RegisterController, jobs: BatchJobManager):
+        self.register_controller = register_controller
+        self.jobs = jobs
+
+    def _check_port(self) -> None:
+        serial = self.register_controller.serial_helper._serial
+        if not serial or not serial.is_open:
+            raise HTTPException(status_code=500, detail="提交批量任务失败: Serial port is not open.")
+
+    def submit_batch_read(self, request: BatchRegisterReadRequest) -> dict:
+        """提交批量读取任务：地址按段经读取规划分块读取，每段完成即可获取结果"""
+        try:
+            addresses = parse_addresses(request.addresses)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=f"地址格式错误: {e}")
+        self._check_port()
+        controller = self.register_controller
+
+        async def execute(chunk: Sequence[int]) -> List[dict]:
+            result = await controller.read_addresses(array("I", chunk), request.size, request.profile,
+                                                     request.max_age, priority=PRIORITY_BULK)
+            return result.to_results()
+
+        job = self.jobs.submit("read", addresses, execute, meta={"size": request.size})
+        return job.summary()
+
+    def submit_batch_write(self, request: BatchRegisterWriteRequestPipelined) -> dict:
+        """提交批量写入任务：每段按信用窗口流水线写入，结果以收到的确认为准"""
+        self._check_port()
+        controller = self.register_controller
+
+        async def execute(chunk: Sequence) -> List[dict]:
+            response = await controller.batch_write_registers_pipelined(
+                BatchRegisterWriteRequestPipelined(operations=list(chunk), window=request.window))
+            return response.results
+
+        job = self.jobs.submit("write", request.operations, execute, meta={"window": request.window})
+        return job.summary()
+
+    def get_job(self, job_id: str) -> BatchJob:
+        job = self.jobs.get(job_id)
+        if job is None:
+            raise HTTPException(status_code=404, detail=f"任务 {job_id} 不存在或已过期")
+        return job
+
+    def list_jobs(self) -> List[dict]:
+        return [job.summary() for job in self.jobs.list()]
+
+    def get_results(self, job_id: str, offset: int = 0, limit: Optional[int] = None) -> dict:
+        """已完成部分的结果（运行中也可获取）"""
+        job = self.get_job(job_id)
+        end = len(job.results) if limit is None else offset + limit
+        return {**job.summary(), "offset": offset, "results": job.results[offset:end]}
+
+    def control(self, job_id: str, action: str) -> dict:
+        """pause / resume / cancel"""
+        job = self.get_job(job_id)
+        if job.finished:
+            raise HTTPException(status_code=409, detail=f"任务已结束（{job.state}）")
+        getattr(job, action)()
+        return job.summary()
+
+    def delete_job(self, job_id: str) -> dict:
+        """删除任务记录，未结束的任务先取消"""
+        self.get_job(job_id)
+        self.jobs.remove(job_id)
+        return {"status": 200, "message": f"任务 {job_id} 已删除"}
+
+    async def stream_ndjson(self, job: BatchJob, offset: int = 0) -> AsyncIterator[bytes]:
+        """按行输出任务事件（results / progress / end），任务结束后关闭"""
+        async for event in job.follow(offset):
+            yield (json.dumps(event, ensure_ascii=False) + "\n").encode("utf-8")
@@ -5,72 +5,71 @@ LastEditors: nll
 LastEditTime: 2025-10-09 16:00:00
 Description: 寄存器控制器
 '''
-from typing import List, Optional
+from array import array
+from typing import AsyncIterator, Dict, Iterable, List, Optional, Tuple
 from sqlalchemy.orm import Session
 from fastapi import HTTPException
 from datetime import datetime
 import time
+import logging
 import pandas as pd
 import os
 import asyncio
 import io
+import json
 
 from app.models.register_log import RegisterLog
 from app.models.serial_config import SerialConfig
 from app.schemas.register_schemas import (
     RegisterLogResponse, RegisterLogList, RegisterReadRequest, 
     RegisterWriteRequest, RegisterAccessResponse, BatchRegisterReadRequest,
-    BatchRegisterWriteRequest, BatchRegisterWriteRequestV2, BatchRegisterResponse
+    BatchRegisterWriteRequest, BatchRegisterWriteRequestV2, BatchRegisterWriteRequestPipelined,
+    BatchRegisterResponse
 )
 from app.utils.serial_helper import SerialHelper
+from app.utils.response_framer import ReadResponseFramer, parse_read_response
+from app.utils.register_values import (
+    RegisterBlock, BatchReadResult, parse_hex, parse_addresses, format_address, format_value, format_int
+)
+from app.utils.read_planner import DeviceProfile, ReadPlan, load_profiles, plan_reads
+from app.block_tuning import BlockTuning
+from app.utils.block_tuner import BlockTuner
+from app.utils.register_cache import RegisterCache, classify_definitions
+from app.utils.read_flights import ReadFlights
+from app.utils.serial_scheduler import PRIORITY_INTERACTIVE, PRIORITY_POLL, PRIORITY_BULK, SerialTransaction
 
 
-def _group_contiguous_addresses(addresses: List[str], size: int, max_regs_per_block: int = 32) -> List[dict]:
-    """
-    将地址列表分组为连续的内存块，并遵守每个块的最大寄存器数量限制。
-    """
-    if not addresses:
-        return []
-
-    int_addresses = sorted([int(addr, 16) for addr in addresses])
+# 失败块二分重试：首层退避（秒）、退避上限与单个批次的重试总时长上限
+RECOVERY_BACKOFF = 0.02
+RECOVERY_BACKOFF_MAX = 1.0
+RECOVERY_BUDGET = 10.0
 
-    groups = []
-    if not int_addresses:
-        return []
-        
-    current_group = [int_addresses[0]]
 
-    for i in range(1, len(int_addresses)):
-        # 检查连续性和块大小限制
-        if int_addresses[i] == current_group[-1] + size and len(current_group) < max_regs_per_block:
-            current_group.append(int_addresses[i])
-        else:
-            groups.append(current_group)
-            current_group = [int_addresses[i]]
-    
-    groups.append(current_group)
-
-    blocks = []
-    for group in groups:
-        if not group: continue
-        start_address = group[0]
-        length = len(group) * size
-        original_addrs_in_block = [f"0x{addr:08X}" for addr in group]
-        blocks.append({
-            "start_address": f"0x{start_address:08X}",
-            "length": length,
-            "original_addresses": original_addrs_in_block
-        })
-        
-    return blocks
+def _parse_write(address_text: str, value_text: str) -> Tuple[int, int, int]:
+    """解析写操作为 (地址, 值, 字节宽度)，地址或值格式错误时抛出 ValueError"""
+    address = parse_hex(address_text)
+    value = parse_hex(value_text, "值")
+    return address, value, max(4, (value.bit_length() + 7) // 8)
 
 
 class RegisterController:
     """寄存器控制器"""
     
-    def __init__(self, serial_helper: SerialHelper):
+    def __init__(self, serial_helper: SerialHelper, block_tuning: Optional[BlockTuning] = None,
+                 write_window: int = 8, register_cache: Optional[RegisterCache] = None,
+                 read_flights: Optional[ReadFlights] = None):
         self.serial_helper = serial_helper
+        # 同时进行的读取中重叠的寄存器只读一次，结果按各自请求分发
+        self.read_flights = read_flights or ReadFlights()
+        # 影子缓存：所有经过控制器的读写都会更新它，读请求带 max_age 时可直接命中；未提供时关闭
+        self.register_cache = register_cache or RegisterCache(capacity=0)
+        # 不等待确认的批量写入同时在途的命令数，调度器在窗口内把连续命令合并为一次写入
+        self.write_window = max(1, write_window)
+        # 按端口学习块大小与超时；未提供时使用固定参数
+        self.block_tuning = block_tuning or BlockTuning(serial_helper, enabled=False)
         self.register_definitions = {}  # In-memory storage for register definitions
+        # 设备读取配置（块大小上限、命令开销等），DEVICE_PROFILES_FILE 可追加
+        self.device_profiles = load_profiles()
 
     def get_register_definitions(self):
         """获取当前加载的寄存器定义"""
@@ -184,10 +183,13 @@ class RegisterController:
                     all_definitions[sheet_name] = sheet_registers
             
             self.register_definitions = all_definitions  # Store parsed data in memory
+            # 按位域类型区分缓存失效规则（含 RO 位域的状态寄存器使用更短的 TTL）
+            self.register_cache.set_volatility(classify_definitions(all_definitions))
             return all_definitions
         except Exception as e:
             # Clear definitions on failure to avoid serving stale/bad data
             self.register_definitions = {}
+            self.register_cache.set_volatility({})
             raise HTTPException(status_code=500, detail=f"Failed to parse register file: {str(e)}")
 
     def get_register_logs(self, db: Session, skip: int = 0, limit: int = 100, 
@@ -205,53 +207,60 @@ class RegisterController:
             total=total
         )
 
-    def read_register_direct(self, request: RegisterReadRequest) -> RegisterAccessResponse:
-        """直接读取寄存器值（不涉及数据库）"""
+    async def read_register_direct(self, request: RegisterReadRequest) -> RegisterAccessResponse:
+        """(异步)直接读取寄存器值（不涉及数据库）"""
         try:
-            # 验证16进制地址格式
-            if not request.address.startswith('0x') and not request.address.startswith('0X'):
-                raise ValueError(f"地址必须以0x或0X开头，当前地址: {request.address}")
-            
-            # 移除0x前缀进行验证
-            hex_part = request.address[2:] if request.address.startswith('0x') else request.address[2:]
-            
-            # 验证是否为有效的16进制字符
-            if not all(c in '0123456789ABCDEFabcdef' for c in hex_part):
-                raise ValueError(f"地址包含非法字符，当前地址: {request.address}")
-            
-            address = int(request.address, 16)
-            
-            # # 在读取寄存器前，先清空串口缓冲区中的缓存数据
-            # if self.serial_helper._serial and self.serial_helper._serial.is_open:
-            #     print("读取寄存器前清空串口缓冲区...")
-            #     # 清空输入缓冲区，确保不会读取到之前的残留数据
-            #     self.serial_helper._serial.reset_input_buffer()
-            #     # 清空输出缓冲区，确保命令发送不会受到之前数据的影响
-            #     self.serial_helper._serial.reset_output_buffer()
-            #     # 短暂等待，确保缓冲区完全清空
-            #     time.sleep(0.02)
+            # 验证16进制地址格式，内部统一使用整数地址
+            address = parse_hex(request.address)
+
+            # 调用方接受一定时效的值时先查影子缓存
+            port = self._port_key()
+            read_started = time.monotonic()
+            if request.max_age:
+                cached = self.register_cache.get(port, address, request.size, request.max_age)
+                if cached is not None:
+                    raw, age = cached
+                    return RegisterAccessResponse(
+                        success=True,
+                        message=f"寄存器读取成功（缓存，{age * 1000:.0f} ms 前）",
+                        address=request.address,
+                        value=format_value(raw),
+                        access_type="READ",
+                        timestamp=datetime.now().isoformat()
+                    )
             
+            # 同一寄存器正在被其他请求读取时直接使用其结果
+            single = BatchReadResult(array("I", [address]), request.size)
+            flight, _, shared = self.read_flights.claim(port, request.size, [address], PRIORITY_INTERACTIVE)
+            for other_flight in shared:
+                other = await other_flight.future
+                if other is not None and not single.copy_from(other, [address]) and single.ok[0]:
+                    self.read_flights.record_saved(1)
+                    return RegisterAccessResponse(
+                        success=True,
+                        message=f"寄存器读取成功，读取{request.size}字节（共享读取）",
+                        address=request.address,
+                        value=format_value(single.values),
+                        access_type="READ",
+                        timestamp=datetime.now().isoformat()
+                    )
+
             # 构建读取命令，包含字节数
-            command = f"read {request.address} {request.size}"
-            # 刷新串口输入缓存区，防止读取到旧数据
-            self.serial_helper._serial.flushInput()
-            # 发送命令到串口
-            self.serial_helper.write_data(command, append_newline=True)
-            # 等待设备响应
-            time.sleep(0.1)  # 增加等待时间到0.1秒
-
-            # 尝试读取响应数据
+            command = f"read {format_address(address)} {request.size}"
+
+            # 经串口调度器发送命令并等待 OK，最多等待 1 秒
             try:
                 if self.serial_helper._serial and self.serial_helper._serial.is_open:
-                    response_data = self.serial_helper._serial.read(1024)
-                    print(f"读取到{response_data}")  # 调试信息
-                    if response_data:
-                        response_text = response_data.decode("utf-8", errors="ignore").strip()
-                        print(f":串口原始内容 {response_text}")  # 调试信息
-                        
-                        # 处理4字节的16进制返回值
-                        processed_value = self._process_hex_response(response_text, request.size)
-                        print(f":处理后值 {processed_value}")  # 调试信息
+                    response_data = await self.serial_helper.transact(command, timeout=1.0)
+                    logging.debug(f"读取到{response_data}")
+                    framer = parse_read_response(response_data, request.size) if response_data else None
+                    if framer is not None and framer.filled:
+                        if framer.filled == request.size:
+                            self.register_cache.put(port, address, framer.data, now=read_started)
+                            single.set_block(RegisterBlock(address, request.size, single.addresses), framer.data)
+                        # 只在返回给前端时格式化为16进制文本
+                        processed_value = format_value(framer.data[:framer.filled])
+                        logging.debug(f"处理后值 {processed_value}")
                         
                         return RegisterAccessResponse(
                             success=True,
@@ -262,8 +271,10 @@ class RegisterController:
                             timestamp=datetime.now().isoformat()
                         )
             except Exception as e:
-                print(f"读取响应时出错: {e}")  # 调试信息
-                pass
+                logging.debug(f"读取响应时出错: {e}")
+            finally:
+                # 读取不完整时等待者拿不到读取记录，会自行重读
+                self.read_flights.land(flight, single)
             
             # 如果没有读取到响应，返回默认值
             return RegisterAccessResponse(
@@ -280,49 +291,27 @@ class RegisterController:
         except Exception as e:
             raise HTTPException(status_code=500, detail=f"读取寄存器失败: {str(e)}")
 
-    def _process_hex_response(self, response_text: str, size: int) -> str:
-        """处理16进制响应数据"""
-        if not response_text:
-            return None
-        start_index = response_text.find(':') + 1
-        end_index = response_text.find('\r\nOK')
-        value = response_text[start_index:end_index]
-        value = '0x' + value.strip().upper()
-        print(f":匹配后的值 {value}")  # 调试信息
-        return value
-
-    async def write_register_direct(self, request: RegisterWriteRequest, wait_for_ok: bool = True) -> RegisterAccessResponse:
-        """(异步)直接写入寄存器值，可选是否等待OK"""
+    async def write_register_direct(self, request: RegisterWriteRequest, wait_for_ok: bool = True,
+                                    priority: int = PRIORITY_INTERACTIVE) -> RegisterAccessResponse:
+        """(异步)直接写入寄存器值，可选是否等待OK；批量接口逐个调用时以批量优先级排队"""
         try:
-            if not request.address.startswith('0x') and not request.address.startswith('0X'):
-                raise ValueError(f"地址必须以0x或0X开头，当前地址: {request.address}")
-            if not request.value.startswith('0x') and not request.value.startswith('0X'):
-                raise ValueError(f"值必须以0x或0X开头，当前值: {request.value}")
-
-            command = f"write {request.address} {request.value}"
+            address, value, width = _parse_write(request.address, request.value)
 
             if not self.serial_helper._serial or not self.serial_helper._serial.is_open:
                 raise ConnectionError("Serial port is not open.")
 
-            # 写入命令
-            await self.serial_helper.async_write(command)
+            # 写入命令（经串口调度器排队，保证与其他事务不交错），超时由该端口的实测延迟决定
+            tuner = self.block_tuning.get()
+            pending = self._submit_write(address, value, width, timeout=tuner.write_timeout(), priority=priority)
 
             if wait_for_ok:
-                # 使用健壮的读取循环等待 "OK"
-                response_buffer = bytearray()
-                terminator = b"OK\r\n"
-                start_time = time.time()
-                timeout = 3.0
-
-                while terminator not in response_buffer:
-                    if time.time() - start_time > timeout:
-                        raise TimeoutError("写入命令后等待OK响应超时")
-                    
-                    chunk = await self.serial_helper.async_read(64)
-                    if chunk:
-                        response_buffer.extend(chunk)
-                    else:
-                        await asyncio.sleep(0.01)
+                try:
+                    await pending.future
+                except TimeoutError:
+                    tuner.record_failure("error")
+                    raise TimeoutError("写入命令后等待OK响应超时")
+                tuner.record_write(pending.service_time)
+                self.block_tuning.save()
             
             return RegisterAccessResponse(
                 success=True,
@@ -338,161 +327,419 @@ class RegisterController:
         except Exception as e:
             raise HTTPException(status_code=500, detail=f"写入寄存器失败: {str(e)}")
 
-    async def batch_read_registers(self, request: BatchRegisterReadRequest) -> BatchRegisterResponse:
-        """批量读取寄存器 (异步优化版)"""
+    def get_device_profile(self, name: Optional[str]) -> DeviceProfile:
+        """按名称取设备读取配置，未指定时使用 default"""
+        profile = self.device_profiles.get(name or "default")
+        if profile is None:
+            raise HTTPException(status_code=400, detail=f"未知的设备配置: {name}")
+        return profile
+
+    def _current_baudrate(self) -> int:
+        serial = self.serial_helper._serial
+        return serial.baudrate if serial is not None and serial.baudrate else 115200
+
+    def plan_batch_read(self, addresses: Iterable[int], size: int, profile: Optional[str] = None) -> ReadPlan:
+        """按当前波特率、设备配置和该端口学到的块大小规划批量读取"""
+        device_profile = self.get_device_profile(profile)
+        tuner = self.block_tuning.get(device_profile.max_regs_per_block)
+        return plan_reads(addresses, size, device_profile.with_block_regs(tuner.block_regs),
+                          self._current_baudrate())
+
+    def get_read_plan(self, request: BatchRegisterReadRequest) -> dict:
+        """返回批量读取将采用的分块方案（不访问串口）"""
         try:
-            # The block size limit is now a safeguard, not the primary fix.
-            address_blocks = _group_contiguous_addresses(request.addresses, request.size)
-            
-            all_results_map = {}
-            successful_count = 0
-            failed_count = 0
+            addresses = parse_addresses(request.addresses)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=f"地址格式错误: {e}")
+        return self.plan_batch_read(addresses, request.size, request.profile).to_dict()
+
+    def _port_key(self) -> str:
+        serial = self.serial_helper._serial
+        return serial.port if serial is not None and serial.port else ""
+
+    def _submit_write(self, address: int, value: int, width: int, timeout: float,
+                      window: Optional[int] = None, priority: int = PRIORITY_INTERACTIVE) -> SerialTransaction:
+        """提交写命令并返回事务；确认后写穿/失效影子缓存（写入期间先失效，避免读到旧值）"""
+        port = self._port_key()
+        self.register_cache.invalidate(port, address)
+        # 之后的读取不再共享写入前已发出的读取
+        self.read_flights.forget(port, address)
+        tx = self.serial_helper.submit_transaction(f"write {format_address(address)} {format_int(value, width)}",
+                                                   timeout=timeout, window=window, priority=priority)
+
+        def _done(f: asyncio.Future) -> None:
+            # 不等待确认的调用方也由这里取走异常，避免未处理异常告警
+            if f.cancelled() or f.exception() is not None:
+                self.register_cache.invalidate(port, address)
+            else:
+                self.register_cache.written(port, address, value.to_bytes(width, "big"))
+
+        tx.future.add_done_callback(_done)
+        return tx
 
-            for block in address_blocks:
-                try:
-                    command = f"read {block['start_address']} {block['length']}"
-                    
-                    if not self.serial_helper._serial or not self.serial_helper._serial.is_open:
-                        raise ConnectionError("Serial port is not open.")
+    async def batch_read_registers(self, request: BatchRegisterReadRequest) -> BatchRegisterResponse:
+        """批量读取寄存器 (异步优化版)"""
+        result = await self.batch_read_registers_typed(request)
+        return BatchRegisterResponse(results=result.to_results(), **self.batch_read_summary(result))
+
+    @staticmethod
+    def batch_read_summary(result: BatchReadResult) -> dict:
+        """批量读取响应中除逐个结果以外的字段"""
+        successful = result.successful
+        failed = len(result.addresses) - successful
+        return {
+            "success": True,
+            "message": f"批量读取完成，成功 {successful} 个，失败 {failed} 个",
+            "total_operations": len(result.addresses),
+            "successful_operations": successful,
+            "failed_operations": failed,
+            "retries": result.retries,
+            "recovery_time_ms": round(result.recovery_time * 1000, 3),
+            "isolated_addresses": [format_address(a) for a in result.isolated],
+            "shared_round_trips": result.shared_round_trips,
+            "timestamp": datetime.now().isoformat(),
+        }
+
+    @classmethod
+    def batch_read_content(cls, result: BatchReadResult, columnar: bool = False) -> dict:
+        """批量读取的响应内容（已是 JSON 基本类型，配合 FastJSONResponse 跳过逐项校验）。
+
+        字段与 BatchRegisterResponse 一致；columnar 为 True 时 results 换成列式的 columns。
+        """
+        content = cls.batch_read_summary(result)
+        if columnar:
+            content["columns"] = result.to_columns()
+        else:
+            content["results"] = result.to_results()
+            content["mismatches"] = None
+            content["verify_rounds"] = 0
+        return content
 
-                    # --- CRITICAL FIX: Flush input buffer before writing ---
-                    await self.serial_helper.async_flush_input()
-                    
-                    await self.serial_helper.async_write(command)
-                    
-                    # --- Robust reading loop with terminator and timeout ---
-                    response_buffer = bytearray()
-                    terminator = b"OK\r\n"
-                    start_time = time.time()
-                    timeout = 3.0  # 3-second timeout for the entire block read
-
-                    while terminator not in response_buffer:
-                        if time.time() - start_time > timeout:
-                            raise TimeoutError(f"Timeout waiting for response terminator '{terminator.decode().strip()}'")
-                        
-                        chunk = await self.serial_helper.async_read(128)
-                        if chunk:
-                            response_buffer.extend(chunk)
-                        else:
-                            await asyncio.sleep(0.01)
-                    
-                    response_data = bytes(response_buffer)
-                    # --- End of robust reading loop ---
+    async def batch_read_registers_typed(self, request: BatchRegisterReadRequest) -> BatchReadResult:
+        """批量读取寄存器，返回列式结果（整数地址 + 原始字节值），由调用方决定输出格式"""
+        try:
+            addresses = parse_addresses(request.addresses)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=f"地址格式错误: {e}")
 
-                    if response_data:
-                        response_text = response_data.decode("utf-8", errors="ignore").strip()
-                        hex_body = self._process_merged_hex_response(response_text)
-                        
-                        expected_len = block['length'] * 2
-                        if len(hex_body) >= expected_len:
-                            hex_body = hex_body[:expected_len]
-                            
-                            for j, original_addr in enumerate(block['original_addresses']):
-                                start_idx = j * request.size * 2
-                                end_idx = start_idx + request.size * 2
-                                value = "0x" + hex_body[start_idx:end_idx].upper()
-                                
-                                all_results_map[original_addr] = {
-                                    "address": original_addr, "success": True, "value": value,
-                                    "message": "读取成功", "timestamp": datetime.now().isoformat()
-                                }
-                                successful_count += 1
-                        else:
-                            raise ValueError(f"Merged read response length mismatch. Expected {expected_len}, got {len(hex_body)}.")
-                    else:
-                        raise ValueError("No response from merged read.")
+        return await self._read_addresses(addresses, request.size, request.profile, request.max_age)
 
-                except Exception as e:
-                    for addr in block['original_addresses']:
-                        all_results_map[addr] = {
-                            "address": addr, "success": False, "value": None,
-                            "message": f"块读取失败: {str(e)}", "timestamp": datetime.now().isoformat()
-                        }
-                        failed_count += 1
-            
-            final_results = [all_results_map.get(addr) for addr in request.addresses if addr in all_results_map]
+    def stream_batch_read(self, request: BatchRegisterReadRequest) -> AsyncIterator[bytes]:
+        """批量读取的 NDJSON 流：按读取规划逐块读取，每块读完立即输出该块寄存器的结果行。
 
-            return BatchRegisterResponse(
-                success=True,
-                message=f"批量读取完成，成功 {successful_count} 个，失败 {failed_count} 个",
-                total_operations=len(request.addresses),
-                successful_operations=successful_count,
-                failed_operations=failed_count,
-                results=final_results,
-                timestamp=datetime.now().isoformat()
-            )
+        地址在开始读取前完成校验（格式错误直接返回 400）；服务端只保留当前块的结果，
+        结果行带请求中的序号 index，最后一行为汇总。
+        """
+        try:
+            addresses = parse_addresses(request.addresses)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=f"地址格式错误: {e}")
+        # 地址 -> 请求中的序号（重复地址输出多行）
+        positions: Dict[int, List[int]] = {}
+        for i, address in enumerate(addresses):
+            positions.setdefault(address, []).append(i)
+        plan = self.plan_batch_read(positions.keys(), request.size, request.profile)
+        totals = {"retries": 0, "recovery_time_ms": 0.0, "isolated_addresses": [], "shared_round_trips": 0}
+
+        async def batches() -> AsyncIterator[List[dict]]:
+            for block in plan.blocks:
+                result = await self._read_addresses(block.addresses, request.size, request.profile,
+                                                    request.max_age)
+                totals["retries"] += result.retries
+                totals["recovery_time_ms"] = round(totals["recovery_time_ms"] + result.recovery_time * 1000, 3)
+                totals["isolated_addresses"].extend(format_address(a) for a in result.isolated)
+                totals["shared_round_trips"] += result.shared_round_trips
+                lines = []
+                for address, item in zip(block.addresses, result.to_results()):
+                    for index in positions[address]:
+                        lines.append({"index": index, **item})
+                yield lines
+
+        return self._ndjson(batches(), "批量读取完成", totals)
+
+    @staticmethod
+    async def _ndjson(batches: AsyncIterator[List[dict]], title: str,
+                      extra: Optional[dict] = None) -> AsyncIterator[bytes]:
+        """把逐批产出的结果编码为 NDJSON：每批一次输出，结果行 type=result，末行 type=summary。
+
+        没有 index 的结果按产出顺序编号；中途出错时输出一行 type=error 后结束。
+        """
+        total = successful = 0
+        try:
+            async for items in batches:
+                lines = []
+                for item in items:
+                    if "index" not in item:
+                        item = {"index": total, **item}
+                    total += 1
+                    successful += 1 if item["success"] else 0
+                    lines.append(json.dumps({"type": "result", **item}, ensure_ascii=False))
+                if lines:
+                    yield ("\n".join(lines) + "\n").encode("utf-8")
+        except Exception as e:
+            error = getattr(e, "detail", None) or str(e)
+            logging.warning(f"流式批量操作中断: {error}")
+            yield (json.dumps({"type": "error", "message": error, "completed_operations": total},
+                              ensure_ascii=False) + "\n").encode("utf-8")
+            return
+        failed = total - successful
+        summary = {
+            "type": "summary", "success": True,
+            "message": f"{title}，成功 {successful} 个，失败 {failed} 个",
+            "total_operations": total, "successful_operations": successful, "failed_operations": failed,
+            **(extra or {}),
+            "timestamp": datetime.now().isoformat(),
+        }
+        yield (json.dumps(summary, ensure_ascii=False) + "\n").encode("utf-8")
+
+    async def read_addresses(self, addresses: array, size: int, profile: Optional[str] = None,
+                             max_age: Optional[float] = None, priority: int = PRIORITY_POLL) -> BatchReadResult:
+        """读取整数地址列表（寄存器监视、批量任务等内部调用方使用，不经过 HTTP 参数解析），默认按轮询优先级排队"""
+        return await self._read_addresses(addresses, size, profile, max_age, priority)
+
+    def resolve_register_names(self, names: Iterable[str]) -> Tuple[Dict[str, int], List[str]]:
+        """按已加载的寄存器定义把名称解析为地址，返回 ({名称: 地址}, 未找到的名称)。
+
+        名称可写作 "寄存器名" 或 "表名/寄存器名"，不带表名时取第一个同名寄存器。
+        """
+        resolved: Dict[str, int] = {}
+        unknown: List[str] = []
+        for name in names:
+            sheet, _, register = str(name).rpartition("/")
+            sheets = [self.register_definitions.get(sheet, {})] if sheet else self.register_definitions.values()
+            for registers in sheets:
+                definition = registers.get(register)
+                if definition is not None:
+                    resolved[name] = int(str(definition["address"]), 16)
+                    break
+            else:
+                unknown.append(name)
+        return resolved, unknown
+
+    async def _read_addresses(self, addresses: array, size: int, profile: Optional[str] = None,
+                              max_age: Optional[float] = None, priority: int = PRIORITY_BULK) -> BatchReadResult:
+        """按规划分块读取整数地址列表（失败块二分重试），返回列式结果。
+
+        max_age 非空时先用影子缓存中不超过该时效的值，只读取未命中的地址；
+        其他请求正在读取的地址等待其结果而不重复读取；读到的值回填缓存。
+        """
+        result = BatchReadResult(addresses, size)
+        port = self._port_key()
+        read_started = time.monotonic()
+        to_read = result.unique_addresses()
+        if max_age:
+            hits = []
+            misses = []
+            for address in to_read:
+                cached = self.register_cache.get(port, address, size, max_age)
+                if cached is None:
+                    misses.append(address)
+                else:
+                    hits.append((address, cached[0]))
+            result.set_cached(hits)
+            to_read = misses
+        if not to_read:
+            return result
+
+        # 单飞合并：其他请求正在读取的地址直接等它的结果，只读取剩下的地址
+        flight, owned, shared = self.read_flights.claim(port, size, to_read, priority)
+        try:
+            if owned:
+                # 按代价模型分块：空洞较小时多读几个字节比多一次往返更快，空洞字节读后丢弃
+                plan = self.plan_batch_read(owned, size, profile)
+                await self._read_plan(result, plan, priority)
+            self.read_flights.land(flight, result)
+            if shared:
+                # 省去的往返 = 全部自己读时的块数 - 实际读取的块数
+                saved = len(self.plan_batch_read(to_read, size, profile).blocks) - (len(plan.blocks) if owned else 0)
+                result.shared_round_trips = max(0, saved)
+                self.read_flights.record_saved(result.shared_round_trips)
+                for other_flight, addresses_shared in shared.items():
+                    other = await other_flight.future
+                    unread = addresses_shared if other is None else result.copy_from(other, addresses_shared)
+                    if unread:
+                        # 对方读取中断：这部分地址自己补读
+                        await self._read_plan(result, self.plan_batch_read(unread, size, profile), priority)
+
+            self.register_cache.put_many(port, result.iter_successful(), now=read_started)
+            return result
         except Exception as e:
             raise HTTPException(status_code=500, detail=f"批量读取时发生严重错误: {str(e)}")
+        finally:
+            self.read_flights.land(flight)
+            self.block_tuning.save()
 
-    def _process_merged_hex_response(self, response_text: str) -> str:
-        """从合并读取的多行响应中提取并拼接纯十六进制数据。"""
-        if not response_text:
-            return ""
-        
-        hex_parts = []
-        lines = response_text.splitlines() # 按行分割
-        
-        for line in lines:
-            line = line.strip()
-            if ":" in line:
-                # 提取冒号后面的部分
+    async def _read_plan(self, result: BatchReadResult, plan: ReadPlan, priority: int = PRIORITY_BULK) -> None:
+        """按规划逐块读取并写入 result，失败块二分重试；每块单独排队，更高优先级的命令可插在块之间"""
+        size = result.size
+        tuner = self.block_tuning.get(plan.profile.max_regs_per_block)
+        planned_regs = plan.profile.max_regs_per_block
+
+        for block in plan.blocks:
+            try:
+                # 调度器负责串行化、丢弃旧数据和等待终止符，超时由该端口的实测延迟决定
                 try:
-                    hex_value = line.split(":")[1].strip()
-                    # 移除可能存在的'0x'前缀
-                    if hex_value.lower().startswith('0x'):
-                        hex_value = hex_value[2:]
-                    hex_parts.append(hex_value)
-                except IndexError:
-                    continue # 忽略格式不正确的行
-        
-        # 将所有提取的十六进制部分拼接成一个长字符串
-        return "".join(hex_parts)
+                    framer, elapsed = await self._read_block(block, tuner.read_timeout(block.length), priority)
+                except TimeoutError:
+                    tuner.record_failure("timeout")
+                    raise
+
+                if framer.filled == block.length:
+                    result.set_block(block, framer.data)
+                    # 只有块达到本批规划时的上限才参与块大小探测
+                    full = tuner.block_regs == planned_regs and block.length >= planned_regs * size
+                    tuner.record_read(block.length, elapsed, full)
+                    continue
+
+                # 应答不完整：先保留已完整收到的寄存器，其余进入二分重试
+                tuner.record_failure("truncated")
+                missing = result.set_block(block, framer.data, framer.filled)
+                error = f"Merged read response length mismatch. Expected {block.length * 2}, got {framer.filled * 2}."
+            except ConnectionError as e:
+                result.fail_block(block, str(e))
+                continue
+            except Exception as e:
+                missing, error = block.addresses, str(e)
+
+            await self._recover_block(result, missing, error, tuner, priority)
+
+    async def _read_block(self, block: RegisterBlock, timeout: float,
+                          priority: int = PRIORITY_BULK) -> Tuple[ReadResponseFramer, Optional[float]]:
+        """发送一次块读取，返回解析结果与发送到应答的耗时；超时抛出 TimeoutError，串口未打开抛出 ConnectionError"""
+        if not self.serial_helper._serial or not self.serial_helper._serial.is_open:
+            raise ConnectionError("Serial port is not open.")
+        command = f"read {format_address(block.start)} {block.length}"
+        tx = self.serial_helper.submit_transaction(command, timeout=timeout, priority=priority)
+        response_data = await tx.future
+        # 与超时一致，耗时从命令发出算起，不含排队等待
+        elapsed = tx.service_time
+        if not response_data:
+            raise ValueError("No response from merged read.")
+        # 数据行直接解码进预分配缓冲区，不再整段 decode / splitlines
+        return parse_read_response(response_data, block.length), elapsed
+
+    async def _recover_block(self, result: BatchReadResult, addresses: array, error: str, tuner: BlockTuner,
+                             priority: int = PRIORITY_BULK) -> None:
+        """失败块二分重试：每半块单独重读，失败的一半继续二分，直到单个寄存器。
+
+        第 n 层重试前等待 RECOVERY_BACKOFF * 2^(n-1) 秒（上限 RECOVERY_BACKOFF_MAX），
+        单个寄存器再重试一次仍失败则记为问题地址。整个恢复过程不超过 RECOVERY_BUDGET 秒，
+        重试的失败不计入块大小调节（原因是个别寄存器而不是块大小）。
+        """
+        started = time.perf_counter()
+        deadline = time.monotonic() + RECOVERY_BUDGET
+        try:
+            await self._bisect(result, addresses, error, 1, tuner, deadline, priority)
+        finally:
+            result.recovery_time += time.perf_counter() - started
+
+    async def _bisect(self, result: BatchReadResult, addresses: array, error: str, depth: int,
+                      tuner: BlockTuner, deadline: float, priority: int = PRIORITY_BULK) -> None:
+        size = result.size
+        if len(addresses) == 1:
+            parts = [addresses]
+        else:
+            mid = len(addresses) // 2
+            parts = [addresses[:mid], addresses[mid:]]
+
+        for part in parts:
+            block = RegisterBlock(part[0], part[-1] + size - part[0], part)
+            if time.monotonic() >= deadline:
+                result.fail_block(block, f"重试时间用尽: {error}")
+                continue
+            await asyncio.sleep(min(RECOVERY_BACKOFF_MAX, RECOVERY_BACKOFF * 2 ** (depth - 1)))
+            result.retries += 1
+            try:
+                framer, elapsed = await self._read_block(block, tuner.read_timeout(block.length), priority)
+                missing = result.set_block(block, framer.data, framer.filled)
+                if not missing:
+                    # 只更新延迟估计，不参与块大小探测
+                    tuner.record_read(block.length, elapsed, full=False)
+                    continue
+                part_error = f"应答不完整，收到 {framer.filled} / {block.length} 字节"
+            except ConnectionError as e:
+                result.fail_block(block, str(e))
+                continue
+            except Exception as e:
+                missing, part_error = part, str(e)
+
+            if len(addresses) == 1:
+                # 单个寄存器已重试过仍失败：定位到问题地址
+                result.isolated.append(addresses[0])
+                result.fail_block(block, f"寄存器 {format_address(addresses[0])} 读取失败: {part_error}")
+            else:
+                await self._bisect(result, missing, part_error, depth + 1, tuner, deadline, priority)
 
     async def batch_write_registers(self, request: BatchRegisterWriteRequest) -> BatchRegisterResponse:
         """(异步优化, "火力全开"模式)批量写入寄存器"""
+        writes = self._submit_fire(request)
+
+        # --- 由于我们没有等待确认，所以只能假设所有操作都已“成功”发送 ---
+        results = self._fire_results(request)
         
-        # --- 清空一次缓冲区，为命令风暴做准备 ---
-        if self.serial_helper._serial and self.serial_helper._serial.is_open:
-            await self.serial_helper.async_flush_input()
+        return BatchRegisterResponse(
+            success=True,
+            message=f"批量写入命令已全部发送 ({len(writes)} 个)",
+            total_operations=len(writes),
+            successful_operations=len(writes),
+            failed_operations=0,
+            results=results,
+            timestamp=datetime.now().isoformat()
+        )
+
+    def _submit_fire(self, request: BatchRegisterWriteRequest) -> List[Tuple[int, int, int]]:
+        """校验并提交全部写命令（不等待确认），返回解析后的写操作"""
+        # 命令按提交顺序进入串口调度器，不等待确认；窗口内的连续命令由调度器合并为一次写入
+        if not self.serial_helper._serial or not self.serial_helper._serial.is_open:
+            raise HTTPException(status_code=500, detail="批量写入失败: Serial port is not open.")
 
-        tasks = []
+        tuner = self.block_tuning.get()
+        timeout = tuner.write_timeout()
+        writes = []
         for operation in request.operations:
             address = operation.get("address")
             value = operation.get("value")
             if address is None or value is None:
                 continue # 跳过无效操作
-            
-            write_request = RegisterWriteRequest(address=address, value=value)
-            # 创建一个不等待OK的任务
-            task = self.write_register_direct(write_request, wait_for_ok=False)
-            tasks.append(task)
-
-        # --- 并发执行所有写入任务 ---
-        await asyncio.gather(*tasks)
-
-        # --- 由于我们没有等待确认，所以只能假设所有操作都已“成功”发送 ---
-        results = [{
+            try:
+                writes.append(_parse_write(address, value))
+            except ValueError as e:
+                raise HTTPException(status_code=400, detail=f"地址或值格式错误: {e}")
+
+        for address, value, width in writes:
+            self._submit_write(address, value, width, timeout=timeout, window=self.write_window,
+                               priority=PRIORITY_BULK)
+        return writes
+
+    @staticmethod
+    def _fire_results(request: BatchRegisterWriteRequest) -> List[dict]:
+        timestamp = datetime.now().isoformat()
+        return [{
             "address": op.get("address"), "value": op.get("value"),
             "success": True, "message": "写入命令已发送",
-            "timestamp": datetime.now().isoformat()
+            "timestamp": timestamp
         } for op in request.operations]
+
+    async def batch_write_registers_v2(self, request: BatchRegisterWriteRequestV2) -> BatchRegisterResponse:
+        """(异步优化)批量写入寄存器V2（使用嵌套模型验证）"""
+        results = []
+        async for items in self._iter_writes_v2(request):
+            results.extend(items)
+        successful_count = sum(1 for item in results if item["success"])
+        failed_count = len(results) - successful_count
         
         return BatchRegisterResponse(
             success=True,
-            message=f"批量写入命令已全部发送 ({len(tasks)} 个)",
-            total_operations=len(tasks),
-            successful_operations=len(tasks),
-            failed_operations=0,
+            message=f"批量写入完成，成功 {successful_count} 个，失败 {failed_count} 个",
+            total_operations=len(request.operations),
+            successful_operations=successful_count,
+            failed_operations=failed_count,
             results=results,
             timestamp=datetime.now().isoformat()
         )
 
-    async def batch_write_registers_v2(self, request: BatchRegisterWriteRequestV2) -> BatchRegisterResponse:
-        """(异步优化)批量写入寄存器V2（使用嵌套模型验证）"""
-        results = []
-        successful_count = 0
-        failed_count = 0
-        
+    async def _iter_writes_v2(self, request: BatchRegisterWriteRequestV2) -> AsyncIterator[List[dict]]:
+        """逐个写入并等待确认，每完成一个产出一次结果"""
         for operation in request.operations:
             try:
                 write_request = RegisterWriteRequest(
@@ -500,37 +747,195 @@ class RegisterController:
                     value=operation.value
                 )
                 
-                await self.write_register_direct(write_request)
+                await self.write_register_direct(write_request, priority=PRIORITY_BULK)
                 
-                results.append({
+                yield [{
                     "address": operation.address,
                     "value": operation.value,
                     "success": True,
                     "message": "写入成功",
                     "timestamp": datetime.now().isoformat()
-                })
-                successful_count += 1
+                }]
                 
             except Exception as e:
-                failed_count += 1
-                results.append({
+                yield [{
                     "address": operation.address,
                     "value": operation.value,
                     "success": False,
                     "message": str(e),
                     "timestamp": datetime.now().isoformat()
-                })
-        
+                }]
+
+    async def batch_write_registers_pipelined(self, request: BatchRegisterWriteRequestPipelined) -> BatchRegisterResponse:
+        """(异步)流水线批量写入：最多 window 条写命令同时等待 OK，按顺序对应确认。
+
+        所有命令一次性提交给串口调度器，调度器在途命令达到 window 时暂停发送，
+        设备每返回一个 OK 就放行下一条，既不会冲垮设备的接收缓冲区，
+        又不必每条都等一个往返。每个操作的结果以实际收到的确认为准。
+        """
+        started = time.perf_counter()
+        entries = self._submit_pipelined(request)
+        results = []
+        async for items in self._iter_acks(entries):
+            results.extend(items)
+        elapsed = time.perf_counter() - started
+
+        successful_count = sum(1 for item in results if item["success"])
+        failed_count = len(results) - successful_count
         return BatchRegisterResponse(
             success=True,
-            message=f"批量写入完成，成功 {successful_count} 个，失败 {failed_count} 个",
-            total_operations=len(request.operations),
+            message=(f"流水线批量写入完成，成功 {successful_count} 个，失败 {failed_count} 个，"
+                     f"窗口 {request.window}，耗时 {elapsed * 1000:.1f} ms"),
+            total_operations=len(results),
             successful_operations=successful_count,
             failed_operations=failed_count,
             results=results,
             timestamp=datetime.now().isoformat()
         )
 
+    def _submit_pipelined(self, request: BatchRegisterWriteRequestPipelined) -> List[tuple]:
+        """一次性提交全部写命令，返回 (操作, Future 或 None, 格式错误)"""
+        if not self.serial_helper._serial or not self.serial_helper._serial.is_open:
+            raise HTTPException(status_code=500, detail="批量写入失败: Serial port is not open.")
+
+        tuner = self.block_tuning.get()
+        timeout = tuner.write_timeout()
+        entries = []
+        for operation in request.operations:
+            try:
+                address, value, width = _parse_write(operation.address, operation.value)
+            except ValueError as e:
+                entries.append((operation, None, f"地址或值格式错误: {e}"))
+                continue
+            future = self._submit_write(address, value, width, timeout=timeout, window=request.window,
+                                        priority=PRIORITY_BULK).future
+            entries.append((operation, future, None))
+        return entries
+
+    async def _iter_acks(self, entries: List[tuple]) -> AsyncIterator[List[dict]]:
+        """按提交顺序等待确认；已到达的确认合为一批产出，遇到尚未确认的命令前先交出已有结果"""
+        batch = []
+        # 同一批已到达的确认共用一个时间戳，只在真正等待过确认后重新取时间
+        timestamp = datetime.now().isoformat()
+        for operation, future, error in entries:
+            if future is not None:
+                waited = not future.done()
+                if batch and waited:
+                    yield batch
+                    batch = []
+                try:
+                    await future
+                except TimeoutError:
+                    error = "未收到OK确认（超时，之后的在途命令无法再对应确认）"
+                except Exception as e:
+                    error = str(e)
+                if waited:
+                    timestamp = datetime.now().isoformat()
+            batch.append({
+                "address": operation.address,
+                "value": operation.value,
+                "success": error is None,
+                "message": "写入成功" if error is None else error,
+                "timestamp": timestamp
+            })
+        if batch:
+            yield batch
+
+    def stream_batch_write(self, request: BatchRegisterWriteRequest) -> AsyncIterator[bytes]:
+        """"火力全开"写入的 NDJSON 流：命令全部提交后输出结果行（不等待确认）"""
+        self._submit_fire(request)
+
+        async def batches() -> AsyncIterator[List[dict]]:
+            yield self._fire_results(request)
+
+        return self._ndjson(batches(), "批量写入命令已全部发送")
+
+    def stream_batch_write_v2(self, request: BatchRegisterWriteRequestV2) -> AsyncIterator[bytes]:
+        """逐个确认写入的 NDJSON 流：每个操作确认后输出一行"""
+        return self._ndjson(self._iter_writes_v2(request), "批量写入完成")
+
+    def stream_batch_write_pipelined(self, request: BatchRegisterWriteRequestPipelined) -> AsyncIterator[bytes]:
+        """流水线写入的 NDJSON 流：命令在开始输出前全部提交，确认陆续到达时分批输出"""
+        entries = self._submit_pipelined(request)
+        return self._ndjson(self._iter_acks(entries), "流水线批量写入完成", {"window": request.window})
+
+    async def verify_batch_write(self, response: BatchRegisterResponse, retries: int = 2) -> BatchRegisterResponse:
+        """批量写入后回读校验：按批量读取的分块规则读回所有写成功的地址，逐个比较。
+
+        同一地址写入多次时以最后一次为准。不一致的地址重新写入并只回读这些地址，
+        最多 retries 轮；回读失败的地址记为未校验（verified 为 None），不重写。
+        """
+        started = time.perf_counter()
+        # 地址 -> (结果下标, 值, 宽度)，同一地址以最后一次写入为准
+        expected: Dict[int, Tuple[int, int, int]] = {}
+        for i, item in enumerate(response.results):
+            if not item.get("success") or item.get("address") is None:
+                continue
+            try:
+                address, value, width = _parse_write(item["address"], item["value"])
+            except (ValueError, TypeError):
+                continue
+            if address in expected:
+                response.results[expected[address][0]]["verified"] = None
+                response.results[expected[address][0]]["message"] += "（被后续写入覆盖，未单独校验）"
+            expected[address] = (i, value, width)
+
+        actual: Dict[int, Optional[bytes]] = {}
+        rounds = 0
+        pending = sorted(expected)
+        while pending:
+            mismatched = []
+            # 不同宽度的值分组回读，每组按连续块合并，每批只需少量块读取
+            for width in sorted({expected[a][2] for a in pending}):
+                group = array("I", (a for a in pending if expected[a][2] == width))
+                result = await self._read_addresses(group, width)
+                wanted = b"".join(expected[a][1].to_bytes(width, "big") for a in group)
+                for pos in result.mismatches(wanted):
+                    mismatched.append(group[pos])
+                for pos, address in enumerate(group):
+                    actual[address] = bytes(result.values[pos * width:(pos + 1) * width]) if result.ok[pos] else None
+            if not mismatched or rounds >= retries:
+                break
+            rounds += 1
+            await self._rewrite(mismatched, expected)
+            pending = sorted(mismatched)
+
+        mismatches = []
+        for address, (index, value, width) in expected.items():
+            item = response.results[index]
+            raw = actual.get(address)
+            wanted = format_int(value, width)
+            if raw is None:
+                item["verified"] = None
+                item["message"] += "（回读失败，未校验）"
+            elif raw == value.to_bytes(width, "big"):
+                item["verified"] = True
+            else:
+                item["verified"] = False
+                item["success"] = False
+                item["message"] = f"回读校验不一致: 期望 {wanted}，实际 {format_value(raw)}"
+                mismatches.append({"address": format_address(address), "expected": wanted,
+                                   "actual": format_value(raw)})
+
+        successful = sum(1 for item in response.results if item.get("success"))
+        response.successful_operations = successful
+        response.failed_operations = len(response.results) - successful
+        response.mismatches = mismatches
+        response.verify_rounds = rounds
+        response.message += (f"；回读校验 {len(expected)} 个地址，不一致 {len(mismatches)} 个，"
+                             f"重写 {rounds} 轮，耗时 {(time.perf_counter() - started) * 1000:.1f} ms")
+        return response
+
+    async def _rewrite(self, addresses: List[int], expected: Dict[int, Tuple[int, int, int]]) -> None:
+        """按信用窗口重新写入校验不一致的地址并等待确认"""
+        timeout = self.block_tuning.get().write_timeout()
+        futures = []
+        for address in addresses:
+            _, value, width = expected[address]
+            futures.append(self._submit_write(address, value, width, timeout=timeout, window=self.write_window,
+                                              priority=PRIORITY_BULK).future)
+        await asyncio.gather(*futures, return_exceptions=True)
+
     def update_log_response(self, db: Session, log_id: int, response: str, status: str = "success"):
         """更新日志响应（由 WebSocket 回调使用）"""
         log = db.query(RegisterLog).filter(RegisterLog.id == log_id).first()
@@ -10,18 +10,19 @@ from sqlalchemy.orm import Session
 from fastapi import HTTPException
 
 from app.models.serial_config import SerialConfig
+from app.models.port_tuning import PortTuning
 from app.schemas.serial_schemas import (
     SerialConfigCreate, SerialConfigUpdate, SerialConfigResponse,
     SerialConfigList, SerialOpenRequest, SerialWriteRequest, SerialStatusResponse
 )
-from app.utils.serial_helper import SerialHelper
+from app.core.state import serial_helper
 
 
 class SerialController:
     """串口控制器"""
     
     def __init__(self):
-        self.serial_helper = SerialHelper()
+        self.serial_helper = serial_helper
 
     def list_ports(self) -> List[str]:
         """列出可用串口"""
@@ -74,6 +75,7 @@ class SerialController:
         if not config:
             raise HTTPException(status_code=404, detail="配置不存在")
         
+        db.query(PortTuning).filter(PortTuning.serial_config_id == config_id).delete()
         db.delete(config)
         db.commit()
         return {"status": "ok", "message": "配置已删除"}
@@ -1,6 +1,81 @@
+import os
+
 from app.serial_manager import SerialManager
 from app.ws_manager import WebSocketManager
+from app.utils.serial_helper import SerialHelper
+from app.serial_hub import SerialHub
+from app.serial_capture import SerialCapture
+from app.block_tuning import BlockTuning
+from app.utils.register_cache import RegisterCache
+from app.utils.read_flights import ReadFlights
+from app.register_watch import RegisterWatcher
+from app.batch_jobs import BatchJobManager
 
 # 全局单例，供各模块导入使用（不改变原有逻辑，只抽离位置）
 serial_manager = SerialManager()
-ws_manager = WebSocketManager()
+# WS_QUEUE_SIZE / WS_SLOW_CLIENT_POLICY: 每个连接的发送队列上限与慢客户端策略
+# （drop_oldest / coalesce / disconnect）
+ws_manager = WebSocketManager(
+    max_queue=int(os.getenv("WS_QUEUE_SIZE", "256")),
+    slow_client_policy=os.getenv("WS_SLOW_CLIENT_POLICY", "drop_oldest"),
+)
+# 串口只能被一个对象持有：I/O 线程和接收缓冲区挂在这个实例上，各模块共用
+# SERIAL_MAX_IN_FLIGHT: 允许同时等待响应的命令数，1 为严格的一问一答
+# SERIAL_COALESCE_BYTES: 多条命令同时在途时合并为一次写入的最大字节数，0 关闭合并
+# SERIAL_BULK_MAX_WAIT_MS: 轮询/批量命令被更高优先级命令压住时的最长排队时间，超过后插队发送一条
+serial_helper = SerialHelper(
+    max_in_flight=int(os.getenv("SERIAL_MAX_IN_FLIGHT", "1")),
+    coalesce_bytes=int(os.getenv("SERIAL_COALESCE_BYTES", "4096")),
+    max_wait=float(os.getenv("SERIAL_BULK_MAX_WAIT_MS", "200")) / 1000.0,
+)
+# SERIAL_WRITE_WINDOW: 不等待确认的批量写入（/batch-write）同时在途的写命令数
+batch_write_window = int(os.getenv("SERIAL_WRITE_WINDOW", "8"))
+# 串口数据扇出中心：所有 /ws 连接共用一个读取任务
+# SERIAL_SCROLLBACK_LINES: 供后加入的 /ws 回放的历史行数，0 表示关闭
+serial_hub = SerialHub(
+    serial_helper,
+    scrollback_lines=int(os.getenv("SERIAL_SCROLLBACK_LINES", "50000")),
+)
+# 串口抓包：原始接收数据写入 mmap 分段文件，SERIAL_CAPTURE_DIR 非空时随应用启动
+serial_capture = SerialCapture(
+    serial_helper,
+    serial_hub,
+    segment_bytes=int(os.getenv("SERIAL_CAPTURE_SEGMENT_MB", "64")) * 1024 * 1024,
+    segment_seconds=float(os.getenv("SERIAL_CAPTURE_SEGMENT_SECONDS", "3600")),
+    max_total_bytes=int(os.getenv("SERIAL_CAPTURE_MAX_MB", "4096")) * 1024 * 1024,
+)
+# 批量读写的块大小与超时按端口在线学习，按串口配置持久化
+# SERIAL_ADAPTIVE_BLOCKS=0 关闭（固定使用设备配置的块大小和 3 秒超时）
+# SERIAL_ADAPTIVE_MAX_REGS: 块大小增长上限（寄存器个数）
+block_tuning = BlockTuning(
+    serial_helper,
+    enabled=os.getenv("SERIAL_ADAPTIVE_BLOCKS", "1") != "0",
+    max_regs=int(os.getenv("SERIAL_ADAPTIVE_MAX_REGS", "256")),
+)
+# 寄存器影子缓存：读请求带 max_age 时可直接命中
+# SERIAL_CACHE_SIZE: 缓存的寄存器个数上限（LRU），0 关闭
+# SERIAL_CACHE_TTL / SERIAL_CACHE_RO_TTL: 普通寄存器与含 RO 位域的状态寄存器的最长缓存秒数
+register_cache = RegisterCache(
+    capacity=int(os.getenv("SERIAL_CACHE_SIZE", "65536")),
+    ttl=float(os.getenv("SERIAL_CACHE_TTL", "5")),
+    ro_ttl=float(os.getenv("SERIAL_CACHE_RO_TTL", "0.5")),
+)
+# 同时进行的读取请求中重叠的寄存器只读一次（单飞合并）
+# SERIAL_READ_SINGLE_FLIGHT=0 关闭
+read_flights = ReadFlights(enabled=os.getenv("SERIAL_READ_SINGLE_FLIGHT", "1") != "0")
+# 寄存器监视（/ws/registers）：所有订阅按节拍合并读取，只推送变化的值
+# SERIAL_WATCH_TICK_MS: 调度节拍，监视周期向上取整为节拍的整数倍
+# SERIAL_WATCH_MAX_REGISTERS: 单个监视集合的寄存器个数上限
+register_watcher = RegisterWatcher(
+    tick=float(os.getenv("SERIAL_WATCH_TICK_MS", "50")) / 1000.0,
+    max_registers=int(os.getenv("SERIAL_WATCH_MAX_REGISTERS", "4096")),
+)
+# 后台批量任务（/api/register/jobs）
+# SERIAL_JOB_CONCURRENCY: 同时执行的任务数；SERIAL_JOB_CHUNK: 每段操作数（暂停/取消在段之间生效）
+# SERIAL_JOB_RETENTION_S / SERIAL_JOB_MAX: 已结束任务的保留秒数与保留个数上限
+batch_jobs = BatchJobManager(
+    max_concurrent=int(os.getenv("SERIAL_JOB_CONCURRENCY", "1")),
+    chunk_size=int(os.getenv("SERIAL_JOB_CHUNK", "256")),
+    retention=float(os.getenv("SERIAL_JOB_RETENTION_S", "3600")),
+    max_jobs=int(os.getenv("SERIAL_JOB_MAX", "100")),
+)
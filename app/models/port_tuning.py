@@ -0,0 +1,33 @@
+'''
+Author: nll
+Date: 2026-10-17
+Description: 每个串口配置学到的批量读写参数（块大小、延迟估计等）
+'''
+from sqlalchemy import Column, Integer, Float, Boolean, DateTime, ForeignKey
+from sqlalchemy.sql import func
+from app.settings.database import Base
+
+
+class PortTuning(Base):
+    """串口读写调优参数表，与 serial_configs 一对一"""
+    __tablename__ = "port_tunings"
+
+    id = Column(Integer, primary_key=True, index=True)
+    serial_config_id = Column(Integer, ForeignKey("serial_configs.id", ondelete="CASCADE"),
+                              unique=True, nullable=False, comment="串口配置ID")
+    block_regs = Column(Integer, comment="每块寄存器数")
+    settled = Column(Boolean, default=False, comment="块大小是否已收敛")
+    throughput = Column(Float, comment="吞吐（字节/秒）")
+    avg_block_bytes = Column(Float, comment="平均块字节数")
+    read_srtt = Column(Float, comment="读取平滑延迟（秒）")
+    read_rttvar = Column(Float, comment="读取延迟偏差（秒）")
+    write_srtt = Column(Float, comment="写入平滑延迟（秒）")
+    write_rttvar = Column(Float, comment="写入延迟偏差（秒）")
+    reads = Column(Integer, default=0, comment="成功读取块数")
+    writes = Column(Integer, default=0, comment="成功写入数")
+    failures = Column(Integer, default=0, comment="失败次数")
+    timeouts = Column(Integer, default=0, comment="超时次数")
+    updated_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now(), comment="更新时间")
+
+    STATE_FIELDS = ("block_regs", "settled", "throughput", "avg_block_bytes", "read_srtt", "read_rttvar",
+                    "write_srtt", "write_rttvar", "reads", "writes", "failures", "timeouts")
@@ -0,0 +1,238 @@
+'''
+Author: nll
+Date: 2026-10-17
+Description: 寄存器监视：合并所有 WebSocket 客户端的监视集合，按节拍统一读取，只推送值变化的寄存器
+'''
+import asyncio
+import logging
+import math
+import time
+from array import array
+from datetime import datetime
+from typing import Any, Awaitable, Callable, Dict, Hashable, Iterable, List, Optional, Tuple, Union
+
+from app.utils.register_values import BatchReadResult, format_address, format_value, parse_hex
+
+
+# read(地址数组, 字节数) -> BatchReadResult；resolve(名称列表) -> ({名称: 地址}, 未找到的名称)
+ReadFunc = Callable[[array, int], Awaitable[BatchReadResult]]
+ResolveFunc = Callable[[List[str]], Tuple[Dict[str, int], List[str]]]
+
+
+class RegisterWatch:
+    """一个客户端的监视集合：地址、字节数、周期（秒）与上次推送的各寄存器状态"""
+
+    __slots__ = ("client", "watch_id", "addresses", "names", "size", "interval", "send",
+                 "next_due", "last", "seq")
+
+    def __init__(self, client: Hashable, watch_id: str, addresses: List[int], names: Dict[int, str],
+                 size: int, interval: float, send: Callable[[Dict[str, Any]], bool]):
+        self.client = client
+        self.watch_id = watch_id
+        self.addresses = addresses
+        self.names = names
+        self.size = size
+        self.interval = interval
+        self.send = send
+        self.next_due = 0.0
+        # 地址 -> 上次推送的值（原始字节）或失败原因（文本）
+        self.last: Dict[int, Union[bytes, str]] = {}
+        self.seq = 0
+
+
+class RegisterWatcher:
+    """寄存器监视调度器。
+
+    每个节拍收集到期的监视集合，按字节数合并所有地址后只读取一次（分块规划、与 HTTP 读取的
+    单飞合并、缓存回填都由读取函数完成），再与各集合上次推送的状态比较，只推送变化的寄存器。
+    周期向上取整为节拍的整数倍并对齐到节拍，周期成倍数关系的集合落在同一节拍上共享读取。
+    调度任务在第一个监视集合加入时启动，最后一个移除时结束。
+    """
+
+    def __init__(self, tick: float = 0.05, max_registers: int = 4096):
+        self.tick = tick
+        self.max_registers = max_registers
+        self._read: Optional[ReadFunc] = None
+        self._resolve: Optional[ResolveFunc] = None
+        self._watches: Dict[Tuple[Hashable, str], RegisterWatch] = {}
+        self._task: Optional[asyncio.Task] = None
+        self._wakeup: Optional[asyncio.Event] = None
+        self._stats = {"ticks": 0, "reads": 0, "registers_read": 0, "pushes": 0, "changes": 0,
+                       "overruns": 0, "errors": 0}
+        self._last_tick_ms = 0.0
+
+    def attach(self, read: ReadFunc, resolve: Optional[ResolveFunc] = None) -> None:
+        """绑定读取函数与寄存器名称解析函数（由寄存器控制器提供）"""
+        self._read = read
+        self._resolve = resolve
+
+    def watch(self, client: Hashable, watch_id: str, send: Callable[[Dict[str, Any]], bool],
+              addresses: Iterable[str] = (), names: Iterable[str] = (), size: int = 4,
+              interval_ms: float = 1000) -> Dict[str, Any]:
+        """新增或替换客户端的监视集合，返回确认消息；参数无效时抛出 ValueError"""
+        if self._read is None:
+            raise ValueError("寄存器读取未就绪")
+        if not isinstance(size, int) or not 1 <= size <= 8:
+            raise ValueError("size 必须为 1-8 的整数")
+        parsed = [parse_hex(a) for a in addresses]
+        resolved: Dict[str, int] = {}
+        unknown: List[str] = []
+        names = list(names)
+        if names:
+            if self._resolve is None:
+                raise ValueError("未加载寄存器定义")
+            resolved, unknown = self._resolve(names)
+        unique = sorted(set(parsed) | set(resolved.values()))
+        if not unique:
+            raise ValueError("监视集合为空")
+        if len(unique) > self.max_registers:
+            raise ValueError(f"单个监视集合最多 {self.max_registers} 个寄存器")
+
+        # 周期向上取整为节拍的整数倍，首次读取对齐到下一个节拍
+        ticks = max(1, math.ceil(float(interval_ms) / 1000.0 / self.tick - 1e-9))
+        watch = RegisterWatch(client, str(watch_id), unique, {a: n for n, a in resolved.items()},
+                              size, ticks * self.tick, send)
+        watch.next_due = math.ceil(time.monotonic() / self.tick) * self.tick
+        self._watches[(client, watch.watch_id)] = watch
+        self._ensure_task()
+        return {
+            "type": "watch_ack",
+            "id": watch.watch_id,
+            "count": len(unique),
+            "size": size,
+            "interval_ms": round(watch.interval * 1000, 3),
+            "names": {n: format_address(a) for n, a in resolved.items()},
+            "unknown": unknown,
+        }
+
+    def unwatch(self, client: Hashable, watch_id: Optional[str] = None) -> int:
+        """移除客户端的一个（watch_id 为 None 时全部）监视集合，返回移除个数"""
+        keys = [k for k in self._watches if k[0] == client and (watch_id is None or k[1] == str(watch_id))]
+        for key in keys:
+            del self._watches[key]
+        return len(keys)
+
+    def resync(self, client: Hashable, watch_id: Optional[str] = None) -> int:
+        """丢弃已推送的状态，下次读取时推送完整快照（客户端丢消息后使用）"""
+        count = 0
+        for (owner, wid), watch in self._watches.items():
+            if owner == client and (watch_id is None or wid == str(watch_id)):
+                watch.last.clear()
+                count += 1
+        return count
+
+    def stop(self) -> None:
+        self._watches.clear()
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    def stats(self) -> Dict[str, Any]:
+        groups: Dict[int, set] = {}
+        for watch in self._watches.values():
+            groups.setdefault(watch.size, set()).update(watch.addresses)
+        return {
+            "running": self._task is not None and not self._task.done(),
+            "tick_ms": round(self.tick * 1000, 3),
+            "watches": len(self._watches),
+            "clients": len({k[0] for k in self._watches}),
+            "registers": sum(len(v) for v in groups.values()),
+            "subscribed_registers": sum(len(w.addresses) for w in self._watches.values()),
+            **self._stats,
+            "last_tick_ms": round(self._last_tick_ms, 3),
+        }
+
+    def _ensure_task(self) -> None:
+        if self._wakeup is None:
+            self._wakeup = asyncio.Event()
+        self._wakeup.set()
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+
+    async def _run(self) -> None:
+        try:
+            while self._watches:
+                now = time.monotonic()
+                due = [w for w in self._watches.values() if w.next_due <= now]
+                if due:
+                    started = time.perf_counter()
+                    await self._poll(due)
+                    self._last_tick_ms = (time.perf_counter() - started) * 1000
+                    self._stats["ticks"] += 1
+                    now = time.monotonic()
+                    for watch in due:
+                        watch.next_due += watch.interval
+                        # 读取耗时超过周期时跳过错过的节拍，保持对齐
+                        if watch.next_due <= now:
+                            skipped = math.ceil((now - watch.next_due) / watch.interval)
+                            watch.next_due += skipped * watch.interval
+                            self._stats["overruns"] += skipped
+                if not self._watches:
+                    break
+                delay = min(w.next_due for w in self._watches.values()) - time.monotonic()
+                if delay > 0:
+                    self._wakeup.clear()
+                    try:
+                        await asyncio.wait_for(self._wakeup.wait(), delay)
+                    except asyncio.TimeoutError:
+                        pass
+        except asyncio.CancelledError:
+            return
+        finally:
+            if self._task is asyncio.current_task():
+                self._task = None
+
+    async def _poll(self, due: List[RegisterWatch]) -> None:
+        """按字节数合并到期集合的地址，每组读取一次后分发给各集合"""
+        groups: Dict[int, set] = {}
+        for watch in due:
+            groups.setdefault(watch.size, set()).update(watch.addresses)
+        for size, addresses in groups.items():
+            error = None
+            result = None
+            try:
+                result = await self._read(array("I", sorted(addresses)), size)
+                self._stats["reads"] += 1
+                self._stats["registers_read"] += len(addresses)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                error = getattr(e, "detail", None) or str(e)
+                self._stats["errors"] += 1
+                logging.warning(f"寄存器监视读取失败: {error}")
+            for watch in due:
+                if watch.size == size and (watch.client, watch.watch_id) in self._watches:
+                    self._push(watch, result, error)
+
+    def _push(self, watch: RegisterWatch, result: Optional[BatchReadResult], error: Optional[str]) -> None:
+        changes = []
+        last = watch.last
+        for address in watch.addresses:
+            if result is not None:
+                raw, reason = result.lookup(address)
+            else:
+                raw, reason = None, error
+            state = raw if raw is not None else reason
+            if last.get(address) == state:
+                continue
+            last[address] = state
+            change = {"address": format_address(address),
+                      "value": format_value(raw) if raw is not None else None}
+            if raw is None:
+                change["error"] = reason
+            name = watch.names.get(address)
+            if name is not None:
+                change["name"] = name
+            changes.append(change)
+        if not changes:
+            return
+        watch.seq += 1
+        self._stats["pushes"] += 1
+        self._stats["changes"] += len(changes)
+        watch.send({
+            "type": "register_delta",
+            "id": watch.watch_id,
+            "seq": watch.seq,
+            "timestamp": datetime.now().isoformat(),
+            "changes": changes,
+        })
@@ -14,6 +14,7 @@ class RegisterReadRequest(BaseModel):
     """寄存器读请求"""
     address: str = Field(..., description="寄存器地址（16进制）", example="0x20470c04")
     size: int = Field(4, ge=1, le=8, description="读取字节数，默认4字节", example=4)
+    max_age: Optional[float] = Field(None, ge=0, description="可接受的缓存时效（秒），为空或 0 时总是读取设备")
 
 
 class RegisterWriteRequest(BaseModel):
@@ -64,6 +65,8 @@ class BatchRegisterReadRequest(BaseModel):
     """批量寄存器读请求"""
     addresses: List[str] = Field(..., min_items=1, description="寄存器地址列表")
     size: int = Field(4, ge=1, le=8, description="每个地址的读取字节数，默认4字节")
+    profile: Optional[str] = Field(None, description="设备读取配置名称，默认 default")
+    max_age: Optional[float] = Field(None, ge=0, description="可接受的缓存时效（秒），为空或 0 时总是读取设备")
 
 
 class BatchRegisterWriteRequest(BaseModel):
@@ -96,6 +99,23 @@ class BatchRegisterWriteRequestV2(BaseModel):
         }
 
 
+class BatchRegisterWriteRequestPipelined(BaseModel):
+    """流水线批量写请求：最多 window 条写命令同时等待确认"""
+    operations: List['BatchOperationItem'] = Field(..., min_items=1, description="写入操作列表")
+    window: int = Field(8, ge=1, le=256, description="同时等待OK确认的写命令数（信用窗口）")
+
+    class Config:
+        json_schema_extra = {
+            "example": {
+                "operations": [
+                    {"address": "0x20470c04", "value": "0xFFB25233"},
+                    {"address": "0x20470c08", "value": "0x12345678"}
+                ],
+                "window": 8
+            }
+        }
+
+
 class BatchOperationItem(BaseModel):
     """批量操作项"""
     address: str = Field(..., description="寄存器地址（16进制）", example="0x20470c04")
@@ -110,6 +130,12 @@ class BatchRegisterResponse(BaseModel):
     successful_operations: int
     failed_operations: int
     results: List[dict] = Field(..., description="每个操作的结果")
+    retries: int = Field(0, description="失败块二分重试发送的命令数")
+    recovery_time_ms: float = Field(0.0, description="失败块重试耗时（毫秒）")
+    isolated_addresses: List[str] = Field(default_factory=list, description="重试到单个寄存器仍失败的地址")
+    shared_round_trips: int = Field(0, description="与同时进行的其他读取共享结果而省去的设备往返次数")
+    mismatches: Optional[List[dict]] = Field(None, description="verify=true 时回读校验仍不一致的地址")
+    verify_rounds: int = Field(0, description="verify=true 时校验不一致后的重写轮数")
     timestamp: str
 
 
@@ -73,3 +73,15 @@ class SerialStatusResponse(BaseModel):
     port: Optional[str]
     baudrate: Optional[int]
     active_config_id: Optional[int]
+
+
+class CaptureStartRequest(BaseModel):
+    """开始抓包请求"""
+    directory: Optional[str] = Field(None, description="抓包根目录（SERIAL_CAPTURE_DIR，缺省 captures）下的相对子目录，缺省为根目录本身")
+
+
+class CaptureReplayRequest(BaseModel):
+    """抓包回放请求"""
+    start: Optional[float] = Field(None, description="起始时间（Unix 秒），缺省为最早")
+    end: Optional[float] = Field(None, description="结束时间（Unix 秒），缺省为最新")
+    speed: float = Field(1.0, ge=0, le=1000, description="回放倍速，0 表示全速")
@@ -0,0 +1,134 @@
+'''
+Author: nll
+Date: 2026-10-17
+Description: 串口抓包：持续把原始接收字节写入磁盘分段，并支持按时间回放
+'''
+import asyncio
+from typing import Any, AsyncIterator, Dict, List, Optional
+
+from app.serial_hub import SerialHub
+from app.utils.capture_store import CaptureStore, SegmentView, now_us
+from app.utils.serial_helper import SerialHelper
+
+
+class SerialCapture:
+    """挂在串口原始接收缓冲区上的抓包任务。
+
+    读取的是调度器分流之前的原始数据，寄存器应答与终端输出都会被完整保存。
+    回放时把数据按索引点的时间间隔重新投递给 SerialHub 的订阅者，
+    speed 为倍速，0 表示不等待、尽快发送。
+    """
+
+    def __init__(self, serial_helper: SerialHelper, serial_hub: SerialHub, **store_options):
+        self._serial_helper = serial_helper
+        self._serial_hub = serial_hub
+        self._store_options = store_options
+        self.store: Optional[CaptureStore] = None
+        self._task: Optional[asyncio.Task] = None
+        self._replay_task: Optional[asyncio.Task] = None
+        self._replay_progress: Dict[str, Any] = {}
+
+    @property
+    def running(self) -> bool:
+        return self._task is not None and not self._task.done()
+
+    async def start(self, directory: str) -> None:
+        """开始抓包，已在同一目录抓包时直接返回；加载已有分段（及恢复未封存分段）在线程中进行"""
+        if self.running and self.store is not None and self.store.directory == directory:
+            return
+        await self.stop()
+        self.store = await asyncio.to_thread(CaptureStore, directory, **self._store_options)
+        self._task = asyncio.create_task(self._run(self.store))
+
+    async def stop(self) -> None:
+        """停止抓包并等待当前分段封存完成，已写入的数据仍可查询和回放"""
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+        if self.store is not None:
+            await asyncio.wrap_future(self.store.close())
+
+    async def _run(self, store: CaptureStore) -> None:
+        try:
+            while True:
+                reader = self._serial_helper.open_raw_reader()
+                if reader is None:
+                    await asyncio.sleep(0.1)
+                    continue
+                try:
+                    while not reader.at_eof():
+                        data = await reader.read()
+                        if data:
+                            store.write(data)
+                finally:
+                    reader.close()
+        except asyncio.CancelledError:
+            return
+
+    def open_range(self, start_us: Optional[int], end_us: Optional[int]) -> List[SegmentView]:
+        """在事件循环中打开时间范围内各分段的只读映射，之后的写入、封存与淘汰不影响读取"""
+        if self.store is None:
+            raise ValueError("抓包未启用")
+        return self.store.open_range(start_us, end_us)
+
+    @staticmethod
+    async def stream_range(views: List[SegmentView], chunk_size: int = 64 * 1024) -> AsyncIterator[memoryview]:
+        """按块产出已打开映射中的数据（不拷贝），结束或中断时关闭映射"""
+        try:
+            for view in views:
+                for chunk in view.chunks(chunk_size=chunk_size):
+                    yield chunk
+        finally:
+            for view in views:
+                view.close()
+
+    def start_replay(self, start_us: Optional[int], end_us: Optional[int], speed: float = 1.0) -> None:
+        """把时间范围内的抓包数据回放到 /ws 数据流，同一时间只有一个回放任务"""
+        if self.store is None:
+            raise ValueError("抓包未启用")
+        self.cancel_replay()
+        views = self.store.open_range(start_us, end_us)
+        self._replay_progress = {"start_us": start_us, "end_us": end_us, "speed": speed,
+                                 "bytes": 0, "done": False}
+        self._replay_task = asyncio.create_task(self._replay(views, speed))
+
+    def cancel_replay(self) -> bool:
+        if self._replay_task is None or self._replay_task.done():
+            return False
+        self._replay_task.cancel()
+        return True
+
+    async def _replay(self, views: List[SegmentView], speed: float) -> None:
+        loop = asyncio.get_running_loop()
+        started = loop.time()
+        first_ts: Optional[int] = None
+        progress = self._replay_progress
+        try:
+            for view in views:
+                points = view.points
+                for i, (ts, offset) in enumerate(points):
+                    stop = points[i + 1][1] if i + 1 < len(points) else view.hi
+                    if first_ts is None:
+                        first_ts = ts
+                    if speed > 0:
+                        delay = (ts - first_ts) / 1_000_000 / speed - (loop.time() - started)
+                        if delay > 0:
+                            await asyncio.sleep(delay)
+                    for chunk in view.chunks(offset, stop):
+                        await self._serial_hub.publish(bytes(chunk))
+                        progress["bytes"] += len(chunk)
+                    if speed <= 0:
+                        # 全速回放时也让出事件循环，避免饿死其他任务
+                        await asyncio.sleep(0)
+        finally:
+            for view in views:
+                view.close()
+            progress["done"] = True
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "running": self.running,
+            "store": self.store.info() if self.store is not None else None,
+            "replay": self._replay_progress or None,
+            "now_us": now_us(),
+        }
@@ -0,0 +1,273 @@
+'''
+Author: nll
+Date: 2026-10-17
+Description: 串口数据扇出中心
+'''
+import asyncio
+import codecs
+import struct
+import time
+from typing import Any, Callable, Dict, List, Optional, Union
+
+from app.utils.scrollback import LineAssembler, ScrollbackBuffer
+from app.utils.serial_helper import SerialHelper
+from app.utils.triggers import TriggerMatcher
+
+
+STREAM_MODE_JSON = "json"
+STREAM_MODE_BINARY = "binary"
+
+# 二进制帧头（小端）：序号 u32、首字节到达时间 u64（Unix 微秒）、负载长度 u32，之后是原始字节
+STREAM_FRAME_HEADER = struct.Struct("<IQI")
+
+
+def encode_stream_frame(sequence: int, timestamp_us: int, payload: bytes) -> bytes:
+    """编码一个二进制终端数据帧"""
+    return STREAM_FRAME_HEADER.pack(sequence & 0xFFFFFFFF, timestamp_us, len(payload)) + payload
+
+
+class HubSubscriber:
+    """一个串口数据订阅者及其投递计数
+
+    send 只负责把消息交给订阅者自己的发送队列，返回是否被接收，不能阻塞。
+    json 模式每段数据发送一条 {"type": "serial", "payload": text}；
+    binary 模式在 window 秒或 max_bytes 字节内合并数据，以二进制帧发送。
+    filtered 为 True 时只投递命中自己触发规则的完整行。
+    """
+
+    def __init__(
+        self,
+        name: str,
+        send: Callable[[Union[Dict[str, Any], bytes]], bool],
+        mode: str = STREAM_MODE_JSON,
+        window: float = 0.016,
+        max_bytes: int = 64 * 1024,
+    ):
+        if mode not in (STREAM_MODE_JSON, STREAM_MODE_BINARY):
+            raise ValueError(f"未知的流模式: {mode}")
+        self.name = name
+        self.mode = mode
+        self._send = send
+        self._window = window
+        self._max_bytes = max_bytes
+        self._pending = bytearray()
+        self._pending_since_us = 0
+        self._flush_handle: Optional[asyncio.TimerHandle] = None
+        self._sequence = 0
+        self.filtered = False
+        self.delivered = 0
+        self.dropped = 0
+        self.frames = 0
+
+    def deliver(self, data: bytes, text: str) -> None:
+        if self.mode == STREAM_MODE_JSON:
+            if text:
+                self._emit({"type": "serial", "payload": text})
+            return
+
+        if not self._pending:
+            self._pending_since_us = time.time_ns() // 1000
+        self._pending += data
+        if len(self._pending) >= self._max_bytes:
+            self.flush()
+        elif self._flush_handle is None:
+            self._flush_handle = asyncio.get_running_loop().call_later(self._window, self.flush)
+
+    def flush(self) -> None:
+        """立即发送已合并的数据"""
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+        while self._pending:
+            chunk = bytes(self._pending[:self._max_bytes])
+            del self._pending[:self._max_bytes]
+            self._emit(encode_stream_frame(self._sequence, self._pending_since_us, chunk))
+            self._sequence += 1
+            self.frames += 1
+
+    def close(self) -> None:
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+        self._pending.clear()
+
+    def _emit(self, message: Union[Dict[str, Any], bytes]) -> None:
+        try:
+            accepted = self._send(message)
+        except Exception:
+            accepted = False
+        if accepted:
+            self.delivered += 1
+        else:
+            self.dropped += 1
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "name": self.name,
+            "mode": self.mode,
+            "filtered": self.filtered,
+            "delivered": self.delivered,
+            "dropped": self.dropped,
+            "frames": self.frames,
+        }
+
+
+class SerialHub:
+    """串口数据扇出中心。
+
+    每个串口只有一个读取任务，读到的数据投递给所有订阅者（/ws 连接）。
+    读取任务随订阅者引用计数启停：第一个订阅者到来时启动，最后一个离开时停止；
+    调用 start() 后读取任务常驻，没有订阅者时滚动缓冲区也持续记录。
+
+    数据经增量解码后按行写入滚动缓冲区，新订阅者可以先回放任意序号之后的
+    历史行，再无缝切换到实时数据，不需要再次读取设备。
+
+    所有订阅者的触发规则登记在一个 TriggerMatcher 中，各规则独立匹配、互不遮挡，
+    命中事件只发给注册该规则的订阅者。
+    """
+
+    def __init__(self, serial_helper: SerialHelper, scrollback_lines: int = 50000):
+        self._serial_helper = serial_helper
+        self._subscribers: List[HubSubscriber] = []
+        self._reader_task: Optional[asyncio.Task] = None
+        self._pinned = False
+        self._assembler = LineAssembler()
+        self._line_seq = 0
+        self._matcher = TriggerMatcher()
+        self._external_decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+        self.scrollback: Optional[ScrollbackBuffer] = (
+            ScrollbackBuffer(scrollback_lines) if scrollback_lines > 0 else None)
+
+    @property
+    def subscriber_count(self) -> int:
+        return len(self._subscribers)
+
+    def subscribe(
+        self,
+        name: str,
+        send: Callable[[Union[Dict[str, Any], bytes]], bool],
+        mode: str = STREAM_MODE_JSON,
+        window: float = 0.016,
+        max_bytes: int = 64 * 1024,
+        since: Optional[int] = None,
+    ) -> HubSubscriber:
+        """注册订阅者，必要时启动读取任务。
+
+        since 不为 None 时先把滚动缓冲区中序号 >= since 的行（负数表示最近 -since 行）
+        以 replay 消息发给订阅者，最后发送 replay_end，之后才是实时数据。
+        回放与注册之间没有 await，不会漏掉或重复任何数据。
+        """
+        subscriber = HubSubscriber(name, send, mode=mode, window=window, max_bytes=max_bytes)
+        if since is not None:
+            self._replay(subscriber, since)
+        self._subscribers.append(subscriber)
+        self._ensure_reader()
+        return subscriber
+
+    def unsubscribe(self, subscriber: HubSubscriber) -> None:
+        """注销订阅者，没有订阅者时停止读取任务"""
+        subscriber.close()
+        self._matcher.remove_owner(subscriber)
+        if subscriber in self._subscribers:
+            self._subscribers.remove(subscriber)
+        if not self._subscribers and not self._pinned and self._reader_task is not None:
+            self._reader_task.cancel()
+            self._reader_task = None
+
+    def set_triggers(self, subscriber: HubSubscriber, specs: List[Dict[str, Any]],
+                     filtered: bool = False) -> int:
+        """替换订阅者的触发规则，返回规则条数；规则无效时抛出 ValueError"""
+        triggers = self._matcher.set_triggers(subscriber, specs)
+        subscriber.filtered = filtered and bool(triggers)
+        return len(triggers)
+
+    def start(self) -> None:
+        """让读取任务常驻（需在事件循环中调用）"""
+        self._pinned = True
+        self._ensure_reader()
+
+    def stop(self) -> None:
+        self._pinned = False
+        if self._reader_task is not None:
+            self._reader_task.cancel()
+            self._reader_task = None
+
+    def stats(self) -> Dict[str, Any]:
+        """读取任务状态、滚动缓冲区范围与每个订阅者的投递/丢弃计数"""
+        scrollback = None
+        if self.scrollback is not None:
+            scrollback = {
+                "capacity": self.scrollback.capacity,
+                "first_seq": self.scrollback.first_seq,
+                "next_seq": self.scrollback.next_seq,
+            }
+        return {
+            "running": self._reader_task is not None and not self._reader_task.done(),
+            "scrollback": scrollback,
+            "triggers": self._matcher.stats(),
+            "subscribers": [s.stats() for s in self._subscribers],
+        }
+
+    def _ensure_reader(self) -> None:
+        if self._reader_task is None or self._reader_task.done():
+            self._reader_task = asyncio.create_task(
+                self._serial_helper.start_reading(self._publish, raw=True))
+
+    def _replay(self, subscriber: HubSubscriber, since: int, max_chars: int = 64 * 1024) -> None:
+        """把历史行按约 max_chars 字符一批发给订阅者"""
+        if self.scrollback is None:
+            subscriber._emit({"type": "replay_end", "requested_seq": since,
+                              "first_seq": None, "next_seq": None, "partial": ""})
+            return
+        start, lines = self.scrollback.since(since)
+        batch: List[str] = []
+        batch_seq, size = start, 0
+        for line in lines:
+            batch.append(line)
+            size += len(line)
+            if size >= max_chars:
+                subscriber._emit({"type": "replay", "seq": batch_seq, "lines": batch})
+                batch_seq += len(batch)
+                batch, size = [], 0
+        if batch:
+            subscriber._emit({"type": "replay", "seq": batch_seq, "lines": batch})
+        subscriber._emit({
+            "type": "replay_end",
+            "requested_seq": since,
+            "first_seq": start,
+            "next_seq": self.scrollback.next_seq,
+            "partial": self._assembler.partial,
+        })
+
+    async def publish(self, data: bytes) -> None:
+        """把外部数据（如抓包回放）投递给所有订阅者，不写入滚动缓冲区"""
+        text = self._external_decoder.decode(data)
+        for subscriber in list(self._subscribers):
+            subscriber.deliver(data, text)
+
+    async def _publish(self, data: bytes) -> None:
+        # 每段数据只增量解码一次，由滚动缓冲区和所有 json 订阅者共用
+        text, lines = self._assembler.feed(data)
+        first_seq = self._line_seq
+        self._line_seq += len(lines)
+        if lines and self.scrollback is not None:
+            self.scrollback.extend(lines)
+
+        matched: Dict[HubSubscriber, List[int]] = {}
+        if lines and self._matcher:
+            for match in self._matcher.scan(lines):
+                owner = match.trigger.owner
+                owner._emit(match.to_event(first_seq + match.line_index))
+                if owner.filtered:
+                    indexes = matched.setdefault(owner, [])
+                    if not indexes or indexes[-1] != match.line_index:
+                        indexes.append(match.line_index)
+
+        for subscriber in list(self._subscribers):
+            if subscriber.filtered:
+                indexes = matched.get(subscriber)
+                if indexes:
+                    filtered_text = "".join(lines[i] for i in indexes)
+                    subscriber.deliver(filtered_text.encode("utf-8"), filtered_text)
+                continue
+            subscriber.deliver(data, text)
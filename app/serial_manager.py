@@ -1,7 +1,11 @@
 import asyncio
+import codecs
 import threading
 from typing import Optional, List, Dict
 
+from app.utils.ring_buffer import RingBuffer
+from app.utils.serial_io import SerialReaderThread
+
 try:
     import serial
     from serial.tools import list_ports
@@ -19,6 +23,8 @@ class SerialManager:
         self._lock = threading.Lock()
         self._reader_task: Optional[asyncio.Task] = None
         self._stop_event = asyncio.Event()
+        self._rx_ring: Optional[RingBuffer] = None
+        self._io_thread: Optional[SerialReaderThread] = None
 
     def list_ports(self) -> List[str]:
         if list_ports is None:
@@ -59,9 +65,18 @@ class SerialManager:
                 timeout=timeout,
             )
             self._stop_event = asyncio.Event()
+            self._rx_ring = RingBuffer()
+            self._io_thread = SerialReaderThread(self._serial, self._rx_ring)
+            self._io_thread.start()
 
     def close(self) -> None:
         with self._lock:
+            if self._io_thread:
+                self._io_thread.stop()
+                self._io_thread = None
+            if self._rx_ring:
+                self._rx_ring.close()
+                self._rx_ring = None
             if self._serial:
                 try:
                     self._serial.close()
@@ -93,28 +108,25 @@ class SerialManager:
         """
         try:
             while True:
-                await asyncio.sleep(0)  # 让出事件循环
                 with self._lock:
-                    ser = self._serial
+                    ring = self._rx_ring
 
-                if not ser or not ser.is_open:
+                if ring is None or ring.closed:
                     await asyncio.sleep(0.1)
                     continue
 
+                # 数据由 I/O 线程写入环形缓冲区，这里只在有数据时被唤醒
+                reader = ring.reader()
+                decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
                 try:
-                    data = ser.read(1024)
-                except Exception:
-                    await asyncio.sleep(0.05)
-                    continue
-
-                if data:
-                    try:
-                        text = data.decode("utf-8", errors="ignore")
-                    except Exception:
-                        text = ""
-                    if text:
-                        await ws_manager.broadcast({"type": "serial", "payload": text})
-                else:
-                    await asyncio.sleep(0.01)
+                    while not reader.at_eof():
+                        data = await reader.read(4096)
+                        if not data:
+                            continue
+                        text = decoder.decode(data)
+                        if text:
+                            await ws_manager.broadcast({"type": "serial", "payload": text})
+                finally:
+                    reader.close()
         except asyncio.CancelledError:
             return
@@ -0,0 +1,216 @@
+'''
+Author: nll
+Date: 2026-10-17
+Description: 按端口在线调整批量读取的块大小与超时：依据实测延迟、吞吐与失败情况
+'''
+import time
+from typing import Dict, Optional
+
+
+# 超时判定与 TCP RTO 相同：平滑延迟 + 4 倍平均偏差
+_ALPHA = 0.125
+_BETA = 0.25
+_RTO_K = 4.0
+# 连续超时时超时时间的最大放大倍数
+_MAX_BACKOFF = 16.0
+
+
+class LatencyEstimator:
+    """平滑往返延迟（srtt）与偏差（rttvar），据此给出超时"""
+
+    __slots__ = ("srtt", "rttvar", "samples")
+
+    def __init__(self, srtt: Optional[float] = None, rttvar: Optional[float] = None, samples: int = 0):
+        self.srtt = srtt
+        self.rttvar = rttvar
+        self.samples = samples
+
+    def add(self, elapsed: float) -> None:
+        if self.srtt is None:
+            self.srtt, self.rttvar = elapsed, elapsed / 2
+        else:
+            self.rttvar = (1 - _BETA) * self.rttvar + _BETA * abs(self.srtt - elapsed)
+            self.srtt = (1 - _ALPHA) * self.srtt + _ALPHA * elapsed
+        self.samples += 1
+
+    def timeout(self, default: float, minimum: float, maximum: float) -> float:
+        if self.srtt is None:
+            return default
+        return min(maximum, max(minimum, self.srtt + _RTO_K * self.rttvar))
+
+
+class BlockTuner:
+    """单个端口的块大小与超时调节器。
+
+    块大小按吞吐爬山：在当前大小下积累 probe_samples 次成功后，吞吐（字节/秒，含命令开销）
+    不低于上一个大小时继续翻倍，明显下降时退回上一个大小并停止增长；
+    超时或应答不完整时立即减半，并重新开始探测。
+    读超时取平滑延迟 + 4 倍偏差（按块字节数相对平均块的比例放大），超时后加倍退避。
+    """
+
+    def __init__(
+        self,
+        block_regs: int = 32,
+        min_regs: int = 1,
+        max_regs: int = 256,
+        default_timeout: float = 3.0,
+        min_timeout: float = 0.2,
+        max_timeout: float = 10.0,
+        probe_samples: int = 4,
+    ):
+        self.min_regs = max(1, min_regs)
+        self.max_regs = max(self.min_regs, max_regs)
+        self.block_regs = min(self.max_regs, max(self.min_regs, block_regs))
+        self.default_timeout = default_timeout
+        self.min_timeout = min_timeout
+        self.max_timeout = max_timeout
+        self.probe_samples = probe_samples
+        self.read_latency = LatencyEstimator()
+        self.write_latency = LatencyEstimator()
+        self.backoff = 1.0
+        self.settled = False
+        self.throughput = 0.0
+        self.avg_block_bytes = 0.0
+        self.reads = 0
+        self.writes = 0
+        self.failures = 0
+        self.timeouts = 0
+        self.truncated = 0
+        self.last_change = time.time()
+        self._prev_regs: Optional[int] = None
+        self._prev_throughput = 0.0
+        self._window_bytes = 0
+        self._window_time = 0.0
+        self._window_samples = 0
+        self.dirty = False
+
+    # ---- 读取 ----
+
+    def read_timeout(self, block_bytes: int) -> float:
+        timeout = self.read_latency.timeout(self.default_timeout, self.min_timeout, self.max_timeout)
+        if self.read_latency.srtt is not None and self.avg_block_bytes > 0 and block_bytes > self.avg_block_bytes:
+            timeout *= block_bytes / self.avg_block_bytes
+        return min(self.max_timeout, timeout * self.backoff)
+
+    def record_read(self, block_bytes: int, elapsed: Optional[float], full: bool = True) -> None:
+        """记录一次成功的块读取，full 表示块达到了当前上限（只有这样的样本参与块大小探测）。
+
+        elapsed 为 None（没有有效的耗时样本）时只计数，不参与延迟估计与探测。
+        """
+        self.reads += 1
+        self.backoff = 1.0
+        if elapsed is None:
+            return
+        self.read_latency.add(elapsed)
+        self.avg_block_bytes = (block_bytes if self.avg_block_bytes == 0
+                                else (1 - _ALPHA) * self.avg_block_bytes + _ALPHA * block_bytes)
+        self.dirty = True
+        if not full:
+            return
+        self._window_bytes += block_bytes
+        self._window_time += elapsed
+        self._window_samples += 1
+        if self._window_samples >= self.probe_samples:
+            self._evaluate()
+
+    def record_failure(self, kind: str) -> None:
+        """记录失败：kind 为 timeout / truncated / error，前两种缩小块"""
+        self.failures += 1
+        self.dirty = True
+        if kind == "timeout":
+            self.timeouts += 1
+            self.backoff = min(self.backoff * 2, _MAX_BACKOFF)
+        elif kind == "truncated":
+            self.truncated += 1
+        else:
+            return
+        self._set_block_regs(max(self.min_regs, self.block_regs // 2))
+        self._prev_regs = None
+        self._prev_throughput = 0.0
+        self.settled = False
+
+    def _evaluate(self) -> None:
+        throughput = self._window_bytes / self._window_time if self._window_time > 0 else 0.0
+        self._window_bytes, self._window_time, self._window_samples = 0, 0.0, 0
+        self.throughput = throughput
+        if self.settled:
+            return
+        if self._prev_regs is not None and throughput < self._prev_throughput * 0.95:
+            # 变大后吞吐下降：退回并固定
+            self._set_block_regs(self._prev_regs)
+            self.settled = True
+            return
+        if self.block_regs >= self.max_regs:
+            self.settled = True
+            return
+        self._prev_regs, self._prev_throughput = self.block_regs, throughput
+        self._set_block_regs(min(self.max_regs, self.block_regs * 2))
+
+    def _set_block_regs(self, value: int) -> None:
+        if value != self.block_regs:
+            self.block_regs = value
+            self.last_change = time.time()
+            self._window_bytes, self._window_time, self._window_samples = 0, 0.0, 0
+
+    # ---- 写入 ----
+
+    def write_timeout(self) -> float:
+        return self.write_latency.timeout(self.default_timeout, self.min_timeout, self.max_timeout)
+
+    def record_write(self, elapsed: Optional[float]) -> None:
+        self.writes += 1
+        if elapsed is None:
+            return
+        self.write_latency.add(elapsed)
+        self.dirty = True
+
+    # ---- 状态 ----
+
+    def stats(self) -> dict:
+        return {
+            "block_regs": self.block_regs,
+            "settled": self.settled,
+            "read_timeout": round(self.read_timeout(int(self.avg_block_bytes)), 4),
+            "write_timeout": round(self.write_timeout(), 4),
+            "read_srtt": self.read_latency.srtt,
+            "write_srtt": self.write_latency.srtt,
+            "throughput_bps": round(self.throughput, 1),
+            "reads": self.reads,
+            "writes": self.writes,
+            "failures": self.failures,
+            "timeouts": self.timeouts,
+            "truncated": self.truncated,
+            "failure_rate": round(self.failures / (self.reads + self.failures), 4) if self.reads + self.failures else 0.0,
+        }
+
+    def to_state(self) -> dict:
+        """持久化字段（对应 PortTuning 表的列）"""
+        return {
+            "block_regs": self.block_regs,
+            "settled": self.settled,
+            "throughput": self.throughput,
+            "avg_block_bytes": self.avg_block_bytes,
+            "read_srtt": self.read_latency.srtt,
+            "read_rttvar": self.read_latency.rttvar,
+            "write_srtt": self.write_latency.srtt,
+            "write_rttvar": self.write_latency.rttvar,
+            "reads": self.reads,
+            "writes": self.writes,
+            "failures": self.failures,
+            "timeouts": self.timeouts,
+        }
+
+    def load_state(self, state: Dict) -> None:
+        """从持久化字段恢复，上次学到的参数作为本次起点"""
+        if state.get("block_regs"):
+            self.block_regs = min(self.max_regs, max(self.min_regs, int(state["block_regs"])))
+        self.settled = bool(state.get("settled"))
+        self.throughput = state.get("throughput") or 0.0
+        self.avg_block_bytes = state.get("avg_block_bytes") or 0.0
+        self.read_latency = LatencyEstimator(state.get("read_srtt"), state.get("read_rttvar"))
+        self.write_latency = LatencyEstimator(state.get("write_srtt"), state.get("write_rttvar"))
+        self.reads = state.get("reads") or 0
+        self.writes = state.get("writes") or 0
+        self.failures = state.get("failures") or 0
+        self.timeouts = state.get("timeouts") or 0
+        self.dirty = False
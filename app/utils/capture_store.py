@@ -0,0 +1,415 @@
+'''
+Author: nll
+Date: 2026-10-17
+Description: 串口抓包存储：mmap 追加写入的分段文件与稀疏时间索引
+'''
+import bisect
+import logging
+import mmap
+import os
+import struct
+import time
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Callable, Deque, Iterator, List, Optional, Tuple
+
+
+# 索引文件由定长记录组成（小端）：时间戳 u64（Unix 微秒）、段内偏移 u64
+INDEX_ENTRY = struct.Struct("<QQ")
+# 封存时追加的结束记录：时间戳为该值，偏移为分段的实际长度（没有它说明分段未正常封存）
+SEAL_MARK = 0xFFFFFFFFFFFFFFFF
+# 恢复未封存分段时向前扫描零填充尾部的块大小
+_RECOVER_CHUNK = 1024 * 1024
+SEGMENT_SUFFIX = ".bin"
+INDEX_SUFFIX = ".idx"
+
+
+def now_us() -> int:
+    return time.time_ns() // 1000
+
+
+def _log_failure(future: Future) -> None:
+    if not future.cancelled() and future.exception() is not None:
+        logging.error(f"抓包写盘失败: {future.exception()}")
+
+
+class CaptureSegment:
+    """一个抓包分段：原始字节文件 + 稀疏时间索引文件。
+
+    写入中的分段预先扩展到 capacity 并整体 mmap，写入只是一次内存拷贝；新索引点先放进
+    待写队列，由写盘线程调用 flush_index 落盘。封存时截断到实际长度，并在索引末尾写入
+    结束记录保存实际长度。
+    索引记录的是“该时刻写入的第一个字节的偏移”，按时间定位的精度取决于索引间隔。
+    """
+
+    def __init__(self, path: str, start_us: int):
+        self.path = path
+        self.index_path = path[:-len(SEGMENT_SUFFIX)] + INDEX_SUFFIX
+        self.start_us = start_us
+        self.end_us = start_us
+        self.length = 0
+        self.sealed = True
+        self._ts: List[int] = []
+        self._offsets: List[int] = []
+        self._mm: Optional[mmap.mmap] = None
+        self._fd: Optional[int] = None
+        self._index_file = None
+        self._pending_index: Deque[bytes] = deque()
+        self._capacity = 0
+
+    @classmethod
+    def create(cls, directory: str, start_us: int, capacity: int) -> "CaptureSegment":
+        path = os.path.join(directory, f"capture-{start_us}{SEGMENT_SUFFIX}")
+        segment = cls(path, start_us)
+        segment._fd = os.open(path, os.O_RDWR | os.O_CREAT | os.O_TRUNC, 0o644)
+        os.ftruncate(segment._fd, capacity)
+        segment._mm = mmap.mmap(segment._fd, capacity)
+        segment._index_file = open(segment.index_path, "wb", buffering=0)
+        segment._capacity = capacity
+        segment.sealed = False
+        return segment
+
+    @classmethod
+    def load(cls, path: str) -> Optional["CaptureSegment"]:
+        """加载已封存（或异常退出时未封存）的分段，文件名无法识别时返回 None"""
+        name = os.path.basename(path)
+        try:
+            start_us = int(name[len("capture-"):-len(SEGMENT_SUFFIX)])
+        except ValueError:
+            return None
+        segment = cls(path, start_us)
+        size = os.path.getsize(path)
+        entries = []
+        if os.path.exists(segment.index_path):
+            with open(segment.index_path, "rb") as f:
+                raw = f.read()
+            usable = len(raw) - len(raw) % INDEX_ENTRY.size
+            entries = list(INDEX_ENTRY.iter_unpack(raw[:usable]))
+        if entries and entries[-1][0] == SEAL_MARK:
+            length = min(entries.pop()[1], size)
+        else:
+            length = segment._recover(size, entries)
+        if size > length:
+            # 未封存或封存时截断失败的分段：去掉预扩展的尾部
+            with open(path, "r+b") as f:
+                f.truncate(length)
+        segment.length = length
+        for ts, offset in entries:
+            if ts == SEAL_MARK or offset >= length:
+                break
+            segment._ts.append(ts)
+            segment._offsets.append(offset)
+        if segment._ts:
+            segment.end_us = segment._ts[-1]
+        return segment
+
+    def _recover(self, size: int, entries: List[Tuple[int, int]]) -> int:
+        """异常退出时未封存的分段：文件长度是预扩展的容量，实际长度取最后一个非零字节之后，
+        且不小于最后一个索引点的偏移（该索引点之后结尾处的 0 字节无法与填充区分，会被丢弃）。
+        恢复后补写结束记录，下次加载不再扫描。"""
+        floor = min(max((offset for ts, offset in entries if ts != SEAL_MARK), default=0), size)
+        length = floor
+        if size > floor:
+            with open(self.path, "rb") as f:
+                mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            try:
+                end = size
+                while end > floor:
+                    begin = max(floor, end - _RECOVER_CHUNK)
+                    tail = mm[begin:end].rstrip(b"\0")
+                    if tail:
+                        length = begin + len(tail)
+                        break
+                    end = begin
+            finally:
+                mm.close()
+        logging.warning(f"抓包分段 {os.path.basename(self.path)} 未正常封存，恢复长度 {length} 字节")
+        with open(self.index_path, "ab") as f:
+            f.write(INDEX_ENTRY.pack(SEAL_MARK, length))
+        return length
+
+    @property
+    def remaining(self) -> int:
+        return self._capacity - self.length
+
+    @property
+    def index_pending(self) -> bool:
+        return bool(self._pending_index)
+
+    def append(self, data: bytes, ts_us: int, index_interval_us: int) -> int:
+        """追加数据，返回实际写入的字节数（分段写满时可能小于 len(data)）"""
+        size = min(len(data), self.remaining)
+        if size <= 0:
+            return 0
+        if not self._ts or ts_us - self._ts[-1] >= index_interval_us:
+            self._ts.append(ts_us)
+            self._offsets.append(self.length)
+            self._pending_index.append(INDEX_ENTRY.pack(ts_us, self.length))
+        self._mm[self.length:self.length + size] = data[:size] if size < len(data) else data
+        self.length += size
+        self.end_us = ts_us
+        return size
+
+    def flush_index(self) -> None:
+        """把待写的索引记录写入索引文件（写盘线程调用，与 append 并发安全）"""
+        records = []
+        while self._pending_index:
+            records.append(self._pending_index.popleft())
+        if records and self._index_file is not None:
+            self._index_file.write(b"".join(records))
+
+    def seal(self) -> None:
+        """停止写入：释放映射并把文件截断到实际长度（调用前该分段不能再有 append）"""
+        if self.sealed:
+            return
+        self.sealed = True
+        self.flush_index()
+        # 不用 mmap.flush：它在持有 GIL 时执行 msync，会连带卡住事件循环；
+        # 共享映射写入的就是页缓存，解除映射后对文件 fsync（释放 GIL）同样会落盘
+        self._mm.close()
+        self._mm = None
+        try:
+            os.ftruncate(self._fd, self.length)
+        except OSError:
+            # Windows 下仍有读取方映射着文件时无法截断，下次加载时按结束记录截断
+            pass
+        os.fsync(self._fd)
+        os.close(self._fd)
+        self._fd = None
+        self._index_file.write(INDEX_ENTRY.pack(SEAL_MARK, self.length))
+        self._index_file.close()
+        self._index_file = None
+
+    def delete(self) -> bool:
+        """删除分段文件；POSIX 下读取方已打开的映射不受影响，
+        Windows 下文件仍被映射时删除失败，返回 False 由调用方稍后重试"""
+        self.seal()
+        deleted = True
+        for path in (self.path, self.index_path):
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            except OSError:
+                deleted = False
+        return deleted
+
+    def offset_range(self, start_us: Optional[int], end_us: Optional[int],
+                     index_interval_us: int = 0) -> Tuple[int, int]:
+        """把时间范围换算成段内字节范围（按索引点向外取整）。
+
+        索引点 k 之后、k+1 之前的字节写入于 [ts_k, ts_k + index_interval_us] 内。
+        """
+        lo, hi = 0, self.length
+        if start_us is not None and self._ts:
+            i = bisect.bisect_left(self._ts, start_us - index_interval_us)
+            lo = self._offsets[i] if i < len(self._offsets) else self.length
+        if end_us is not None and self._ts:
+            i = bisect.bisect_right(self._ts, end_us)
+            hi = self._offsets[i] if i < len(self._offsets) else self.length
+        return lo, max(lo, hi)
+
+    def index_points(self, lo: int, hi: int) -> List[Tuple[int, int]]:
+        """返回 [lo, hi) 内的 (时间戳, 偏移) 索引点，首个点对齐到 lo"""
+        points = []
+        for ts, offset in zip(self._ts, self._offsets):
+            if offset >= hi:
+                break
+            if offset <= lo:
+                points = [(ts, lo)]
+            else:
+                points.append((ts, offset))
+        return points
+
+    def open_view(self, lo: int, hi: int) -> "SegmentView":
+        """打开 [lo, hi) 的只读映射（需在写入方所在的事件循环中调用，hi 不超过当前已写入长度）。
+
+        映射由读取方持有：之后的封存、滚动或淘汰都不会关闭它，读取不会越过打开时已写入的长度。
+        """
+        hi = min(hi, self.length)
+        lo = min(lo, hi)
+        mm = None
+        if hi > lo:
+            with open(self.path, "rb") as f:
+                mm = mmap.mmap(f.fileno(), hi, access=mmap.ACCESS_READ)
+        return SegmentView(mm, lo, hi, self.index_points(lo, hi))
+
+    def info(self) -> dict:
+        return {
+            "file": os.path.basename(self.path),
+            "start_us": self.start_us,
+            "end_us": self.end_us,
+            "bytes": self.length,
+            "index_points": len(self._ts),
+            "sealed": self.sealed,
+        }
+
+
+class SegmentView:
+    """读取方持有的分段只读映射与打开时的范围、索引点"""
+
+    __slots__ = ("lo", "hi", "points", "_mm")
+
+    def __init__(self, mm: Optional[mmap.mmap], lo: int, hi: int, points: List[Tuple[int, int]]):
+        self._mm = mm
+        self.lo = lo
+        self.hi = hi
+        self.points = points
+
+    def chunks(self, lo: Optional[int] = None, hi: Optional[int] = None,
+               chunk_size: int = 64 * 1024) -> Iterator[memoryview]:
+        """按块产出 [lo, hi) 的数据切片（不拷贝），范围限制在打开时的范围内"""
+        lo = self.lo if lo is None else max(lo, self.lo)
+        hi = self.hi if hi is None else min(hi, self.hi)
+        if self._mm is None or hi <= lo:
+            return
+        view = memoryview(self._mm)
+        try:
+            for pos in range(lo, hi, chunk_size):
+                yield view[pos:min(pos + chunk_size, hi)]
+        finally:
+            view.release()
+
+    def close(self) -> None:
+        if self._mm is None:
+            return
+        try:
+            self._mm.close()
+        except BufferError:
+            # 下游仍持有切片时交给垃圾回收释放
+            pass
+        self._mm = None
+
+
+class CaptureStore:
+    """抓包目录：按大小或时长滚动分段，并按总大小淘汰最旧分段。
+
+    write 在事件循环中调用，只做映射内的内存拷贝；索引落盘、封存（msync 与截断）和
+    淘汰删除都交给单个写盘线程按提交顺序执行，不阻塞事件循环。分段列表只在事件循环中修改。
+    """
+
+    def __init__(
+        self,
+        directory: str,
+        segment_bytes: int = 64 * 1024 * 1024,
+        segment_seconds: float = 3600.0,
+        max_total_bytes: int = 4 * 1024 * 1024 * 1024,
+        index_interval: float = 0.05,
+    ):
+        if segment_bytes <= 0:
+            raise ValueError("segment_bytes 必须大于 0")
+        self.directory = directory
+        self.segment_bytes = segment_bytes
+        self.segment_us = int(segment_seconds * 1_000_000)
+        self.max_total_bytes = max_total_bytes
+        self.index_interval_us = int(index_interval * 1_000_000)
+        self.segments: List[CaptureSegment] = []
+        self._active: Optional[CaptureSegment] = None
+        # 淘汰时因仍被映射而删除失败的分段（Windows），之后重试；只在写盘线程中访问
+        self._doomed: List[CaptureSegment] = []
+        os.makedirs(directory, exist_ok=True)
+        self._load_existing()
+        self._writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix="capture-writer")
+        self._closed: Optional[Future] = None
+
+    def _load_existing(self) -> None:
+        for name in sorted(os.listdir(self.directory)):
+            if name.startswith("capture-") and name.endswith(SEGMENT_SUFFIX):
+                segment = CaptureSegment.load(os.path.join(self.directory, name))
+                if segment is not None:
+                    self.segments.append(segment)
+        self.segments.sort(key=lambda s: s.start_us)
+
+    @property
+    def total_bytes(self) -> int:
+        return sum(s.length for s in self.segments)
+
+    def _submit(self, func: Callable[..., None], *args) -> Future:
+        future = self._writer.submit(func, *args)
+        future.add_done_callback(_log_failure)
+        return future
+
+    def write(self, data: bytes, ts_us: Optional[int] = None) -> None:
+        ts_us = now_us() if ts_us is None else ts_us
+        view = memoryview(data)
+        while view:
+            segment = self._active
+            if (segment is None or segment.remaining <= 0
+                    or ts_us - segment.start_us >= self.segment_us):
+                segment = self._rotate(ts_us)
+            written = segment.append(view, ts_us, self.index_interval_us)
+            view = view[written:]
+        if self._active.index_pending:
+            self._submit(self._active.flush_index)
+
+    def _rotate(self, ts_us: int) -> CaptureSegment:
+        if self._active is not None:
+            # 旧分段不再写入，封存交给写盘线程
+            self._submit(self._active.seal)
+        # 同一微秒内滚动时保证文件名唯一
+        if self.segments and ts_us <= self.segments[-1].start_us:
+            ts_us = self.segments[-1].start_us + 1
+        # 新分段是稀疏文件，创建与映射只有几次元数据调用
+        self._active = CaptureSegment.create(self.directory, ts_us, self.segment_bytes)
+        self.segments.append(self._active)
+        self._enforce_retention()
+        return self._active
+
+    def _enforce_retention(self) -> None:
+        """先从分段列表中移除超出总大小的最旧分段（之后的查询不再返回它们），再由写盘线程删除文件"""
+        expired = []
+        total = self.total_bytes
+        while len(self.segments) > 1 and total > self.max_total_bytes:
+            oldest = self.segments.pop(0)
+            total -= oldest.length
+            expired.append(oldest)
+        self._submit(self._delete_segments, expired)
+
+    def _delete_segments(self, expired: List[CaptureSegment]) -> None:
+        self._doomed = [s for s in self._doomed + expired if not s.delete()]
+
+    def close(self) -> Future:
+        """封存当前分段并停止写盘线程，返回写盘线程处理完所有已提交工作时完成的 Future"""
+        if self._closed is None:
+            active, self._active = self._active, None
+            self._closed = self._submit(active.seal) if active is not None else self._submit(lambda: None)
+            self._writer.shutdown(wait=False)
+        return self._closed
+
+    def find(self, start_us: Optional[int], end_us: Optional[int]) -> List[Tuple[CaptureSegment, int, int]]:
+        """返回与时间范围重叠的 (分段, 起始偏移, 结束偏移)"""
+        result = []
+        for i, segment in enumerate(self.segments):
+            # 分段的结束时间以下一段的开始为准，避免漏掉最后一个索引点之后的数据
+            seg_end = self.segments[i + 1].start_us if i + 1 < len(self.segments) else None
+            if end_us is not None and segment.start_us > end_us:
+                break
+            if start_us is not None and seg_end is not None and seg_end <= start_us:
+                continue
+            lo, hi = segment.offset_range(start_us, end_us, self.index_interval_us)
+            if hi > lo:
+                result.append((segment, lo, hi))
+        return result
+
+    def open_range(self, start_us: Optional[int], end_us: Optional[int]) -> List[SegmentView]:
+        """一次性打开时间范围内各分段的只读映射（需在写入方所在的事件循环中调用）。
+
+        分段列表与已写入长度在调用时确定，之后的写入、滚动与淘汰不影响返回的映射；
+        用完后由调用方逐个 close。
+        """
+        views: List[SegmentView] = []
+        try:
+            for segment, lo, hi in self.find(start_us, end_us):
+                views.append(segment.open_view(lo, hi))
+        except BaseException:
+            for view in views:
+                view.close()
+            raise
+        return views
+
+    def info(self) -> dict:
+        return {
+            "directory": os.path.abspath(self.directory),
+            "total_bytes": self.total_bytes,
+            "segments": [s.info() for s in self.segments],
+        }
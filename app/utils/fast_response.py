@@ -0,0 +1,28 @@
+'''
+Author: nll
+Date: 2026-10-17
+Description: 大批量结果的快速 JSON 响应：内容已是 JSON 基本类型时直接编码，不经过 response_model 校验
+'''
+import json
+from typing import Any
+
+from fastapi.responses import JSONResponse
+
+# 安装了 orjson 时用它编码（可选依赖），否则用标准库
+_orjson = None
+try:
+    import orjson as _orjson
+except ImportError:
+    pass
+
+
+class FastJSONResponse(JSONResponse):
+    """路由直接返回本响应时，FastAPI 跳过 response_model 的逐项校验与 jsonable_encoder。
+
+    内容只能由 dict / list / str / int / float / bool / None 组成，由调用方保证字段与模型一致。
+    """
+
+    def render(self, content: Any) -> bytes:
+        if _orjson is not None:
+            return _orjson.dumps(content)
+        return json.dumps(content, ensure_ascii=False, allow_nan=False, separators=(",", ":")).encode("utf-8")
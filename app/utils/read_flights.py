@@ -0,0 +1,94 @@
+'''
+Author: nll
+Date: 2026-10-17
+Description: 单飞读取合并：同时进行的读取请求中重叠的寄存器只向设备读取一次
+'''
+import asyncio
+from typing import Dict, Hashable, Iterable, List, Optional, Tuple
+
+
+class ReadFlight:
+    """一次正在进行的设备读取，完成后 future 的结果为 BatchReadResult（失败为 None）"""
+
+    __slots__ = ("key", "addresses", "future", "priority")
+
+    def __init__(self, key: Tuple[Hashable, int], addresses: List[int], future: asyncio.Future,
+                 priority: int = 0):
+        self.key = key
+        self.addresses = addresses
+        self.future = future
+        self.priority = priority
+
+
+class ReadFlights:
+    """按 (端口, 字节数) 登记正在读取的寄存器地址。
+
+    读取前先 claim：已有其他请求在读的地址由调用方等待对应 ReadFlight 的结果，
+    其余地址登记为本次读取，读完后 land 公布结果并注销。等待只会指向更早登记的读取，
+    不会相互等待。只加入优先级不低于自己的读取（交互读取不去等整个批量读取完成），
+    此时登记表中该地址改为指向本次读取。enabled 为 False 时 claim 总是返回全部地址。
+    """
+
+    def __init__(self, enabled: bool = True):
+        self.enabled = enabled
+        self._index: Dict[Tuple[Hashable, int], Dict[int, ReadFlight]] = {}
+        self._stats = {"reads": 0, "joined_reads": 0, "shared_registers": 0, "saved_round_trips": 0}
+
+    def claim(self, port: Hashable, size: int, addresses: Iterable[int], priority: int = 0
+              ) -> Tuple[Optional[ReadFlight], List[int], Dict[ReadFlight, List[int]]]:
+        """返回 (本次登记的读取, 需要自己读的地址, {已在读的 ReadFlight: 共享的地址})。
+
+        priority 为串口调度器的优先级，数值越小越优先。
+        """
+        self._stats["reads"] += 1
+        if not self.enabled:
+            return None, list(addresses), {}
+        key = (port, size)
+        index = self._index.setdefault(key, {})
+        owned: List[int] = []
+        shared: Dict[ReadFlight, List[int]] = {}
+        for address in addresses:
+            flight = index.get(address)
+            if flight is None or flight.priority > priority:
+                owned.append(address)
+            else:
+                shared.setdefault(flight, []).append(address)
+        if shared:
+            self._stats["joined_reads"] += 1
+            self._stats["shared_registers"] += sum(len(v) for v in shared.values())
+        if not owned:
+            return None, owned, shared
+        flight = ReadFlight(key, owned, asyncio.get_running_loop().create_future(), priority)
+        for address in owned:
+            index[address] = flight
+        return flight, owned, shared
+
+    def land(self, flight: Optional[ReadFlight], result=None) -> None:
+        """公布读取结果（None 表示读取中断，等待者自行重读）并注销登记的地址"""
+        if flight is None:
+            return
+        index = self._index.get(flight.key)
+        if index is not None:
+            for address in flight.addresses:
+                if index.get(address) is flight:
+                    del index[address]
+            if not index:
+                del self._index[flight.key]
+        if not flight.future.done():
+            flight.future.set_result(result)
+
+    def forget(self, port: Hashable, address: int) -> None:
+        """地址被写入：之后的读取不再加入写入前已开始的读取"""
+        for key, index in self._index.items():
+            if key[0] == port:
+                index.pop(address, None)
+
+    def record_saved(self, round_trips: int) -> None:
+        self._stats["saved_round_trips"] += max(0, round_trips)
+
+    def stats(self) -> dict:
+        return {
+            "enabled": self.enabled,
+            **self._stats,
+            "in_flight_registers": sum(len(v) for v in self._index.values()),
+        }
@@ -0,0 +1,179 @@
+'''
+Author: nll
+Date: 2026-10-17
+Description: 批量读取规划：按“每条命令固定开销 vs 当前波特率下每字节传输时间”合并有空洞的地址
+'''
+import json
+import math
+import os
+from array import array
+from typing import Dict, Iterable, List, Optional
+
+from app.utils.register_values import RegisterBlock, format_address
+
+
+class DeviceProfile:
+    """设备读取特性，决定合并策略与块大小上限。
+
+    max_regs_per_block 以寄存器为单位限制一次读取的跨度（含空洞）；
+    max_gap_bytes 限制可以跨过的最大空洞，读敏感（读清除）寄存器较多的设备应设为 0；
+    command_overhead_ms 是一问一答中与数据量无关的耗时（设备处理、调度与往返）；
+    其余字段描述应答格式：每行 line_bytes 个数据字节，每行额外 line_overhead_chars 个字符
+    （`0x%08X:` 与换行），每个应答固定 response_overhead_chars 个字符（`OK\\r\\n`）。
+    """
+
+    FIELDS = ("max_regs_per_block", "max_gap_bytes", "command_overhead_ms",
+              "line_bytes", "line_overhead_chars", "response_overhead_chars")
+
+    def __init__(
+        self,
+        name: str = "default",
+        max_regs_per_block: int = 32,
+        max_gap_bytes: int = 64,
+        command_overhead_ms: float = 5.0,
+        line_bytes: int = 16,
+        line_overhead_chars: int = 13,
+        response_overhead_chars: int = 4,
+    ):
+        if max_regs_per_block < 1 or line_bytes < 1:
+            raise ValueError("max_regs_per_block 与 line_bytes 必须大于 0")
+        self.name = name
+        self.max_regs_per_block = int(max_regs_per_block)
+        self.max_gap_bytes = max(0, int(max_gap_bytes))
+        self.command_overhead_ms = float(command_overhead_ms)
+        self.line_bytes = int(line_bytes)
+        self.line_overhead_chars = int(line_overhead_chars)
+        self.response_overhead_chars = int(response_overhead_chars)
+
+    def to_dict(self) -> dict:
+        return {"name": self.name, **{f: getattr(self, f) for f in self.FIELDS}}
+
+    def with_block_regs(self, max_regs_per_block: int) -> "DeviceProfile":
+        """复制一份并替换块大小上限（由自适应调节给出）"""
+        if max_regs_per_block == self.max_regs_per_block:
+            return self
+        return DeviceProfile(**{**self.to_dict(), "max_regs_per_block": max_regs_per_block})
+
+    def block_cost(self, start: int, length: int, baudrate: int) -> float:
+        """估算一次读取 length 字节的耗时（秒），8N1 下每字符 10 位"""
+        command_chars = len(f"read {format_address(start)} {length}\n")
+        response_chars = (2 * length
+                          + math.ceil(length / self.line_bytes) * self.line_overhead_chars
+                          + self.response_overhead_chars)
+        return self.command_overhead_ms / 1000.0 + (command_chars + response_chars) * 10.0 / baudrate
+
+
+def load_profiles(path: Optional[str] = None) -> Dict[str, DeviceProfile]:
+    """加载设备配置：内置 default，另可从 JSON 文件（DEVICE_PROFILES_FILE）追加或覆盖。
+
+    文件格式：{"profile_name": {"max_regs_per_block": 64, "command_overhead_ms": 2.0}, ...}
+    """
+    profiles = {"default": DeviceProfile()}
+    path = path if path is not None else os.getenv("DEVICE_PROFILES_FILE")
+    if path and os.path.exists(path):
+        with open(path, "r", encoding="utf-8") as f:
+            for name, options in json.load(f).items():
+                fields = {k: v for k, v in options.items() if k in DeviceProfile.FIELDS}
+                profiles[name] = DeviceProfile(name=name, **fields)
+    return profiles
+
+
+class ReadPlan:
+    """规划结果：读取块列表与估算耗时，附带按原“严格连续”规则分组的对照"""
+
+    def __init__(self, blocks: List[RegisterBlock], size: int, profile: DeviceProfile, baudrate: int,
+                 baseline_blocks: int, baseline_cost: float):
+        self.blocks = blocks
+        self.size = size
+        self.profile = profile
+        self.baudrate = baudrate
+        self.baseline_blocks = baseline_blocks
+        self.baseline_cost = baseline_cost
+
+    def filler_bytes(self, block: RegisterBlock) -> int:
+        return block.length - len(block.addresses) * self.size
+
+    @property
+    def estimated_cost(self) -> float:
+        return sum(self.profile.block_cost(b.start, b.length, self.baudrate) for b in self.blocks)
+
+    def to_dict(self) -> dict:
+        blocks = []
+        for block in self.blocks:
+            blocks.append({
+                "start_address": format_address(block.start),
+                "length": block.length,
+                "registers": len(block.addresses),
+                "filler_bytes": self.filler_bytes(block),
+                "estimated_ms": round(self.profile.block_cost(block.start, block.length, self.baudrate) * 1000, 3),
+                "addresses": [format_address(a) for a in block.addresses],
+            })
+        return {
+            "profile": self.profile.to_dict(),
+            "baudrate": self.baudrate,
+            "size": self.size,
+            "commands": len(self.blocks),
+            "filler_bytes": sum(self.filler_bytes(b) for b in self.blocks),
+            "estimated_ms": round(self.estimated_cost * 1000, 3),
+            "baseline_commands": self.baseline_blocks,
+            "baseline_estimated_ms": round(self.baseline_cost * 1000, 3),
+            "blocks": blocks,
+        }
+
+
+def _contiguous_groups(addresses: List[int], size: int, max_regs: int) -> List[List[int]]:
+    groups: List[List[int]] = []
+    for address in addresses:
+        if groups and address == groups[-1][-1] + size and len(groups[-1]) < max_regs:
+            groups[-1].append(address)
+        else:
+            groups.append([address])
+    return groups
+
+
+def plan_reads(addresses: Iterable[int], size: int, profile: DeviceProfile, baudrate: int) -> ReadPlan:
+    """按代价模型规划读取块。
+
+    先按严格连续规则得到若干段，再用动态规划决定相邻段是否合并：
+    dp[i] 为前 i 段的最小总耗时，块跨度不超过 max_regs_per_block 个寄存器，
+    段间空洞不超过 max_gap_bytes。只在多读空洞字节比多发一条命令更便宜时才合并，
+    空洞中读到的字节在结果中丢弃。
+    """
+    unique = sorted(set(addresses))
+    if not unique:
+        return ReadPlan([], size, profile, baudrate, 0, 0.0)
+    max_span = profile.max_regs_per_block * size
+    runs = _contiguous_groups(unique, size, profile.max_regs_per_block)
+    cost = profile.block_cost
+
+    n = len(runs)
+    dp = [0.0] + [math.inf] * n
+    choice = [0] * (n + 1)
+    for i in range(1, n + 1):
+        end = runs[i - 1][-1] + size
+        # 向前尝试把第 j..i-1 段合成一块
+        for j in range(i - 1, -1, -1):
+            start = runs[j][0]
+            if end - start > max_span:
+                break
+            if j < i - 1 and runs[j + 1][0] - (runs[j][-1] + size) > profile.max_gap_bytes:
+                break
+            total = dp[j] + cost(start, end - start, baudrate)
+            if total < dp[i]:
+                dp[i] = total
+                choice[i] = j
+
+    blocks: List[RegisterBlock] = []
+    i = n
+    while i > 0:
+        j = choice[i]
+        start = runs[j][0]
+        members = array("I")
+        for run in runs[j:i]:
+            members.extend(run)
+        blocks.append(RegisterBlock(start, runs[i - 1][-1] + size - start, members))
+        i = j
+    blocks.reverse()
+
+    baseline_cost = sum(cost(run[0], len(run) * size, baudrate) for run in runs)
+    return ReadPlan(blocks, size, profile, baudrate, len(runs), baseline_cost)
@@ -0,0 +1,144 @@
+'''
+Author: nll
+Date: 2026-10-17
+Description: 寄存器影子缓存：按端口保存最近读写的值，带 TTL、LRU 上限与按读写属性区分的失效规则
+'''
+import time
+from collections import OrderedDict
+from typing import Dict, Hashable, Iterable, Optional, Tuple
+
+
+# 寄存器易变性分类（由 Excel 定义中的位域类型得出）
+VOLATILITY_RW = "rw"          # 只有 RW 位域：值只随写入变化，写入后直接更新缓存
+VOLATILITY_RO = "ro"          # 含 RO 位域（硬件状态）：使用较短的 ro_ttl，写入后失效
+VOLATILITY_SPECIAL = "special"  # 其他类型（W1C、WO、RC 等）：写入后的值不可预测，写入后失效
+
+
+def classify_definitions(definitions: dict) -> Dict[int, str]:
+    """从 upload_and_parse_excel 的结果得出 地址 -> 易变性，保留位域不参与判断"""
+    volatility: Dict[int, str] = {}
+    for registers in definitions.values():
+        for register in registers.values():
+            try:
+                address = int(str(register["address"]), 16)
+            except (KeyError, ValueError):
+                continue
+            types = {str(f.get("type", "")).strip().upper()
+                     for f in register.get("bit_fields", [])
+                     if "RESERVED" not in str(f.get("name", "")).upper()}
+            if not types or types == {"RW"}:
+                volatility[address] = VOLATILITY_RW
+            elif "RO" in types:
+                volatility[address] = VOLATILITY_RO
+            else:
+                volatility[address] = VOLATILITY_SPECIAL
+    return volatility
+
+
+class RegisterCache:
+    """寄存器影子缓存。
+
+    键为 (端口, 地址)，值为该地址按设备字节序的原始字节及写入时间；所有端口共用一个
+    LRU 上限 capacity。读取时调用方给出可接受的最大时效 max_age，实际使用
+    min(max_age, 该地址的 TTL)：RW 寄存器为 ttl，含 RO 位域的状态寄存器为 ro_ttl。
+    写入 RW 寄存器直接更新缓存（写穿），其余寄存器写入后失效。
+    """
+
+    def __init__(self, capacity: int = 65536, ttl: float = 5.0, ro_ttl: float = 0.5):
+        self.capacity = max(0, capacity)
+        self.ttl = ttl
+        self.ro_ttl = ro_ttl
+        self._entries: "OrderedDict[Tuple[Hashable, int], Tuple[bytes, float]]" = OrderedDict()
+        self._volatility: Dict[int, str] = {}
+        self._stats = {"hits": 0, "misses": 0, "expired": 0, "evictions": 0,
+                       "updates": 0, "write_through": 0, "invalidations": 0}
+
+    @property
+    def enabled(self) -> bool:
+        return self.capacity > 0
+
+    def set_volatility(self, volatility: Dict[int, str]) -> None:
+        """替换地址易变性表（加载寄存器定义时调用），已缓存的条目按新规则判断"""
+        self._volatility = dict(volatility)
+
+    def ttl_for(self, address: int) -> float:
+        return self.ro_ttl if self._volatility.get(address) == VOLATILITY_RO else self.ttl
+
+    def get(self, port: Hashable, address: int, size: int, max_age: float) -> Optional[Tuple[bytes, float]]:
+        """取不超过 max_age 秒的缓存值，返回 (原始字节, 已过秒数)，未命中返回 None"""
+        key = (port, address)
+        entry = self._entries.get(key)
+        if entry is None or len(entry[0]) != size:
+            self._stats["misses"] += 1
+            return None
+        age = time.monotonic() - entry[1]
+        if age > min(max_age, self.ttl_for(address)):
+            self._stats["misses"] += 1
+            if age > self.ttl_for(address):
+                self._stats["expired"] += 1
+                del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        self._stats["hits"] += 1
+        return entry[0], age
+
+    def put(self, port: Hashable, address: int, raw: bytes, now: Optional[float] = None) -> None:
+        """记录一次读取到的值。
+
+        now 为读取开始的时间；已有更新的条目（例如读取期间确认的写入）时不覆盖。
+        """
+        if not self.enabled:
+            return
+        key = (port, address)
+        now = time.monotonic() if now is None else now
+        entry = self._entries.get(key)
+        if entry is not None and entry[1] > now:
+            return
+        self._entries[key] = (bytes(raw), now)
+        self._entries.move_to_end(key)
+        self._stats["updates"] += 1
+        self._evict()
+
+    def put_many(self, port: Hashable, items: Iterable[Tuple[int, bytes]], now: Optional[float] = None) -> None:
+        now = time.monotonic() if now is None else now
+        for address, raw in items:
+            self.put(port, address, raw, now)
+
+    def written(self, port: Hashable, address: int, raw: Optional[bytes]) -> None:
+        """写入确认后调用：RW 寄存器写穿更新，其余（或写入值未知时）失效"""
+        if not self.enabled:
+            return
+        if raw is not None and self._volatility.get(address, VOLATILITY_RW) == VOLATILITY_RW:
+            self.put(port, address, raw)
+            self._stats["write_through"] += 1
+        else:
+            self.invalidate(port, address)
+
+    def invalidate(self, port: Hashable, address: int) -> None:
+        if self._entries.pop((port, address), None) is not None:
+            self._stats["invalidations"] += 1
+
+    def clear(self, port: Optional[Hashable] = None) -> None:
+        """清空缓存，指定 port 时只清该端口"""
+        if port is None:
+            self._entries.clear()
+            return
+        for key in [k for k in self._entries if k[0] == port]:
+            del self._entries[key]
+
+    def _evict(self) -> None:
+        while len(self._entries) > self.capacity:
+            self._entries.popitem(last=False)
+            self._stats["evictions"] += 1
+
+    def stats(self) -> dict:
+        lookups = self._stats["hits"] + self._stats["misses"]
+        return {
+            **self._stats,
+            "hit_rate": round(self._stats["hits"] / lookups, 4) if lookups else 0.0,
+            "entries": len(self._entries),
+            "capacity": self.capacity,
+            "ttl": self.ttl,
+            "ro_ttl": self.ro_ttl,
+            "volatile_registers": sum(1 for v in self._volatility.values() if v != VOLATILITY_RW),
+        }
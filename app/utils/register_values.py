@@ -0,0 +1,312 @@
+'''
+Author: nll
+Date: 2026-10-17
+Description: 寄存器地址/值的内部表示：地址为 int / array('I')，值为原始字节，只在 API 边界格式化为十六进制
+'''
+import struct
+import sys
+from array import array
+from datetime import datetime
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+
+# format=raw 响应头（小端）：魔数、版本、每个值的字节数、保留、寄存器个数
+RAW_HEADER = struct.Struct("<4sBBHI")
+RAW_MAGIC = b"RGRD"
+RAW_VERSION = 1
+
+# 按值宽度选择可整体字节序翻转的数组类型
+_SWAP_TYPECODES = {2: "H", 4: "I", 8: "Q"}
+
+
+def parse_hex(text: str, name: str = "地址") -> int:
+    """解析 0x 开头的十六进制字符串，格式错误时抛出 ValueError"""
+    if not isinstance(text, str) or text[:2] not in ("0x", "0X") or len(text) <= 2:
+        raise ValueError(f"{name}必须以0x或0X开头，当前{name}: {text}")
+    try:
+        return int(text[2:], 16)
+    except ValueError:
+        raise ValueError(f"{name}包含非法字符，当前{name}: {text}")
+
+
+def parse_addresses(addresses: Iterable[str]) -> array:
+    """把十六进制地址列表转为 array('I')"""
+    try:
+        return array("I", (parse_hex(a) for a in addresses))
+    except OverflowError:
+        raise ValueError("地址超出32位范围")
+
+
+def format_address(address: int) -> str:
+    return f"0x{address:08X}"
+
+
+def format_value(raw: bytes) -> str:
+    """设备输出的十六进制文本即高位在前的字节序，直接转回文本"""
+    return "0x" + raw.hex().upper()
+
+
+def format_int(value: int, width: int = 4) -> str:
+    """整数按 width 字节补齐为十六进制文本，用于拼接串口命令"""
+    return f"0x{value:0{width * 2}X}"
+
+
+def to_little_endian(data: bytes, size: int) -> bytes:
+    """把按设备字节序（高位在前）排列的定宽值批量转为小端"""
+    if size == 1:
+        return bytes(data)
+    typecode = _SWAP_TYPECODES.get(size)
+    if typecode is not None and array(typecode).itemsize == size:
+        values = array(typecode)
+        values.frombytes(bytes(data))
+        # 每个值整体翻转一次字节序即为小端，与本机字节序无关
+        values.byteswap()
+        return values.tobytes()
+    return _reverse_each(data, size)
+
+
+def _reverse_each(data: bytes, size: int) -> bytes:
+    out = bytearray(len(data))
+    for i in range(0, len(data), size):
+        out[i:i + size] = data[i:i + size][::-1]
+    return bytes(out)
+
+
+class RegisterBlock:
+    """一次合并读取：起始地址、字节数与块内按顺序排列的寄存器地址。
+
+    地址之间可以有空洞（读取规划跨过空洞合并），空洞中的字节读取后丢弃。
+    """
+
+    __slots__ = ("start", "length", "addresses")
+
+    def __init__(self, start: int, length: int, addresses: array):
+        self.start = start
+        self.length = length
+        self.addresses = addresses
+
+
+class BatchReadResult:
+    """批量读取结果（列式）。
+
+    addresses 按请求顺序排列，values 是 len(addresses) * size 字节的连续缓冲区，
+    ok 为每个寄存器的成功标志；时间戳与失败原因按块记录。
+    格式化为十六进制字符串或打包为 raw 响应都在 API 边界完成。
+    """
+
+    def __init__(self, addresses: array, size: int):
+        self.addresses = addresses
+        self.size = size
+        self.values = bytearray(len(addresses) * size)
+        self.ok = bytearray(len(addresses))
+        self.block_of = array("I", bytes(4 * len(addresses)))
+        self.block_timestamps: List[str] = []
+        self.block_errors: List[Optional[str]] = []
+        self.block_cached: List[bool] = []
+        # 失败块的二分重试统计：重试命令数、耗时（秒）与最终仍读取失败的地址
+        self.retries = 0
+        self.recovery_time = 0.0
+        self.isolated: List[int] = []
+        # 与同时进行的其他读取共享结果而省去的设备往返次数
+        self.shared_round_trips = 0
+        self._positions: Dict[int, List[int]] = {}
+        for i, address in enumerate(addresses):
+            self._positions.setdefault(address, []).append(i)
+
+    @property
+    def successful(self) -> int:
+        return self.ok.count(1)
+
+    @property
+    def failed(self) -> int:
+        return len(self.ok) - self.successful
+
+    def unique_addresses(self) -> List[int]:
+        return sorted(self._positions)
+
+    def _new_block(self, error: Optional[str], cached: bool = False) -> int:
+        self.block_timestamps.append(datetime.now().isoformat())
+        self.block_errors.append(error)
+        self.block_cached.append(cached)
+        return len(self.block_timestamps) - 1
+
+    def set_cached(self, items: Iterable) -> None:
+        """写入影子缓存命中的值，items 为 (地址, 原始字节)，共用一个“缓存”块记录"""
+        index = None
+        size = self.size
+        for address, raw in items:
+            if index is None:
+                index = self._new_block(None, cached=True)
+            for pos in self._positions.get(address, ()):
+                self.values[pos * size:(pos + 1) * size] = raw
+                self.ok[pos] = 1
+                self.block_of[pos] = index
+
+    def copy_from(self, other: "BatchReadResult", addresses: Iterable[int]) -> List[int]:
+        """从同时进行的另一次读取结果中取出 addresses 的值、失败原因与时间戳。
+
+        返回 other 中没有读取记录的地址（由调用方自行读取）。
+        """
+        size = self.size
+        isolated = set(other.isolated)
+        blocks: Dict[int, int] = {}
+        unread: List[int] = []
+        for address in addresses:
+            src = other._positions.get(address)
+            if not src or not other.block_timestamps:
+                unread.append(address)
+                continue
+            src = src[0]
+            other_block = other.block_of[src]
+            index = blocks.get(other_block)
+            if index is None:
+                index = blocks[other_block] = self._new_block(other.block_errors[other_block],
+                                                              other.block_cached[other_block])
+                self.block_timestamps[index] = other.block_timestamps[other_block]
+            chunk = other.values[src * size:(src + 1) * size]
+            for pos in self._positions.get(address, ()):
+                self.values[pos * size:(pos + 1) * size] = chunk
+                self.ok[pos] = other.ok[src]
+                self.block_of[pos] = index
+            if address in isolated:
+                self.isolated.append(address)
+        return unread
+
+    def lookup(self, address: int) -> Tuple[Optional[bytes], Optional[str]]:
+        """取单个地址的 (原始字节, 失败原因)，成功时失败原因为 None"""
+        positions = self._positions.get(address)
+        if not positions:
+            return None, "未读取"
+        pos = positions[0]
+        if self.ok[pos]:
+            return bytes(self.values[pos * self.size:(pos + 1) * self.size]), None
+        if not self.block_timestamps:
+            return None, "未读取"
+        return None, self.block_errors[self.block_of[pos]] or "读取失败"
+
+    def iter_successful(self):
+        """按去重后的地址产出 (地址, 原始字节)，用于回填缓存"""
+        size = self.size
+        for address, positions in self._positions.items():
+            pos = positions[0]
+            if self.ok[pos] and not self.block_cached[self.block_of[pos]]:
+                yield address, bytes(self.values[pos * size:(pos + 1) * size])
+
+    def set_block(self, block: RegisterBlock, data: Sequence[int], filled: Optional[int] = None) -> array:
+        """写入一个读取成功的块，data 为从 block.start 起的原始字节（含空洞）。
+
+        filled 小于块长度时（应答不完整）只写入完整落在前 filled 字节内的寄存器，
+        返回未覆盖的寄存器地址，供调用方继续重试。
+        """
+        filled = block.length if filled is None else filled
+        index = self._new_block(None)
+        size = self.size
+        values, ok, block_of = self.values, self.ok, self.block_of
+        view = memoryview(data)
+        start = block.start
+        missing = array("I")
+        for address in block.addresses:
+            offset = address - start
+            if offset + size > filled:
+                missing.append(address)
+                continue
+            chunk = view[offset:offset + size]
+            for pos in self._positions.get(address, ()):
+                values[pos * size:(pos + 1) * size] = chunk
+                ok[pos] = 1
+                block_of[pos] = index
+        return missing
+
+    def fail_block(self, block: RegisterBlock, message: str) -> None:
+        index = self._new_block(message)
+        for address in block.addresses:
+            for pos in self._positions.get(address, ()):
+                self.ok[pos] = 0
+                self.block_of[pos] = index
+
+    def mismatches(self, expected: bytes) -> List[int]:
+        """与期望值（按请求顺序排列、每个 size 字节）比较，返回读取成功但不一致的下标。
+
+        整段相等时只做一次比较；否则按定宽整数数组逐个比较，不逐字节切片。
+        """
+        values, ok = self.values, self.ok
+        if values == expected:
+            return []
+        size = self.size
+        typecode = _SWAP_TYPECODES.get(size) if size != 1 else "B"
+        if typecode is not None and array(typecode).itemsize == size:
+            got, want = array(typecode, bytes(values)), array(typecode, expected)
+        else:
+            got = [bytes(values[i:i + size]) for i in range(0, len(values), size)]
+            want = [expected[i:i + size] for i in range(0, len(expected), size)]
+        return [i for i, (a, b) in enumerate(zip(got, want)) if a != b and ok[i]]
+
+    def to_results(self) -> List[dict]:
+        """API 边界：转为逐个寄存器的结果字典（值为 "0x..." 文本）。
+
+        值缓冲区整体转一次十六进制再切片；消息与时间戳按块预先算好，逐个寄存器只做查表。
+        """
+        width = self.size * 2
+        hexed = self.values.hex().upper()
+        ok = self.ok
+        block_of = self.block_of
+        if self.block_timestamps:
+            timestamps = self.block_timestamps
+            ok_messages = ["读取成功（缓存）" if cached else "读取成功" for cached in self.block_cached]
+            failed_messages = [f"块读取失败: {error}" for error in self.block_errors]
+        else:
+            timestamps, ok_messages, failed_messages = [None], [None], ["未读取"]
+            block_of = bytes(len(ok))
+        results = []
+        append = results.append
+        for i, address in enumerate(self.addresses):
+            block = block_of[i]
+            if ok[i]:
+                append({
+                    "address": f"0x{address:08X}", "success": True,
+                    "value": "0x" + hexed[i * width:(i + 1) * width],
+                    "message": ok_messages[block],
+                    "timestamp": timestamps[block],
+                })
+            else:
+                append({
+                    "address": f"0x{address:08X}", "success": False, "value": None,
+                    "message": failed_messages[block],
+                    "timestamp": timestamps[block],
+                })
+        return results
+
+    def to_columns(self) -> dict:
+        """API 边界：列式结果（format=columnar）。
+
+        addresses / values / status / block 按请求顺序一一对应，失败寄存器的值为 None；
+        block 为所属块的序号，时间戳、失败原因与是否来自缓存按块给出。
+        """
+        width = self.size * 2
+        hexed = self.values.hex().upper()
+        ok = self.ok
+        return {
+            "addresses": [f"0x{address:08X}" for address in self.addresses],
+            "values": ["0x" + hexed[i * width:(i + 1) * width] if ok[i] else None for i in range(len(ok))],
+            "status": list(ok),
+            "block": self.block_of.tolist(),
+            "block_timestamps": self.block_timestamps,
+            "block_errors": self.block_errors,
+            "block_cached": self.block_cached,
+        }
+
+    def to_raw(self) -> bytes:
+        """API 边界：打包为 format=raw 响应体。
+
+        布局（全部小端）：RAW_HEADER，地址 u32 x N，值（每个 size 字节，小端整数）x N，
+        状态 u8 x N（1 成功 / 0 失败）。失败寄存器的值为 0。
+        """
+        addresses = array("I", self.addresses)
+        if sys.byteorder == "big":
+            addresses.byteswap()
+        return b"".join((
+            RAW_HEADER.pack(RAW_MAGIC, RAW_VERSION, self.size, 0, len(self.addresses)),
+            addresses.tobytes(),
+            to_little_endian(self.values, self.size),
+            bytes(self.ok),
+        ))
@@ -0,0 +1,108 @@
+'''
+Author: nll
+Date: 2026-10-17
+Description: read 命令应答的增量解析：按扫描偏移切行，十六进制直接解码进预分配缓冲区
+'''
+import binascii
+import re
+from typing import Union
+
+from app.utils.serial_scheduler import DEFAULT_TERMINATOR
+
+
+# 数据行 `<addr>:<hex>`，只捕获冒号后的十六进制部分（可带 0x 前缀，可含空格）；
+# 与原实现一致，任何含冒号的行都视为数据行（非应答行已由 ResponseDemux 分流到终端）
+_DATA_LINE = re.compile(rb":[ \t]*(?:0[xX])?([0-9A-Fa-f ]+)")
+
+
+class ReadResponseFramer:
+    """增量解析 `read <addr> <len>` 的应答。
+
+    应答形如若干行 `<addr>:<hex>` 加终止符 `OK\r\n`。终止符查找从上次扫描位置继续，
+    不重扫已检查过的字节；已完整的行累积到 parse_threshold 字节或收到终止符时，
+    用一次正则扫描取出全部十六进制片段，拼接后一次性解码进预分配的 data，
+    并立即从缓冲区删除。每个字节至多扫描两次，不做整段 decode / splitlines / split。
+    data 中的字节顺序与设备输出的十六进制文本一致，即 `data[i*size:(i+1)*size].hex()`
+    等于原先按字符切出的值。
+    """
+
+    __slots__ = ("data", "filled", "overflow", "done", "_buf", "_scan", "_terminator",
+                 "_parse_threshold", "_odd")
+
+    def __init__(self, expected_bytes: int, terminator: bytes = DEFAULT_TERMINATOR,
+                 parse_threshold: int = 4096):
+        self.data = bytearray(expected_bytes)
+        self.filled = 0
+        self.overflow = 0
+        self.done = False
+        self._buf = bytearray()
+        self._scan = 0
+        self._terminator = terminator
+        self._parse_threshold = parse_threshold
+        self._odd = b""
+
+    @property
+    def complete(self) -> bool:
+        """收到终止符且数据已填满"""
+        return self.done and self.filled == len(self.data)
+
+    def feed(self, chunk: Union[bytes, bytearray, memoryview]) -> bool:
+        """处理一段数据，收到终止符时返回 True（之后的数据被忽略）"""
+        if self.done:
+            return True
+        buf = self._buf
+        buf += chunk
+        terminator = self._terminator
+        idx = buf.find(terminator, self._scan)
+        # 终止符必须位于行首
+        while idx > 0 and buf[idx - 1] != 0x0A:
+            idx = buf.find(terminator, idx + 1)
+        if idx >= 0:
+            self.done = True
+            self._parse(idx)
+            buf.clear()
+            return True
+        # 下次从可能包含终止符开头的位置继续
+        self._scan = max(0, len(buf) - len(terminator) + 1)
+        if len(buf) >= self._parse_threshold:
+            end = buf.rfind(b"\n")
+            if end >= 0:
+                self._parse(end + 1)
+                del buf[:end + 1]
+                self._scan = max(0, self._scan - end - 1)
+        return False
+
+    def finish(self) -> None:
+        """数据已全部给出但没有终止符时，解析缓冲区中剩余的内容"""
+        if not self.done and self._buf:
+            self._parse(len(self._buf))
+            self._buf.clear()
+
+    def _parse(self, limit: int) -> None:
+        parts = _DATA_LINE.findall(self._buf, 0, limit)
+        if not parts:
+            return
+        hex_text = parts[0] if len(parts) == 1 else b"".join(parts)
+        if b" " in hex_text:
+            hex_text = hex_text.replace(b" ", b"")
+        if self._odd:
+            hex_text = self._odd + hex_text
+        # 分批解析时一个字节可能被拆在两批之间，奇数个字符留到下一批
+        if len(hex_text) & 1:
+            hex_text, self._odd = hex_text[:-1], hex_text[-1:]
+        else:
+            self._odd = b""
+        raw = binascii.unhexlify(hex_text)
+        room = len(self.data) - self.filled
+        n = min(room, len(raw))
+        self.data[self.filled:self.filled + n] = memoryview(raw)[:n]
+        self.filled += n
+        self.overflow += len(raw) - n
+
+
+def parse_read_response(response: bytes, expected_bytes: int) -> ReadResponseFramer:
+    """一次性解析完整的 read 应答"""
+    framer = ReadResponseFramer(expected_bytes)
+    framer.feed(response)
+    framer.finish()
+    return framer
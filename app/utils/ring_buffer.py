@@ -0,0 +1,209 @@
+'''
+Author: nll
+Date: 2026-10-17
+Description: 串口接收环形缓冲区（单生产者、多消费者）
+'''
+import asyncio
+import threading
+from typing import Optional, Set
+
+
+class RingBuffer:
+    """预分配的字节环形缓冲区。
+
+    只有一个生产者（串口 I/O 线程或事件循环内的传输层）写入，任意多个 RingReader 各自维护读游标。
+    写入位置是单调递增的总字节数。生产者拷贝前先发布预留位置（本次写入结束后的位置），
+    拷贝完成后再发布写位置；读者按写位置确定可读范围，拷贝后按预留位置校验起点
+    是否已被覆盖（类似顺序锁），因此读写数据都不需要加锁；只有读者集合由一把小锁保护，
+    因为读者在事件循环线程增删，而唤醒在生产者线程遍历。读者落后超过容量时
+    会跳过被覆盖的数据，并计入 dropped。
+    """
+
+    def __init__(self, capacity: int = 1 << 20):
+        if capacity <= 0:
+            raise ValueError("capacity 必须大于 0")
+        self._capacity = capacity
+        self._buf = bytearray(capacity)
+        self._view = memoryview(self._buf)
+        self._write_pos = 0
+        # 正在进行的写入结束后的位置，拷贝前发布；没有写入进行时等于 _write_pos
+        self._reserve_pos = 0
+        self._closed = False
+        self._readers: Set["RingReader"] = set()
+        self._readers_lock = threading.Lock()
+
+    @property
+    def capacity(self) -> int:
+        return self._capacity
+
+    @property
+    def write_pos(self) -> int:
+        return self._write_pos
+
+    @property
+    def reserve_pos(self) -> int:
+        return self._reserve_pos
+
+    @property
+    def closed(self) -> bool:
+        return self._closed
+
+    def write(self, data: bytes) -> None:
+        """生产者写入数据并唤醒等待中的读者（可在任意线程调用）"""
+        n = len(data)
+        if n == 0 or self._closed:
+            return
+        src = memoryview(data)
+        if n > self._capacity:
+            # 超过容量的部分必然被覆盖，只保留最后 capacity 字节
+            src = src[n - self._capacity:]
+        # 先发布预留位置，读者才能发现即将被覆盖的区域
+        self._reserve_pos = self._write_pos + n
+        pos = (self._write_pos + n - len(src)) % self._capacity
+        first = min(len(src), self._capacity - pos)
+        self._view[pos:pos + first] = src[:first]
+        if first < len(src):
+            self._view[0:len(src) - first] = src[first:]
+        # 数据就绪后再发布写位置
+        self._write_pos += n
+        self._notify()
+
+    def close(self) -> None:
+        """标记数据流结束（串口关闭），唤醒所有读者"""
+        self._closed = True
+        self._notify()
+
+    def reader(self, from_start: bool = False) -> "RingReader":
+        """创建一个读游标，默认只接收此后到达的数据"""
+        start = max(0, self._write_pos - self._capacity) if from_start else self._write_pos
+        reader = RingReader(self, start)
+        with self._readers_lock:
+            self._readers.add(reader)
+        return reader
+
+    def _remove_reader(self, reader: "RingReader") -> None:
+        with self._readers_lock:
+            self._readers.discard(reader)
+
+    def _notify(self) -> None:
+        # 在锁内取快照，唤醒放在锁外，避免持锁调用 call_soon_threadsafe
+        with self._readers_lock:
+            readers = list(self._readers)
+        for reader in readers:
+            if reader._waiting:
+                reader._wake()
+
+    def _copy(self, start: int, n: int) -> bytes:
+        pos = start % self._capacity
+        first = min(n, self._capacity - pos)
+        if first == n:
+            return bytes(self._view[pos:pos + n])
+        return bytes(self._view[pos:]) + bytes(self._view[:n - first])
+
+
+class RingReader:
+    """RingBuffer 上的独立读游标，供 asyncio 消费者使用"""
+
+    def __init__(self, ring: RingBuffer, start_pos: int):
+        self._ring = ring
+        self._pos = start_pos
+        # 等待方所在的事件循环在首次 wait 时绑定，因此游标可以在任意线程创建
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._thread_id: Optional[int] = None
+        self._event = asyncio.Event()
+        self._waiting = False
+        self.dropped = 0
+
+    @property
+    def ring(self) -> RingBuffer:
+        return self._ring
+
+    def available(self) -> int:
+        """当前可读字节数（不含已被覆盖的部分）"""
+        return min(self._ring.write_pos - self._pos, self._ring.capacity)
+
+    def at_eof(self) -> bool:
+        """缓冲区已关闭且数据已读完"""
+        return self._ring.closed and self._ring.write_pos == self._pos
+
+    def discard(self) -> int:
+        """丢弃所有未读数据，返回丢弃的字节数"""
+        skipped = self._ring.write_pos - self._pos
+        self._pos += skipped
+        return skipped
+
+    def read_nowait(self, size: int = -1) -> bytes:
+        """非阻塞读取最多 size 字节，无数据时返回空字节串"""
+        ring = self._ring
+        while True:
+            write_pos = ring.write_pos
+            # 进行中的写入会覆盖预留位置往前 capacity 字节之前的数据
+            lowest = ring.reserve_pos - ring.capacity
+            if lowest > write_pos:
+                # 进行中的写入超过容量、整圈覆盖了已发布的数据，等它完成后再读
+                return b""
+            start = self._pos
+            if start < lowest:
+                self.dropped += lowest - start
+                start = lowest
+            n = write_pos - start
+            if size >= 0:
+                n = min(n, size)
+            if n <= 0:
+                self._pos = start
+                return b""
+            data = ring._copy(start, n)
+            # 拷贝前后生产者若开始了覆盖起点的写入（预留位置已发布），数据可能不完整，重试
+            if ring.reserve_pos - ring.capacity > start:
+                self._pos = start
+                continue
+            self._pos = start + n
+            return data
+
+    async def wait(self, timeout: Optional[float] = None) -> bool:
+        """等待新数据到达，返回是否有数据可读"""
+        if self.available() > 0 or self._ring.closed:
+            return self.available() > 0
+        if self._loop is None:
+            self._loop = asyncio.get_running_loop()
+            self._thread_id = threading.get_ident()
+        self._event.clear()
+        self._waiting = True
+        try:
+            # 设置等待标记后再检查一次，避免错过生产者的通知
+            if self.available() > 0 or self._ring.closed:
+                return self.available() > 0
+            try:
+                await asyncio.wait_for(self._event.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+        finally:
+            self._waiting = False
+        return self.available() > 0
+
+    async def read(self, size: int = -1, timeout: Optional[float] = None) -> bytes:
+        """读取最多 size 字节，无数据时最多等待 timeout 秒，超时或关闭时返回空字节串"""
+        data = self.read_nowait(size)
+        if data or self._ring.closed:
+            return data
+        await self.wait(timeout)
+        return self.read_nowait(size)
+
+    def wakeup(self) -> None:
+        """唤醒正在 wait 的消费者（不产生数据），用于让其重新计算等待条件"""
+        if self._waiting:
+            self._wake()
+
+    def close(self) -> None:
+        self._ring._remove_reader(self)
+
+    def _wake(self) -> None:
+        if threading.get_ident() == self._thread_id:
+            # 生产者就在事件循环线程内（非阻塞传输），直接唤醒
+            self._event.set()
+            return
+        try:
+            self._loop.call_soon_threadsafe(self._event.set)
+        except RuntimeError:
+            # 事件循环已关闭
+            pass
@@ -0,0 +1,105 @@
+'''
+Author: nll
+Date: 2026-10-17
+Description: 终端输出的增量解码、按行组装与滚动回看缓冲区
+'''
+import codecs
+from typing import List, Optional, Tuple
+
+
+class LineAssembler:
+    """把串口原始字节增量解码为文本并切分成完整行。
+
+    解码器保留跨读取边界被截断的多字节字符，等后续字节到达后再输出；
+    非法字节替换为 U+FFFD，不会静默丢弃。只以 `\\n` 作为行结束，
+    单独的 `\\r`（进度条等）留在行内。超过 max_line 的未完结行强制成行。
+    """
+
+    def __init__(self, max_line: int = 64 * 1024):
+        self._decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+        self._partial = ""
+        self._max_line = max_line
+
+    @property
+    def partial(self) -> str:
+        """尚未遇到换行的最后一行"""
+        return self._partial
+
+    def feed(self, data: bytes) -> Tuple[str, List[str]]:
+        """处理一段原始数据，返回 (本段解码出的文本, 本段完成的行)"""
+        text = self._decoder.decode(data)
+        if not text:
+            return "", []
+        buf = self._partial + text
+        end = buf.rfind("\n")
+        if end < 0:
+            lines = []
+            self._partial = buf
+        else:
+            lines = [line + "\n" for line in buf[:end].split("\n")]
+            self._partial = buf[end + 1:]
+        if len(self._partial) > self._max_line:
+            lines.append(self._partial)
+            self._partial = ""
+        return text, lines
+
+    def reset(self) -> None:
+        self._decoder.reset()
+        self._partial = ""
+
+
+class ScrollbackBuffer:
+    """按序号索引的定长行缓冲区，保留最近 capacity 行。
+
+    每一行有一个单调递增的序号，序号为 seq 的行存放在 seq % capacity 处，
+    任意序号的定位都是 O(1)。
+    """
+
+    def __init__(self, capacity: int = 50000):
+        if capacity <= 0:
+            raise ValueError("capacity 必须大于 0")
+        self._capacity = capacity
+        self._lines: List[Optional[str]] = [None] * capacity
+        self._next_seq = 0
+
+    @property
+    def capacity(self) -> int:
+        return self._capacity
+
+    @property
+    def next_seq(self) -> int:
+        """下一行将获得的序号"""
+        return self._next_seq
+
+    @property
+    def first_seq(self) -> int:
+        """仍保留的最旧一行的序号"""
+        return max(0, self._next_seq - self._capacity)
+
+    def __len__(self) -> int:
+        return self._next_seq - self.first_seq
+
+    def extend(self, lines: List[str]) -> None:
+        capacity = self._capacity
+        # 一次超出容量时前部直接跳过，但序号照常累加
+        skip = max(0, len(lines) - capacity)
+        seq = self._next_seq + skip
+        for line in lines[skip:] if skip else lines:
+            self._lines[seq % capacity] = line
+            seq += 1
+        self._next_seq = seq
+
+    def since(self, seq: int, limit: Optional[int] = None) -> Tuple[int, List[str]]:
+        """返回 (实际起始序号, 行列表)；seq 早于最旧行时从最旧行开始，负数表示最近 -seq 行"""
+        first, end = self.first_seq, self._next_seq
+        if seq < 0:
+            seq = end + seq
+        start = min(max(seq, first), end)
+        if limit is not None:
+            end = min(end, start + max(0, limit))
+        if start >= end:
+            return start, []
+        lo, hi = start % self._capacity, end % self._capacity
+        if lo < hi:
+            return start, self._lines[lo:hi]
+        return start, self._lines[lo:] + self._lines[:hi]
@@ -0,0 +1,69 @@
+'''
+Author: nll
+Date: 2026-10-17
+Description: 串口接收数据分流：事务应答 / 终端输出
+'''
+import re
+from typing import Tuple
+
+
+# 寄存器读应答的数据行，如 "0x20470C04: FFB25233"、"20470c04:ffb25233"
+REPLY_DATA_LINE = re.compile(rb"^\s*(?:0[xX])?[0-9A-Fa-f]+\s*:\s*(?:0[xX])?[0-9A-Fa-f ]*\s*$")
+
+
+class ResponseDemux:
+    """按行把接收数据分成事务应答与终端输出。
+
+    有事务在途时，形如 `<addr>:<hex>` 的数据行和终止行（默认 `OK`）归事务，
+    每遇到一个终止行在途数减一，其余行（日志、回显、断言等）归终端；
+    不完整的行先缓存，等换行到达后再判断。没有在途事务时数据原样直通终端，
+    不做任何按行处理。
+    """
+
+    def __init__(self, max_partial: int = 4096):
+        self._partial = bytearray()
+        self._max_partial = max_partial
+
+    def feed(self, data: bytes, pending: int, terminator: bytes) -> Tuple[bytes, bytes, int]:
+        """处理一段数据，返回 (事务应答字节, 终端字节, 本段包含的终止行数)"""
+        if pending <= 0 and not self._partial:
+            return b"", data, 0
+
+        buf = self._partial + data if self._partial else bytearray(data)
+        self._partial = bytearray()
+        reply = bytearray()
+        terminal = bytearray()
+        terminator_line = terminator.strip()
+        completed = 0
+
+        start = 0
+        while True:
+            end = buf.find(b"\n", start)
+            if end < 0:
+                break
+            line = buf[start:end + 1]
+            start = end + 1
+            if pending - completed > 0:
+                stripped = line.strip()
+                if stripped == terminator_line:
+                    reply += line
+                    completed += 1
+                    continue
+                if stripped and REPLY_DATA_LINE.match(stripped):
+                    reply += line
+                    continue
+            terminal += line
+
+        rest = buf[start:]
+        if rest:
+            if pending - completed > 0 and len(rest) <= self._max_partial:
+                self._partial = bytearray(rest)
+            else:
+                terminal += rest
+        return bytes(reply), bytes(terminal), completed
+
+    def flush(self) -> bytes:
+        """取出缓存的不完整行（事务结束或失败时交给终端）"""
+        rest = bytes(self._partial)
+        self._partial = bytearray()
+        return rest
@@ -6,10 +6,17 @@ LastEditTime: 2025-10-10 14:29:05
 Description: 串口工具类
 '''
 import asyncio
+import codecs
+import concurrent.futures
 import threading
 from typing import Optional, List, TYPE_CHECKING
 from sqlalchemy.orm import Session
 
+from app.utils.ring_buffer import RingBuffer, RingReader
+from app.utils.serial_io import SerialReaderThread
+from app.utils.serial_transport import SerialFdTransport, SerialRxProtocol, native_transport_supported
+from app.utils.serial_scheduler import SerialScheduler, SerialTransaction, DEFAULT_TERMINATOR, PRIORITY_INTERACTIVE
+
 # For runtime, to handle cases where pyserial is not installed
 _serial_module = None
 _list_ports_func = None
@@ -29,12 +36,44 @@ if TYPE_CHECKING:
 class SerialHelper:
     """串口操作工具类"""
     
-    def __init__(self):
+    def __init__(self, rx_buffer_size: int = 1 << 20, backend: str = "auto", max_in_flight: int = 1,
+                 coalesce_bytes: int = 4096, max_wait: float = 0.2):
         self._serial: Optional["serial.Serial"] = None
         self._lock = threading.Lock()
         self._reader_task: Optional[asyncio.Task] = None
         self._stop_event = asyncio.Event()
         self._active_config_id: Optional[int] = None
+        # 接收侧：每个打开的串口一个 I/O 线程 + 环形缓冲区
+        self._rx_buffer_size = rx_buffer_size
+        self._rx_ring: Optional[RingBuffer] = None
+        # 终端缓冲区：原始数据经调度器分流后，去掉事务应答的剩余输出
+        self._terminal_ring: Optional[RingBuffer] = None
+        self._io_thread: Optional[SerialReaderThread] = None
+        self._default_reader: Optional[RingReader] = None
+        # 传输后端：thread 为独立 I/O 线程；native 为事件循环直接监听 tty fd（仅 POSIX）；
+        # auto 在可用时优先 native，否则回退到 thread
+        if backend not in ("auto", "thread", "native"):
+            raise ValueError(f"未知的串口传输后端: {backend}")
+        self._backend = backend
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._transport: Optional[SerialFdTransport] = None
+        self._protocol: Optional[SerialRxProtocol] = None
+        # 寄存器读写等请求/响应式命令统一经调度器收发，避免并发请求互相抢占响应
+        self._scheduler = SerialScheduler(self, max_in_flight=max_in_flight, coalesce_bytes=coalesce_bytes,
+                                          max_wait=max_wait)
+
+    def attach_loop(self, loop: asyncio.AbstractEventLoop) -> None:
+        """绑定应用事件循环，使在线程池中打开的串口也能注册到该循环"""
+        self._loop = loop
+
+    @property
+    def backend(self) -> str:
+        """当前串口实际使用的传输后端"""
+        if self._transport is not None:
+            return "native"
+        if self._io_thread is not None:
+            return "thread"
+        return self._backend
 
     def list_available_ports(self) -> List[str]:
         """列出可用串口"""
@@ -76,14 +115,80 @@ class SerialHelper:
             print(self._serial)
             self._stop_event = asyncio.Event()
 
+            ser = self._serial
+            ring = RingBuffer(self._rx_buffer_size)
+            self._rx_ring = ring
+            self._terminal_ring = RingBuffer(self._rx_buffer_size)
+            # 打开时即创建默认游标，之后到达的数据都不会漏掉
+            self._default_reader = ring.reader()
+
+        # 注册到事件循环时可能需要等待循环线程，不能持有 self._lock
+        try:
+            self._start_rx(ser, ring)
+        except Exception:
+            self.close_port()
+            raise
+
+    def _start_rx(self, ser, ring: RingBuffer) -> None:
+        """按后端配置启动接收：事件循环直接监听 fd，或启动 I/O 线程"""
+        loop = self._resolve_loop()
+        if self._backend != "thread" and loop is not None and native_transport_supported(ser):
+            protocol = SerialRxProtocol(ring)
+            transport = self._run_in_loop(loop, lambda: SerialFdTransport(loop, ser, protocol))
+            with self._lock:
+                self._transport = transport
+                self._protocol = protocol
+        else:
+            if self._backend == "native":
+                raise ValueError("当前平台或运行环境不支持原生串口传输")
+            io_thread = SerialReaderThread(ser, ring)
+            io_thread.start()
+            with self._lock:
+                self._io_thread = io_thread
+
+        # 调度器负责分流终端输出，串口打开后即需运行
+        if loop is not None:
+            self._run_in_loop(loop, self._scheduler.start)
+
+    def _resolve_loop(self) -> Optional[asyncio.AbstractEventLoop]:
+        try:
+            return asyncio.get_running_loop()
+        except RuntimeError:
+            if self._loop is not None and not self._loop.is_closed():
+                return self._loop
+            return None
+
+    @staticmethod
+    def _run_in_loop(loop: asyncio.AbstractEventLoop, func, timeout: float = 5.0):
+        """在事件循环线程内执行 func 并返回结果（可在任意线程调用）"""
+        try:
+            running = asyncio.get_running_loop()
+        except RuntimeError:
+            running = None
+        if running is loop:
+            return func()
+
+        future: concurrent.futures.Future = concurrent.futures.Future()
+
+        def _call():
+            try:
+                future.set_result(func())
+            except BaseException as e:
+                future.set_exception(e)
+
+        loop.call_soon_threadsafe(_call)
+        return future.result(timeout)
+
     def close_port(self) -> None:
         """关闭串口"""
         with self._lock:
-            if self._serial:
-                try:
-                    self._serial.close()
-                finally:
-                    self._serial = None
+            ser, self._serial = self._serial, None
+            io_thread, self._io_thread = self._io_thread, None
+            transport, self._transport = self._transport, None
+            self._protocol = None
+            ring, self._rx_ring = self._rx_ring, None
+            terminal_ring, self._terminal_ring = self._terminal_ring, None
+            self._default_reader = None
             if self._reader_task:
                 self._reader_task.cancel()
                 self._reader_task = None
@@ -91,6 +196,21 @@ class SerialHelper:
                 self._stop_event.set()
             self._active_config_id = None
 
+        # 先停止接收（fd 需在关闭前从事件循环注销），再关闭串口
+        if transport is not None:
+            try:
+                self._run_in_loop(transport.get_extra_info("loop"), transport.close)
+            except Exception:
+                pass
+        if io_thread is not None:
+            io_thread.stop()
+        if ring is not None:
+            ring.close()
+        if terminal_ring is not None:
+            terminal_ring.close()
+        if ser:
+            ser.close()
+
     def get_status(self) -> dict:
         """获取串口状态"""
         with self._lock:
@@ -105,12 +225,20 @@ class SerialHelper:
         }
 
     def write_data(self, data: str, append_newline: bool = True) -> int:
-        """写入数据"""
+        """写入数据（可在任意线程调用）"""
         with self._lock:
             if not self._serial or not self._serial.is_open:
                 raise ValueError("串口未打开")
             payload = (data + ("\r\n" if append_newline else "")).encode("utf-8")
-            return self._serial.write(payload)
+            transport = self._transport
+            if transport is None:
+                return self._serial.write(payload)
+        # 原生后端：经传输层写缓冲区写出（在事件循环线程内执行），与调度器的写入保持先后顺序，
+        # 不能绕过缓冲区直接写 fd；不持有 self._lock，避免与事件循环线程互相等待
+        if transport.is_closing():
+            raise ValueError("串口未打开")
+        self._run_in_loop(transport.get_extra_info("loop"), lambda: transport.write(payload))
+        return len(payload)
 
     async def async_write(self, data: str, append_newline: bool = True) -> int:
         """异步写入数据"""
@@ -118,53 +246,120 @@ class SerialHelper:
             raise ValueError("串口未打开")
         
         payload = (data + ("\r\n" if append_newline else "")).encode("utf-8")
+        return await self.async_write_bytes(payload)
+
+    async def async_write_bytes(self, payload: bytes) -> int:
+        """异步写入已编码的数据，一次调用对应一次写操作"""
+        if not self._serial or not self._serial.is_open:
+            raise ValueError("串口未打开")
+
+        transport, protocol = self._transport, self._protocol
+        if (transport is not None and not transport.is_closing()
+                and transport.get_extra_info("loop") is asyncio.get_running_loop()):
+            # 原生后端：直接写 fd，写不完时由事件循环等待可写，无线程切换
+            transport.write(payload)
+            await protocol.drain()
+            return len(payload)
         
         # 在线程池中运行阻塞的写入操作
         return await asyncio.to_thread(self._serial.write, payload)
 
-    async def async_read(self, size: int) -> bytes:
-        """异步读取数据"""
+    @property
+    def scheduler(self) -> SerialScheduler:
+        return self._scheduler
+
+    def submit(self, command: str, terminator: bytes = DEFAULT_TERMINATOR,
+               timeout: float = 3.0, window: Optional[int] = None,
+               priority: int = PRIORITY_INTERACTIVE) -> asyncio.Future:
+        """提交一条请求/响应式命令到串口调度器，返回响应 Future（不等待）；
+        window 为该命令发送时允许的在途命令数，priority 为优先级（见 SerialScheduler.submit）"""
         if not self._serial or not self._serial.is_open:
             raise ValueError("串口未打开")
-        
-        # 在线程池中运行阻塞的读取操作
-        return await asyncio.to_thread(self._serial.read, size)
+        return self._scheduler.submit(command, terminator, timeout, window, priority)
 
-    async def async_flush_input(self):
-        """异步清空输入缓冲区"""
+    def submit_transaction(self, command: str, terminator: bytes = DEFAULT_TERMINATOR,
+                           timeout: float = 3.0, window: Optional[int] = None,
+                           priority: int = PRIORITY_INTERACTIVE) -> SerialTransaction:
+        """同 submit，返回事务本身（调用方需要发送到应答的耗时时使用）"""
         if not self._serial or not self._serial.is_open:
             raise ValueError("串口未打开")
-        
-        # 在线程池中运行阻塞的清空操作
-        await asyncio.to_thread(self._serial.reset_input_buffer)
+        return self._scheduler.submit_transaction(command, terminator, timeout, window, priority)
 
-    async def start_reading(self, callback_func):
-        """开始读取串口数据"""
+    async def transact(self, command: str, terminator: bytes = DEFAULT_TERMINATOR,
+                       timeout: float = 3.0, priority: int = PRIORITY_INTERACTIVE) -> bytes:
+        """发送命令并等待以 terminator 结尾的响应，超时抛出 TimeoutError"""
+        return await self.submit(command, terminator, timeout, priority=priority)
+
+    def open_reader(self) -> Optional[RingReader]:
+        """在终端缓冲区上创建读游标（不含寄存器事务应答），串口未打开时返回 None"""
+        with self._lock:
+            ring = self._terminal_ring
+        if ring is None or ring.closed:
+            return None
+        try:
+            asyncio.get_running_loop()
+        except RuntimeError:
+            pass
+        else:
+            # 未绑定应用事件循环时（如独立脚本），由首个终端读者拉起分流任务
+            self._scheduler.start()
+        return ring.reader()
+
+    def open_raw_reader(self) -> Optional[RingReader]:
+        """在原始接收缓冲区上创建读游标（包含全部字节），串口未打开时返回 None"""
+        with self._lock:
+            ring = self._rx_ring
+        if ring is None or ring.closed:
+            return None
+        return ring.reader()
+
+    def _get_default_reader(self) -> RingReader:
+        """async_read / async_flush_input 共用的读游标"""
+        with self._lock:
+            ring = self._rx_ring
+            if not self._serial or not self._serial.is_open or ring is None:
+                raise ValueError("串口未打开")
+            if self._default_reader is None or self._default_reader.ring is not ring:
+                self._default_reader = ring.reader()
+            return self._default_reader
+
+    async def async_read(self, size: int) -> bytes:
+        """异步读取数据，无数据时最多等待串口超时时间"""
+        reader = self._get_default_reader()
+        timeout = self._serial.timeout if self._serial else None
+        # 数据由 I/O 线程写入环形缓冲区，这里只等待唤醒，不再占用线程池
+        return await reader.read(size, timeout)
+
+    async def async_flush_input(self):
+        """异步清空输入缓冲区"""
+        # 已被 I/O 线程搬入缓冲区的数据直接跳过即可
+        self._get_default_reader().discard()
+
+    async def start_reading(self, callback_func, raw: bool = False):
+        """开始读取串口数据，raw 为 True 时回调收到原始字节而非解码后的文本"""
+        read_size = 64 * 1024 if raw else 4096
         try:
             while True:
-                await asyncio.sleep(0)
-                with self._lock:
-                    ser = self._serial
-                
-                if not ser or not ser.is_open:
+                reader = self.open_reader()
+                if reader is None:
                     await asyncio.sleep(0.1)
                     continue
-                
+
+                # 增量解码：跨读取边界的多字节字符不会被截断丢弃
+                decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
                 try:
-                    data = ser.read(1024)
-                except Exception:
-                    await asyncio.sleep(0.05)
-                    continue
-                
-                if data:
-                    try:
-                        text = data.decode("utf-8", errors="ignore")
-                    except Exception:
-                        text = ""
-                    if text and callback_func:
-                        await callback_func(text)
-                else:
-                    await asyncio.sleep(0.01)
+                    while not reader.at_eof():
+                        data = await reader.read(read_size)
+                        if not data:
+                            continue
+                        if raw:
+                            await callback_func(data)
+                            continue
+                        text = decoder.decode(data)
+                        if text and callback_func:
+                            await callback_func(text)
+                finally:
+                    reader.close()
         except asyncio.CancelledError:
             return
 
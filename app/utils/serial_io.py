@@ -0,0 +1,54 @@
+'''
+Author: nll
+Date: 2026-10-17
+Description: 串口 I/O 线程，把 UART 数据持续搬运到接收环形缓冲区
+'''
+import threading
+from typing import Optional
+
+from app.utils.ring_buffer import RingBuffer
+
+
+class SerialReaderThread(threading.Thread):
+    """每个已打开串口对应一个读线程。
+
+    线程内阻塞在 ser.read 上，数据到达后立即写入 RingBuffer，由缓冲区通过
+    call_soon_threadsafe 唤醒事件循环中的消费者，事件循环本身从不阻塞在串口上。
+    """
+
+    def __init__(self, ser, ring: RingBuffer):
+        super().__init__(name=f"serial-io-{getattr(ser, 'port', '')}", daemon=True)
+        self._ser = ser
+        self._ring = ring
+        self._stop_event = threading.Event()
+        self.error: Optional[Exception] = None
+
+    @property
+    def ring(self) -> RingBuffer:
+        return self._ring
+
+    def run(self) -> None:
+        ser = self._ser
+        try:
+            while not self._stop_event.is_set():
+                # 先阻塞等待 1 字节（受串口 timeout 约束，便于检查停止标志），
+                # 再一次性取走驱动缓冲区中已有的全部数据
+                data = ser.read(1)
+                if not data:
+                    continue
+                waiting = ser.in_waiting
+                if waiting:
+                    data += ser.read(waiting)
+                self._ring.write(data)
+        except Exception as e:
+            # 串口被拔出或关闭时 read 会抛异常，结束线程即可
+            if not self._stop_event.is_set():
+                self.error = e
+        finally:
+            self._ring.close()
+
+    def stop(self, timeout: float = 1.0) -> None:
+        """请求线程退出并等待其结束"""
+        self._stop_event.set()
+        if self.is_alive() and threading.current_thread() is not self:
+            self.join(timeout)
@@ -0,0 +1,392 @@
+'''
+Author: nll
+Date: 2026-10-17
+Description: 串口事务调度器：串行化并流水线化寄存器读写命令
+'''
+import asyncio
+from collections import deque
+from typing import Deque, Dict, List, Optional, TYPE_CHECKING
+
+from app.utils.ring_buffer import RingReader
+from app.utils.serial_demux import ResponseDemux
+
+if TYPE_CHECKING:
+    from app.utils.serial_helper import SerialHelper
+
+
+DEFAULT_TERMINATOR = b"OK\r\n"
+
+# 事务优先级，数值越小越先发送
+PRIORITY_INTERACTIVE = 0  # 单个寄存器读写等交互操作
+PRIORITY_POLL = 1         # 寄存器监视等周期轮询
+PRIORITY_BULK = 2         # 批量读写
+PRIORITY_NAMES = ("interactive", "poll", "bulk")
+# 每个优先级保留最近多少个事务的延迟样本用于计算分位数
+LATENCY_SAMPLES = 1024
+
+
+def _encode_command(command: str) -> bytes:
+    return (command + "\r\n").encode("utf-8")
+
+
+def _percentiles(samples, quantiles=(0.5, 0.9, 0.99)) -> Dict[str, float]:
+    """样本（秒）的分位数与最大值，单位毫秒"""
+    if not samples:
+        return {}
+    ordered = sorted(samples)
+    result = {f"p{round(q * 100)}": round(ordered[min(len(ordered) - 1, int(q * len(ordered)))] * 1000, 3)
+              for q in quantiles}
+    result["max"] = round(ordered[-1] * 1000, 3)
+    return result
+
+
+class SerialTransaction:
+    """一条串口命令及其等待的响应，window 非空时覆盖调度器的 max_in_flight"""
+
+    __slots__ = ("command", "terminator", "timeout", "future", "deadline", "window",
+                 "priority", "submitted", "sent", "completed")
+
+    def __init__(self, command: str, terminator: bytes, timeout: float, future: asyncio.Future,
+                 window: Optional[int] = None, priority: int = PRIORITY_INTERACTIVE):
+        self.command = command
+        self.terminator = terminator
+        self.timeout = timeout
+        self.future = future
+        self.deadline: Optional[float] = None
+        self.window = window
+        self.priority = priority
+        self.submitted = 0.0
+        self.sent = 0.0
+        self.completed = 0.0
+
+    @property
+    def service_time(self) -> Optional[float]:
+        """从发出命令到收到完整响应的秒数（不含排队等待），未完成时为 None"""
+        if not self.sent or not self.completed:
+            return None
+        return self.completed - self.sent
+
+
+class SerialScheduler:
+    """每个串口一个调度器，独占该串口的命令收发。
+
+    调用方提交事务时指定优先级（交互 / 轮询 / 批量），发送任务每次从优先级最高的非空队列取出
+    下一条命令，同一优先级内按提交顺序；批量读写逐块提交，交互命令因此能插在两个块之间发送。
+    低优先级队首等待超过 max_wait 秒、且该优先级已有 max_wait 秒未发送时先发它一条，避免饿死。
+    最多允许 max_in_flight 条命令同时等待响应；接收任务从接收缓冲区按终止符切分响应，并按先进先出顺序交还
+    给对应事务（设备按命令顺序应答）。任一事务超时后无法再对齐后续响应，
+    此时所有在途事务都会失败。
+
+    窗口允许多条命令同时在途时，发送任务把连续的待发命令（不超过 coalesce_bytes 字节）
+    拼成一个缓冲区一次写出，减少系统调用与线程切换；事务仍逐条进入在途队列，
+    确认按顺序对应到各自的命令。
+
+    接收任务同时是该串口原始数据的唯一分流点：经 ResponseDemux 把应答行交给
+    事务，其余输出写入终端缓冲区，终端因此可以在批量读写期间保持打开。
+    """
+
+    def __init__(self, helper: "SerialHelper", max_in_flight: int = 1, coalesce_bytes: int = 4096,
+                 max_wait: float = 0.2):
+        self._helper = helper
+        self._max_in_flight = max(1, max_in_flight)
+        # 窗口允许多条命令同时在途时，合并进一次写入的最大字节数，0 表示每条命令单独写入
+        self._coalesce_bytes = max(0, coalesce_bytes)
+        # 低优先级事务的最长排队时间（秒），超过后插队发送一条
+        self._max_wait = max_wait
+        self._queues: List[Deque[SerialTransaction]] = [deque() for _ in PRIORITY_NAMES]
+        self._last_sent = [0.0] * len(PRIORITY_NAMES)
+        self._class_stats = [{"submitted": 0, "completed": 0, "promoted": 0} for _ in PRIORITY_NAMES]
+        self._latency: List[Deque[float]] = [deque(maxlen=LATENCY_SAMPLES) for _ in PRIORITY_NAMES]
+        self._queue_wait: List[Deque[float]] = [deque(maxlen=LATENCY_SAMPLES) for _ in PRIORITY_NAMES]
+        self._in_flight: Deque[SerialTransaction] = deque()
+        self._rx = bytearray()
+        self._scan_pos = 0
+        self._demux = ResponseDemux()
+        self._reader: Optional[RingReader] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._send_event: Optional[asyncio.Event] = None
+        self._tasks: list = []
+        self._stats = {"submitted": 0, "completed": 0, "timeouts": 0, "errors": 0,
+                       "writes": 0, "coalesced": 0}
+
+    @property
+    def max_in_flight(self) -> int:
+        return self._max_in_flight
+
+    @max_in_flight.setter
+    def max_in_flight(self, value: int) -> None:
+        self._max_in_flight = max(1, int(value))
+        self._notify_sender()
+
+    def stats(self) -> dict:
+        """调度器计数、当前队列深度与各优先级的延迟分位数（提交到完成 / 提交到发送，毫秒）"""
+        return {
+            **self._stats,
+            "pending": sum(len(q) for q in self._queues),
+            "in_flight": len(self._in_flight),
+            "max_in_flight": self._max_in_flight,
+            "max_wait_ms": round(self._max_wait * 1000, 3),
+            "classes": {
+                name: {
+                    **self._class_stats[i],
+                    "pending": len(self._queues[i]),
+                    "latency_ms": _percentiles(self._latency[i]),
+                    "queue_wait_ms": _percentiles(self._queue_wait[i]),
+                }
+                for i, name in enumerate(PRIORITY_NAMES)
+            },
+        }
+
+    def submit(self, command: str, terminator: bytes = DEFAULT_TERMINATOR,
+               timeout: float = 3.0, window: Optional[int] = None,
+               priority: int = PRIORITY_INTERACTIVE) -> asyncio.Future:
+        """提交事务，返回在收到完整响应（含终止符）时完成的 Future（参数见 submit_transaction）"""
+        return self.submit_transaction(command, terminator, timeout, window, priority).future
+
+    def submit_transaction(self, command: str, terminator: bytes = DEFAULT_TERMINATOR,
+                           timeout: float = 3.0, window: Optional[int] = None,
+                           priority: int = PRIORITY_INTERACTIVE) -> SerialTransaction:
+        """提交事务并返回它，完成后可从 service_time 取发送到应答的耗时。
+
+        window 为该事务发送时允许的在途命令数（信用窗口），用于批量写入等
+        设备能按顺序缓存命令的场景；为空时使用调度器的 max_in_flight。
+        priority 为 PRIORITY_INTERACTIVE / PRIORITY_POLL / PRIORITY_BULK 之一。
+        """
+        self.start()
+        priority = min(max(int(priority), 0), len(PRIORITY_NAMES) - 1)
+        future = self._loop.create_future()
+        tx = SerialTransaction(command, terminator, timeout, future,
+                               max(1, window) if window else None, priority)
+        tx.submitted = self._loop.time()
+        self._queues[priority].append(tx)
+        self._stats["submitted"] += 1
+        self._class_stats[priority]["submitted"] += 1
+        self._notify_sender()
+        return tx
+
+    async def transact(self, command: str, terminator: bytes = DEFAULT_TERMINATOR,
+                       timeout: float = 3.0, priority: int = PRIORITY_INTERACTIVE) -> bytes:
+        """提交事务并等待响应"""
+        return await self.submit(command, terminator, timeout, priority=priority)
+
+    def stop(self) -> None:
+        """停止调度任务，所有未完成事务以 ConnectionError 结束"""
+        for task in self._tasks:
+            task.cancel()
+        self._tasks = []
+        self._fail_in_flight(ConnectionError("串口调度器已停止"))
+        for queue in self._queues:
+            while queue:
+                tx = queue.popleft()
+                if not tx.future.done():
+                    tx.future.set_exception(ConnectionError("串口调度器已停止"))
+        if self._reader is not None:
+            self._reader.close()
+            self._reader = None
+
+    def start(self) -> None:
+        """在当前事件循环中启动收发任务（已启动时直接返回）"""
+        loop = asyncio.get_running_loop()
+        if self._tasks and self._loop is loop and not any(t.done() for t in self._tasks):
+            return
+        self._loop = loop
+        self._send_event = asyncio.Event()
+        self._tasks = [
+            loop.create_task(self._send_loop()),
+            loop.create_task(self._receive_loop()),
+        ]
+
+    def _send_limit(self, tx: SerialTransaction) -> int:
+        return tx.window if tx.window is not None else self._max_in_flight
+
+    def _select_queue(self) -> Optional[Deque[SerialTransaction]]:
+        """选出下一条命令所在的队列：优先级最高的非空队列；低优先级饿死时改为它"""
+        chosen = None
+        now = self._loop.time()
+        for priority, queue in enumerate(self._queues):
+            while queue and queue[0].future.done():
+                queue.popleft()
+            if not queue:
+                continue
+            if chosen is None:
+                chosen = queue
+                continue
+            if (now - queue[0].submitted >= self._max_wait
+                    and now - self._last_sent[priority] >= self._max_wait):
+                self._class_stats[priority]["promoted"] += 1
+                return queue
+        return chosen
+
+    def _notify_sender(self) -> None:
+        if self._send_event is not None:
+            self._send_event.set()
+
+    def _current_reader(self) -> Optional[RingReader]:
+        """返回当前串口接收缓冲区上的读游标，串口重开后自动切换"""
+        ring = self._helper._rx_ring
+        if ring is None or ring.closed:
+            return None
+        if self._reader is None or self._reader.ring is not ring:
+            if self._reader is not None:
+                self._reader.close()
+            self._reader = ring.reader()
+            self._reset_rx()
+            self._demux.flush()
+        return self._reader
+
+    def _reset_rx(self) -> None:
+        self._rx.clear()
+        self._scan_pos = 0
+
+    def _emit_terminal(self, data: bytes) -> None:
+        ring = self._helper._terminal_ring
+        if data and ring is not None:
+            ring.write(data)
+
+    def _pump(self, reader: RingReader) -> None:
+        """取走原始接收数据并分流到事务应答缓冲区与终端"""
+        data = reader.read_nowait()
+        if not data:
+            return
+        pending = len(self._in_flight)
+        terminator = self._in_flight[0].terminator if pending else DEFAULT_TERMINATOR
+        reply, terminal, _ = self._demux.feed(data, pending, terminator)
+        if terminal:
+            self._emit_terminal(terminal)
+        if reply:
+            self._rx.extend(reply)
+            self._match_responses()
+
+    async def _send_loop(self) -> None:
+        event = self._send_event
+        while True:
+            queue = self._select_queue()
+            while not (queue and len(self._in_flight) < self._send_limit(queue[0])):
+                event.clear()
+                await event.wait()
+                queue = self._select_queue()
+            tx = queue.popleft()
+
+            reader = self._current_reader()
+            if reader is None:
+                tx.future.set_exception(ValueError("串口未打开"))
+                continue
+            if not self._in_flight:
+                # 发送前先把已到达的数据分流出去，它们不可能是本事务的应答
+                self._pump(reader)
+
+            batch = self._take_batch(tx, queue)
+            # 发送时间与截止时间在写入前登记：线程后端写入返回前应答就可能到达并被匹配
+            sent = self._loop.time()
+            self._last_sent[tx.priority] = sent
+            for t in batch:
+                t.sent = sent
+                t.deadline = sent + t.timeout
+            self._in_flight.extend(batch)
+            payload = b"".join(_encode_command(t.command) for t in batch)
+            try:
+                await self._helper.async_write_bytes(payload)
+            except Exception as e:
+                self._stats["errors"] += 1
+                for t in batch:
+                    if t in self._in_flight:
+                        self._in_flight.remove(t)
+                    if not t.future.done():
+                        t.future.set_exception(e)
+                continue
+            self._stats["writes"] += 1
+            self._stats["coalesced"] += len(batch) - 1
+            # 让接收任务按新的截止时间重新等待
+            reader.wakeup()
+
+    def _take_batch(self, first: SerialTransaction, queue: Deque[SerialTransaction]) -> List[SerialTransaction]:
+        """在信用窗口允许的范围内，把同一队列中紧随其后的事务合并进同一次写入（保持提交顺序）"""
+        batch = [first]
+        if self._coalesce_bytes <= 0:
+            return batch
+        size = len(first.command) + 2
+        while queue:
+            nxt = queue[0]
+            if nxt.future.done():
+                queue.popleft()
+                continue
+            if len(self._in_flight) + len(batch) >= self._send_limit(nxt):
+                break
+            size += len(nxt.command) + 2
+            if size > self._coalesce_bytes:
+                break
+            batch.append(queue.popleft())
+        return batch
+
+    async def _receive_loop(self) -> None:
+        while True:
+            reader = self._current_reader()
+            if reader is None:
+                self._fail_in_flight(ConnectionError("串口已关闭"))
+                await asyncio.sleep(0.1)
+                continue
+
+            timeout = None
+            if self._in_flight:
+                deadline = self._in_flight[0].deadline
+                timeout = 0.01 if deadline is None else max(0.0, deadline - self._loop.time())
+            await reader.wait(timeout)
+            self._pump(reader)
+
+            if reader.at_eof():
+                self._fail_in_flight(ConnectionError("串口已关闭"))
+                continue
+
+            if self._in_flight:
+                head = self._in_flight[0]
+                if head.deadline is not None and self._loop.time() >= head.deadline:
+                    self._stats["timeouts"] += 1
+                    terminator = head.terminator.decode(errors="ignore").strip()
+                    self._fail_in_flight(
+                        TimeoutError(f"Timeout waiting for response terminator '{terminator}'")
+                    )
+
+    def _match_responses(self) -> None:
+        completed = False
+        while self._in_flight:
+            tx = self._in_flight[0]
+            idx = self._rx.find(tx.terminator, self._scan_pos)
+            if idx < 0:
+                # 下次从可能包含终止符开头的位置继续扫描
+                self._scan_pos = max(0, len(self._rx) - len(tx.terminator) + 1)
+                break
+            end = idx + len(tx.terminator)
+            response = bytes(self._rx[:end])
+            del self._rx[:end]
+            self._scan_pos = 0
+            self._in_flight.popleft()
+            completed = True
+            tx.completed = self._loop.time()
+            self._stats["completed"] += 1
+            self._record_latency(tx)
+            if not tx.future.done():
+                tx.future.set_result(response)
+        if not self._in_flight and self._rx:
+            # 没有等待中的事务，剩余的是非请求输出
+            self._emit_terminal(bytes(self._rx))
+            self._reset_rx()
+        if completed:
+            self._notify_sender()
+
+    def _record_latency(self, tx: SerialTransaction) -> None:
+        priority = tx.priority
+        self._class_stats[priority]["completed"] += 1
+        self._latency[priority].append(tx.completed - tx.submitted)
+        self._queue_wait[priority].append(tx.sent - tx.submitted)
+
+    def _fail_in_flight(self, exc: Exception) -> None:
+        if not self._in_flight:
+            return
+        while self._in_flight:
+            tx = self._in_flight.popleft()
+            if not tx.future.done():
+                tx.future.set_exception(exc)
+        # 未能归属的应答片段交还终端，方便排查
+        self._emit_terminal(bytes(self._rx) + self._demux.flush())
+        self._reset_rx()
+        self._notify_sender()
@@ -0,0 +1,219 @@
+'''
+Author: nll
+Date: 2026-10-17
+Description: 基于 loop.add_reader/add_writer 的非阻塞串口传输（仅 POSIX）
+'''
+import asyncio
+import os
+from typing import Optional
+
+from app.utils.ring_buffer import RingBuffer
+
+
+def native_transport_supported(ser) -> bool:
+    """判断串口对象能否直接注册到事件循环（Linux/macOS 下 pyserial 以 O_NONBLOCK 打开 tty）"""
+    if os.name != "posix":
+        return False
+    try:
+        return ser.fileno() >= 0
+    except Exception:
+        return False
+
+
+class SerialFdTransport(asyncio.Transport):
+    """把 tty 文件描述符直接挂到事件循环上的最小 Transport 实现。
+
+    可读时在事件循环线程内 os.read 并交给 protocol，写入优先直接 os.write，
+    写不完的部分缓存并通过 add_writer 等待可写，超过高水位时暂停 protocol 写入。
+    串口本身的打开/关闭仍由 SerialHelper 负责。
+    """
+
+    max_read_size = 64 * 1024
+
+    def __init__(self, loop: asyncio.AbstractEventLoop, ser, protocol: asyncio.Protocol,
+                 high_water: int = 64 * 1024):
+        super().__init__(extra={"serial": ser, "loop": loop})
+        self._loop = loop
+        self._fd = ser.fileno()
+        self._protocol = protocol
+        self._write_buffer = bytearray()
+        self._high_water = high_water
+        self._low_water = high_water // 4
+        self._protocol_paused = False
+        self._reading = True
+        self._closing = False
+
+        protocol.connection_made(self)
+        loop.add_reader(self._fd, self._read_ready)
+
+    def get_protocol(self) -> asyncio.BaseProtocol:
+        return self._protocol
+
+    def set_protocol(self, protocol: asyncio.BaseProtocol) -> None:
+        self._protocol = protocol
+
+    def is_closing(self) -> bool:
+        return self._closing
+
+    def is_reading(self) -> bool:
+        return self._reading and not self._closing
+
+    def pause_reading(self) -> None:
+        if self._closing or not self._reading:
+            return
+        self._reading = False
+        self._loop.remove_reader(self._fd)
+
+    def resume_reading(self) -> None:
+        if self._closing or self._reading:
+            return
+        self._reading = True
+        self._loop.add_reader(self._fd, self._read_ready)
+
+    def get_write_buffer_size(self) -> int:
+        return len(self._write_buffer)
+
+    def set_write_buffer_limits(self, high: Optional[int] = None, low: Optional[int] = None) -> None:
+        self._high_water = 64 * 1024 if high is None else high
+        self._low_water = self._high_water // 4 if low is None else low
+        self._maybe_pause_protocol()
+
+    def write(self, data) -> None:
+        if self._closing or not data:
+            return
+        if not self._write_buffer:
+            try:
+                n = os.write(self._fd, data)
+            except (BlockingIOError, InterruptedError):
+                n = 0
+            except OSError as exc:
+                self._fatal_error(exc)
+                return
+            if n == len(data):
+                return
+            data = memoryview(data)[n:]
+            self._loop.add_writer(self._fd, self._write_ready)
+        self._write_buffer.extend(data)
+        self._maybe_pause_protocol()
+
+    def can_write_eof(self) -> bool:
+        return False
+
+    def close(self) -> None:
+        """停止监听 fd 并通知 protocol，尚未写出的数据直接丢弃"""
+        if self._closing:
+            return
+        self._closing = True
+        self._loop.remove_reader(self._fd)
+        self._loop.remove_writer(self._fd)
+        self._write_buffer.clear()
+        self._loop.call_soon(self._call_connection_lost, None)
+
+    def abort(self) -> None:
+        self.close()
+
+    def _read_ready(self) -> None:
+        try:
+            data = os.read(self._fd, self.max_read_size)
+        except (BlockingIOError, InterruptedError):
+            return
+        except OSError as exc:
+            self._fatal_error(exc)
+            return
+        if not data:
+            # tty 挂断（设备被拔出）
+            self.close()
+            return
+        self._protocol.data_received(data)
+
+    def _write_ready(self) -> None:
+        try:
+            n = os.write(self._fd, self._write_buffer)
+        except (BlockingIOError, InterruptedError):
+            return
+        except OSError as exc:
+            self._fatal_error(exc)
+            return
+        del self._write_buffer[:n]
+        if not self._write_buffer:
+            self._loop.remove_writer(self._fd)
+        self._maybe_resume_protocol()
+
+    def _maybe_pause_protocol(self) -> None:
+        if not self._protocol_paused and len(self._write_buffer) > self._high_water:
+            self._protocol_paused = True
+            self._protocol.pause_writing()
+
+    def _maybe_resume_protocol(self) -> None:
+        if self._protocol_paused and len(self._write_buffer) <= self._low_water:
+            self._protocol_paused = False
+            self._protocol.resume_writing()
+
+    def _fatal_error(self, exc: Exception) -> None:
+        if self._closing:
+            return
+        self._closing = True
+        self._loop.remove_reader(self._fd)
+        self._loop.remove_writer(self._fd)
+        self._write_buffer.clear()
+        self._loop.call_soon(self._call_connection_lost, exc)
+
+    def _call_connection_lost(self, exc: Optional[Exception]) -> None:
+        self._protocol.connection_lost(exc)
+
+
+class SerialRxProtocol(asyncio.Protocol):
+    """把收到的数据写入 RingBuffer，并提供写入背压（drain）"""
+
+    def __init__(self, ring: RingBuffer):
+        self._ring = ring
+        self._transport: Optional[SerialFdTransport] = None
+        self._paused = False
+        self._drain_waiter: Optional[asyncio.Future] = None
+        self._exc: Optional[Exception] = None
+        self._lost = False
+
+    @property
+    def ring(self) -> RingBuffer:
+        return self._ring
+
+    def connection_made(self, transport: asyncio.BaseTransport) -> None:
+        self._transport = transport
+
+    def data_received(self, data: bytes) -> None:
+        self._ring.write(data)
+
+    def connection_lost(self, exc: Optional[Exception]) -> None:
+        self._lost = True
+        self._exc = exc
+        self._ring.close()
+        self._wake_drain(exc)
+
+    def pause_writing(self) -> None:
+        self._paused = True
+
+    def resume_writing(self) -> None:
+        self._paused = False
+        self._wake_drain(None)
+
+    async def drain(self) -> None:
+        """等待写缓冲降到低水位以下"""
+        if self._lost:
+            raise ConnectionError(f"串口连接已断开: {self._exc}" if self._exc else "串口连接已断开")
+        if not self._paused:
+            return
+        waiter = self._drain_waiter
+        if waiter is None or waiter.done():
+            waiter = asyncio.get_running_loop().create_future()
+            self._drain_waiter = waiter
+        await waiter
+
+    def _wake_drain(self, exc: Optional[Exception]) -> None:
+        waiter = self._drain_waiter
+        self._drain_waiter = None
+        if waiter is None or waiter.done():
+            return
+        if exc is None and not self._lost:
+            waiter.set_result(None)
+        else:
+            waiter.set_exception(ConnectionError("串口连接已断开"))
@@ -0,0 +1,174 @@
+'''
+Author: nll
+Date: 2026-10-17
+Description: 终端输出触发器：每条规则独立匹配，合并正则预筛，无命中的数据只扫描一次
+'''
+import bisect
+import re
+from typing import Any, Dict, Hashable, Iterator, List, Optional, Tuple
+
+
+_NAMED_GROUP = re.compile(r"\(\?P<")
+# 按编号引用分组：\1..\99 反向引用（前面的反斜杠个数为偶数）与 (?(1)...) 条件分组。
+# 合并进预筛后分组会重新编号，这类规则不参与预筛；字符类中的八进制转义会被误判，只是少一次预筛
+_GROUP_REF = re.compile(r"(?<!\\)(?:\\\\)*\\[1-9]|\(\?\(")
+
+
+class Trigger:
+    """一条触发规则，owner 是注册它的订阅者"""
+
+    __slots__ = ("id", "pattern", "regex", "ignore_case", "owner", "group", "group_count", "hits")
+
+    def __init__(self, trigger_id: str, pattern: str, regex: bool, ignore_case: bool, owner: Hashable):
+        self.id = trigger_id
+        self.pattern = pattern
+        self.regex = regex
+        self.ignore_case = ignore_case
+        self.owner = owner
+        self.group = ""
+        self.group_count = 0
+        self.hits = 0
+
+    def source(self) -> str:
+        body = self.pattern if self.regex else re.escape(self.pattern)
+        return f"(?i:{body})" if self.ignore_case else body
+
+
+class TriggerMatch:
+    """一次命中：line_index 为该批内的行下标，start/end 与 groups 均为行内字符偏移"""
+
+    __slots__ = ("trigger", "line_index", "start", "end", "text", "groups")
+
+    def __init__(self, trigger: Trigger, line_index: int, start: int, end: int, text: str,
+                 groups: List[Optional[Tuple[int, int]]]):
+        self.trigger = trigger
+        self.line_index = line_index
+        self.start = start
+        self.end = end
+        self.text = text
+        self.groups = groups
+
+    def to_event(self, seq: int) -> Dict[str, Any]:
+        return {
+            "type": "trigger",
+            "id": self.trigger.id,
+            "seq": seq,
+            "span": [self.start, self.end],
+            "match": self.text,
+            "groups": [list(g) if g else None for g in self.groups],
+        }
+
+
+class TriggerMatcher:
+    """所有订阅者的触发规则。
+
+    每条规则单独编译、单独在整批文本上 finditer，规则之间互不遮挡：同一段文本
+    可同时命中多条规则（包括不同订阅者的重叠规则），每条规则的命中只与自身有关。
+    另把规则合并成一个交替正则作为预筛：一批行中任何规则都不匹配时只需一次扫描，
+    有命中时参与预筛的规则从预筛找到的最早位置开始扫描。按编号引用分组的规则（反向引用、
+    条件分组）合并后编号会错位，不参与预筛，总是从头扫描。命中按起始位置、同位置按注册顺序产出。
+    用户正则中不允许命名分组（会与预筛的外层分组冲突），普通捕获分组照常报告偏移。
+    """
+
+    def __init__(self):
+        self._triggers: List[Trigger] = []
+        self._patterns: List[re.Pattern] = []
+        # 与 _triggers 对应：该规则是否包含在预筛中
+        self._prefiltered: List[bool] = []
+        self._prefilter: Optional[re.Pattern] = None
+
+    def __bool__(self) -> bool:
+        return bool(self._triggers)
+
+    def __len__(self) -> int:
+        return len(self._triggers)
+
+    def set_triggers(self, owner: Hashable, specs: List[Dict[str, Any]]) -> List[Trigger]:
+        """替换 owner 的全部规则；任一规则无效时抛出 ValueError 且不做任何修改"""
+        new_triggers = []
+        for i, spec in enumerate(specs):
+            pattern = spec.get("pattern")
+            if not isinstance(pattern, str) or not pattern:
+                raise ValueError(f"第 {i} 条触发规则缺少 pattern")
+            regex = bool(spec.get("regex", False))
+            trigger = Trigger(str(spec.get("id", i)), pattern, regex,
+                              bool(spec.get("ignore_case", False)), owner)
+            if regex:
+                if _NAMED_GROUP.search(pattern):
+                    raise ValueError(f"触发规则 {trigger.id} 不支持命名分组")
+                try:
+                    trigger.group_count = re.compile(pattern).groups
+                except re.error as e:
+                    raise ValueError(f"触发规则 {trigger.id} 正则无效: {e}")
+            new_triggers.append(trigger)
+
+        triggers = [t for t in self._triggers if t.owner != owner] + new_triggers
+        try:
+            self._rebuild(triggers)
+        except re.error as e:
+            raise ValueError(f"触发规则无效: {e}")
+        return new_triggers
+
+    def remove_owner(self, owner: Hashable) -> None:
+        triggers = [t for t in self._triggers if t.owner != owner]
+        if len(triggers) != len(self._triggers):
+            self._rebuild(triggers)
+
+    def _rebuild(self, triggers: List[Trigger]) -> None:
+        patterns = [re.compile(t.source()) for t in triggers]
+        prefiltered = [not (t.regex and _GROUP_REF.search(t.pattern)) for t in triggers]
+        sources = [f"(?:{t.source()})" for t, p in zip(triggers, prefiltered) if p]
+        try:
+            prefilter = re.compile("|".join(sources)) if sources else None
+        except re.error:
+            # 例如规则中间出现 (?i) 这类全局标志，单独编译可以、合并后不行：不做预筛
+            prefilter = None
+        if prefilter is None:
+            prefiltered = [False] * len(triggers)
+        self._triggers, self._patterns, self._prefilter = triggers, patterns, prefilter
+        self._prefiltered = prefiltered
+
+    def scan(self, lines: List[str]) -> Iterator[TriggerMatch]:
+        """在一批完整行上逐条规则匹配，命中跨行时归属起始行"""
+        if not self._triggers or not lines:
+            return
+        text = "".join(lines)
+        first = 0
+        if self._prefilter is not None:
+            m = self._prefilter.search(text)
+            if m is None:
+                if all(self._prefiltered):
+                    return
+                # 参与预筛的规则都不会命中，只扫描其余规则
+                first = len(text) + 1
+            else:
+                # 参与预筛的规则的第一个命中都不会早于合并正则的第一个命中
+                first = m.start()
+        starts = []
+        pos = 0
+        for line in lines:
+            starts.append(pos)
+            pos += len(line)
+
+        found = []
+        for order, (trigger, pattern) in enumerate(zip(self._triggers, self._patterns)):
+            begin = first if self._prefiltered[order] else 0
+            if begin > len(text):
+                continue
+            for m in pattern.finditer(text, begin):
+                found.append((m.start(), order, trigger, m))
+        found.sort(key=lambda item: (item[0], item[1]))
+
+        for start, _, trigger, m in found:
+            trigger.hits += 1
+            line_index = bisect.bisect_right(starts, start) - 1
+            base = starts[line_index]
+            groups = []
+            for g in range(1, 1 + trigger.group_count):
+                s, e = m.span(g)
+                groups.append((s - base, e - base) if s >= 0 else None)
+            yield TriggerMatch(trigger, line_index, start - base, m.end() - base, m.group(), groups)
+
+    def stats(self) -> List[Dict[str, Any]]:
+        return [{"id": t.id, "pattern": t.pattern, "regex": t.regex, "hits": t.hits}
+                for t in self._triggers]
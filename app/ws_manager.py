@@ -1,24 +1,171 @@
-from typing import Set, Dict, Any
+from typing import Set, Dict, Any, Deque, Callable, Awaitable, Optional, Union
+from collections import deque
 from fastapi import WebSocket
 import asyncio
+import logging
+
+
+# 慢客户端处理策略
+POLICY_DROP_OLDEST = "drop_oldest"   # 丢弃队列中最旧的消息
+POLICY_COALESCE = "coalesce"         # 把串口文本合并进队尾消息，无法合并时丢弃最旧
+POLICY_DISCONNECT = "disconnect"     # 直接断开落后的客户端
+SLOW_CLIENT_POLICIES = (POLICY_DROP_OLDEST, POLICY_COALESCE, POLICY_DISCONNECT)
+
+
+class ClientSender:
+    """单个 WebSocket 连接的有界发送队列与独立发送任务
+
+    队列中的 dict 以 JSON 文本帧发送，str 以原样文本帧发送，bytes 以二进制帧发送。
+    """
+
+    def __init__(
+        self,
+        websocket: WebSocket,
+        max_queue: int,
+        policy: str,
+        on_error: Callable[[WebSocket], None],
+        max_coalesce_bytes: int = 64 * 1024,
+    ) -> None:
+        self.websocket = websocket
+        self.policy = policy
+        self._queue: Deque[Union[Dict[str, Any], bytes, str]] = deque()
+        self._max_queue = max(1, max_queue)
+        self._max_coalesce_bytes = max_coalesce_bytes
+        self._on_error = on_error
+        self._event = asyncio.Event()
+        self._closed = False
+        self.sent = 0
+        self.dropped = 0
+        self.coalesced = 0
+        self.max_depth = 0
+        self._task = asyncio.create_task(self._run())
+
+    @property
+    def depth(self) -> int:
+        return len(self._queue)
+
+    def enqueue(self, message: Union[Dict[str, Any], bytes, str]) -> bool:
+        """把消息放入队列（不等待发送），返回消息是否被接收"""
+        if self._closed:
+            return False
+        if len(self._queue) >= self._max_queue:
+            if self.policy == POLICY_DISCONNECT:
+                self.dropped += 1
+                self._closed = True
+                self._on_error(self.websocket)
+                return False
+            if self.policy == POLICY_COALESCE and self._coalesce(message):
+                return True
+            self._queue.popleft()
+            self.dropped += 1
+        self._queue.append(message)
+        self.max_depth = max(self.max_depth, len(self._queue))
+        self._event.set()
+        return True
+
+    def _coalesce(self, message: Union[Dict[str, Any], bytes, str]) -> bool:
+        tail = self._queue[-1]
+        if not isinstance(tail, dict) or not isinstance(message, dict):
+            return False
+        if (tail.get("type") != "serial" or message.get("type") != "serial"
+                or not isinstance(tail.get("payload"), str)
+                or not isinstance(message.get("payload"), str)):
+            return False
+        payload = tail["payload"] + message["payload"]
+        if len(payload) > self._max_coalesce_bytes:
+            return False
+        # 广播的消息对象被多个连接共享，合并时生成新对象
+        self._queue[-1] = {**tail, "payload": payload}
+        self.coalesced += 1
+        return True
+
+    async def _run(self) -> None:
+        try:
+            while True:
+                while not self._queue:
+                    self._event.clear()
+                    await self._event.wait()
+                message = self._queue.popleft()
+                try:
+                    if isinstance(message, bytes):
+                        await self.websocket.send_bytes(message)
+                    elif isinstance(message, str):
+                        await self.websocket.send_text(message)
+                    else:
+                        await self.websocket.send_json(message)
+                except Exception:
+                    self._closed = True
+                    self._on_error(self.websocket)
+                    return
+                self.sent += 1
+        except asyncio.CancelledError:
+            return
+
+    def close(self) -> None:
+        self._closed = True
+        self._queue.clear()
+        if self._task is not asyncio.current_task():
+            self._task.cancel()
+
+    def stats(self) -> Dict[str, Any]:
+        client = self.websocket.client
+        return {
+            "client": f"{client.host}:{client.port}" if client else None,
+            "policy": self.policy,
+            "queue_depth": len(self._queue),
+            "max_queue_depth": self.max_depth,
+            "queue_limit": self._max_queue,
+            "sent": self.sent,
+            "dropped": self.dropped,
+            "coalesced": self.coalesced,
+        }
 
 
 class WebSocketManager:
-    def __init__(self) -> None:
+    def __init__(self, max_queue: int = 256, slow_client_policy: str = POLICY_DROP_OLDEST) -> None:
+        if slow_client_policy not in SLOW_CLIENT_POLICIES:
+            raise ValueError(f"未知的慢客户端策略: {slow_client_policy}")
         self._connections: Set[WebSocket] = set()
         self._serial_port_connections: Set[WebSocket] = set()
+        self._senders: Dict[WebSocket, ClientSender] = {}
+        self._max_queue = max_queue
+        self._policy = slow_client_policy
         self._lock = asyncio.Lock()
+        # 发送失败或队列溢出时调度的断开任务，保留引用直到完成
+        self._disconnect_tasks: Set[asyncio.Task] = set()
 
     async def connect(self, websocket: WebSocket) -> None:
         await websocket.accept()
         async with self._lock:
             self._connections.add(websocket)
+            self._senders[websocket] = self._new_sender(websocket)
 
     async def connect_serial_ports(self, websocket: WebSocket) -> None:
         """连接串口监听 WebSocket"""
         await websocket.accept()
         async with self._lock:
             self._serial_port_connections.add(websocket)
+            self._senders[websocket] = self._new_sender(websocket)
+
+    async def connect_direct(self, websocket: WebSocket) -> None:
+        """连接只接收定向消息（send_to）的 WebSocket，不参与广播（如寄存器监视）"""
+        await websocket.accept()
+        async with self._lock:
+            self._senders[websocket] = self._new_sender(websocket)
+
+    def _new_sender(self, websocket: WebSocket) -> ClientSender:
+        return ClientSender(websocket, self._max_queue, self._policy, self._schedule_disconnect)
+
+    def _schedule_disconnect(self, websocket: WebSocket) -> None:
+        """在独立任务中断开连接（发送方不能在入队或发送路径上等待断开完成）"""
+        task = asyncio.create_task(self.disconnect(websocket))
+        self._disconnect_tasks.add(task)
+        task.add_done_callback(self._disconnect_done)
+
+    def _disconnect_done(self, task: asyncio.Task) -> None:
+        self._disconnect_tasks.discard(task)
+        if not task.cancelled() and task.exception() is not None:
+            logging.warning(f"断开 WebSocket 连接失败: {task.exception()}")
 
     async def disconnect(self, websocket: WebSocket) -> None:
         async with self._lock:
@@ -26,39 +173,52 @@ class WebSocketManager:
                 self._connections.remove(websocket)
             if websocket in self._serial_port_connections:
                 self._serial_port_connections.remove(websocket)
+            sender = self._senders.pop(websocket, None)
+        if sender is not None:
+            sender.close()
         try:
             await websocket.close()
         except Exception:
             pass
 
+    def send_to(self, websocket: WebSocket, message: Union[Dict[str, Any], bytes, str]) -> bool:
+        """把消息放入单个连接的发送队列，返回是否被接收"""
+        sender = self._senders.get(websocket)
+        if sender is None:
+            return False
+        return sender.enqueue(message)
+
+    def pending(self, websocket: WebSocket) -> int:
+        """单个连接发送队列中尚未发出的消息数"""
+        sender = self._senders.get(websocket)
+        return sender.depth if sender is not None else 0
+
     async def broadcast(self, message: Dict[str, Any]) -> None:
-        """广播消息给所有连接"""
-        async with self._lock:
-            targets = list(self._connections)
-        for ws in targets:
-            try:
-                await ws.send_json(message)
-            except Exception:
-                # 发送失败则尝试断开
-                await self.disconnect(ws)
+        """广播消息给所有连接（只入队，慢客户端不会拖住其他连接）"""
+        for ws in list(self._connections):
+            self.send_to(ws, message)
 
     async def broadcast_serial_ports(self, message: Dict[str, Any]) -> None:
         """广播串口更新消息给串口监听连接"""
-        async with self._lock:
-            targets = list(self._serial_port_connections)
-        for ws in targets:
-            try:
-                await ws.send_json(message)
-            except Exception:
-                # 发送失败则尝试断开
-                await self.disconnect(ws)
-
-    async def receive_from_client(self, websocket: WebSocket) -> None:
+        for ws in list(self._serial_port_connections):
+            self.send_to(ws, message)
+
+    def stats(self) -> list:
+        """每个连接的队列深度、发送与丢弃计数"""
+        return [sender.stats() for sender in list(self._senders.values())]
+
+    async def receive_from_client(
+        self,
+        websocket: WebSocket,
+        handler: Optional[Callable[[Dict[str, Any]], Awaitable[bool]]] = None,
+    ) -> None:
         """接收客户端消息，转为写串口的指令格式：
         约定客户端发送 JSON：{"type":"write", "payload":"text", "appendNewline":false}
         非 write 类型可忽略或扩展
-        由外层协程处理写串口逻辑（此示例简化为回显/广播）
+        handler 返回 True 表示消息已处理，其余消息交给外层协程处理写串口逻辑（此示例简化为回显/广播）
         """
         while True:
             data = await websocket.receive_json()
+            if handler is not None and isinstance(data, dict) and await handler(data):
+                continue
             await self.broadcast({"type": "echo", "payload": data})
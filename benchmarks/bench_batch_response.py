@@ -0,0 +1,129 @@
+'''
+Author: nll
+Date: 2026-10-17
+Description: 批量读取响应序列化基准：逐项结果 + response_model 校验 vs 快速 JSON 响应（逐项 / 列式）
+
+不访问串口：先构造一份按 64 个寄存器一块读完的批量读取结果，再挂到一个最小 FastAPI 应用的三个路由上，
+经 TestClient 请求，统计从生成结果到拿到响应体的耗时与响应体大小：
+- legacy:   原实现，逐个寄存器格式化地址与值，经 BatchRegisterResponse 校验与 FastAPI 默认编码
+- fast:     预先按块算好消息与时间戳，FastJSONResponse 直接编码（字段与 legacy 相同）
+- columnar: format=columnar 的列式结果（addresses / values / status 数组）
+
+运行: python benchmarks/bench_batch_response.py --registers 10000 --repeat 20
+'''
+import argparse
+import os
+import statistics
+import sys
+import time
+from array import array
+from datetime import datetime
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from app.controllers.register_controller import RegisterController
+from app.schemas.register_schemas import BatchRegisterResponse
+from app.utils.fast_response import FastJSONResponse
+from app.utils.register_values import BatchReadResult, RegisterBlock, format_address, format_value
+
+BLOCK_REGS = 64
+
+
+def build_result(count: int, size: int = 4) -> BatchReadResult:
+    addresses = array("I", (0x20000000 + i * size for i in range(count)))
+    result = BatchReadResult(addresses, size)
+    for start in range(0, count, BLOCK_REGS):
+        block_addresses = addresses[start:start + BLOCK_REGS]
+        block = RegisterBlock(block_addresses[0], len(block_addresses) * size, block_addresses)
+        data = bytes((start + j) & 0xFF for j in range(block.length))
+        # 每 50 块有一块失败，覆盖失败分支
+        if start // BLOCK_REGS % 50 == 49:
+            result.fail_block(block, "timeout")
+        else:
+            result.set_block(block, data)
+    return result
+
+
+def legacy_results(result: BatchReadResult) -> list:
+    """原实现：逐个寄存器切片、格式化并拼接消息"""
+    size = result.size
+    results = []
+    for i, address in enumerate(result.addresses):
+        block = result.block_of[i]
+        timestamp = result.block_timestamps[block] if result.block_timestamps else None
+        if result.ok[i]:
+            results.append({
+                "address": format_address(address), "success": True,
+                "value": format_value(result.values[i * size:(i + 1) * size]),
+                "message": "读取成功（缓存）" if result.block_cached[block] else "读取成功",
+                "timestamp": timestamp,
+            })
+        else:
+            results.append({
+                "address": format_address(address), "success": False, "value": None,
+                "message": f"块读取失败: {result.block_errors[block]}" if result.block_timestamps else "未读取",
+                "timestamp": timestamp,
+            })
+    return results
+
+
+def build_app(result: BatchReadResult) -> FastAPI:
+    app = FastAPI()
+
+    @app.post("/legacy", response_model=BatchRegisterResponse)
+    def legacy():
+        return BatchRegisterResponse(
+            success=True,
+            message=f"批量读取完成，成功 {result.successful} 个，失败 {result.failed} 个",
+            total_operations=len(result.addresses),
+            successful_operations=result.successful,
+            failed_operations=result.failed,
+            results=legacy_results(result),
+            timestamp=datetime.now().isoformat()
+        )
+
+    @app.post("/fast", response_model=BatchRegisterResponse)
+    def fast():
+        return FastJSONResponse(RegisterController.batch_read_content(result))
+
+    @app.post("/columnar", response_model=BatchRegisterResponse)
+    def columnar():
+        return FastJSONResponse(RegisterController.batch_read_content(result, columnar=True))
+
+    return app
+
+
+def bench(client: TestClient, path: str, repeat: int) -> tuple:
+    client.post(path)  # 预热
+    samples = []
+    body = b""
+    for _ in range(repeat):
+        started = time.perf_counter()
+        body = client.post(path).content
+        samples.append(time.perf_counter() - started)
+    return statistics.median(samples), len(body)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--registers", type=int, default=10000)
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    result = build_result(args.registers)
+    with TestClient(build_app(result)) as client:
+        legacy = client.post("/legacy").json()
+        fast = client.post("/fast").json()
+        assert legacy["results"] == fast["results"], "fast 路径结果与原实现不一致"
+        print(f"{args.registers} 个寄存器，{len(result.block_timestamps)} 块，每种路径 {args.repeat} 次取中位数")
+        baseline = None
+        for path in ("/legacy", "/fast", "/columnar"):
+            elapsed, size = bench(client, path, args.repeat)
+            baseline = baseline or elapsed
+            print(f"{path[1:]:>9}: {elapsed * 1000:8.2f} ms  {size / 1024:8.1f} KiB  x{baseline / elapsed:.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,95 @@
+'''
+Author: nll
+Date: 2026-10-17
+Description: read 应答解析基准：原先的整段重扫 + 文本切分 vs 增量解析器
+
+模拟设备以 64 字节为单位陆续到达的应答（每行 4 个 32 位寄存器），分别统计
+每个块从收数据到得到全部寄存器值的耗时。
+
+运行: python benchmarks/bench_response_framer.py --repeat 200
+'''
+import argparse
+import os
+import sys
+import time
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from app.utils.response_framer import ReadResponseFramer
+
+TERMINATOR = b"OK\r\n"
+CHUNK = 64
+
+
+def build_response(start: int, regs: int) -> bytes:
+    lines = []
+    for i in range(0, regs, 4):
+        words = "".join(f"{(start + j * 4) * 2654435761 & 0xFFFFFFFF:08X}" for j in range(i, min(i + 4, regs)))
+        lines.append(f"0x{start + i * 4:08X}:{words}\r\n")
+    return "".join(lines).encode() + TERMINATOR
+
+
+def legacy_parse(chunks: list, regs: int, size: int = 4) -> str:
+    """原实现：每到一块就在整个缓冲区里找终止符，最后整段解码再按行、按冒号切分"""
+    buffer = bytearray()
+    for chunk in chunks:
+        buffer.extend(chunk)
+        if TERMINATOR in buffer:
+            break
+    text = buffer.decode("utf-8", errors="ignore").strip()
+    hex_parts = []
+    for line in text.splitlines():
+        line = line.strip()
+        if ":" in line:
+            hex_value = line.split(":")[1].strip()
+            if hex_value.lower().startswith("0x"):
+                hex_value = hex_value[2:]
+            hex_parts.append(hex_value)
+    return "".join(hex_parts)[:regs * size * 2]
+
+
+def framer_parse(chunks: list, regs: int, size: int = 4) -> bytearray:
+    framer = ReadResponseFramer(regs * size)
+    for chunk in chunks:
+        if framer.feed(chunk):
+            break
+    return framer.data
+
+
+def legacy_values(chunks: list, regs: int, size: int = 4) -> list:
+    hex_body = legacy_parse(chunks, regs, size)
+    return ["0x" + hex_body[j * size * 2:(j + 1) * size * 2].upper() for j in range(regs)]
+
+
+def framer_values(chunks: list, regs: int, size: int = 4) -> list:
+    data = framer_parse(chunks, regs, size)
+    return ["0x" + data[j * size:(j + 1) * size].hex().upper() for j in range(regs)]
+
+
+def bench(func, chunks: list, regs: int, repeat: int) -> float:
+    start = time.perf_counter()
+    for _ in range(repeat):
+        func(chunks, regs)
+    return (time.perf_counter() - start) / repeat
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[3])
+    parser.add_argument("--repeat", type=int, default=200)
+    args = parser.parse_args()
+
+    # parse: 收齐应答并得到整块数据；values: 再格式化为每个寄存器的 "0x..." 字符串
+    print(f"{'regs':>6} {'stage':>7} {'legacy(us)':>11} {'framer(us)':>11} {'speedup':>8}")
+    for regs in (32, 256, 4096):
+        response = build_response(0x20000000, regs)
+        chunks = [response[i:i + CHUNK] for i in range(0, len(response), CHUNK)]
+        assert legacy_values(chunks, regs) == framer_values(chunks, regs)
+        for stage, legacy_func, framer_func in (("parse", legacy_parse, framer_parse),
+                                                ("values", legacy_values, framer_values)):
+            legacy = bench(legacy_func, chunks, regs, args.repeat)
+            framer = bench(framer_func, chunks, regs, args.repeat)
+            print(f"{regs:>6} {stage:>7} {legacy * 1e6:>11.1f} {framer * 1e6:>11.1f} "
+                  f"{legacy / framer:>7.1f}x")
+
+
+if __name__ == "__main__":
+    main()
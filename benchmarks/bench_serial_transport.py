@@ -0,0 +1,105 @@
+'''
+Author: nll
+Date: 2026-10-17
+Description: 串口传输后端基准测试：I/O 线程 + to_thread 写入 vs 事件循环原生 fd 监听
+
+用 pty 模拟设备（仅 Linux/macOS），按 write_register_direct 的方式逐条发送命令、
+以 64 字节为单位读取直到 OK，统计每种后端的事务耗时。
+
+运行: python benchmarks/bench_serial_transport.py --transactions 2000
+'''
+import argparse
+import asyncio
+import os
+import statistics
+import sys
+import threading
+import time
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from app.utils.serial_helper import SerialHelper
+
+
+class PtyDevice:
+    """pty 设备替身：收到一行命令后回 `<addr>:<hex>\\r\\nOK\\r\\n`"""
+
+    def __init__(self):
+        import pty
+        import tty
+
+        self.master, self.slave = pty.openpty()
+        tty.setraw(self.slave)
+        self.path = os.ttyname(self.slave)
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        buf = b""
+        while True:
+            try:
+                data = os.read(self.master, 4096)
+            except OSError:
+                return
+            buf += data
+            while b"\n" in buf:
+                line, buf = buf.split(b"\n", 1)
+                parts = line.split()
+                if not parts:
+                    continue
+                addr = parts[1].decode() if len(parts) > 1 else "0x0"
+                os.write(self.master, f"{addr}:DEADBEEF\r\nOK\r\n".encode())
+
+    def close(self):
+        os.close(self.master)
+        os.close(self.slave)
+
+
+async def _transaction(helper: SerialHelper, address: int) -> None:
+    await helper.async_write(f"write 0x{address:08X} 0x12345678")
+    buffer = bytearray()
+    while b"OK\r\n" not in buffer:
+        chunk = await helper.async_read(64)
+        if not chunk:
+            raise TimeoutError("设备无响应")
+        buffer.extend(chunk)
+
+
+async def _run_backend(backend: str, path: str, transactions: int) -> list:
+    helper = SerialHelper(backend=backend)
+    helper.open_port(path)
+    try:
+        latencies = []
+        await _transaction(helper, 0)  # 预热
+        for i in range(transactions):
+            start = time.perf_counter()
+            await _transaction(helper, i * 4)
+            latencies.append(time.perf_counter() - start)
+        return latencies
+    finally:
+        helper.close_port()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[3])
+    parser.add_argument("--transactions", type=int, default=2000)
+    args = parser.parse_args()
+
+    if os.name != "posix":
+        print("该基准依赖 pty，仅支持 POSIX 平台")
+        return
+
+    device = PtyDevice()
+    try:
+        print(f"{'backend':<8} {'total(s)':>9} {'tx/s':>9} {'p50(us)':>9} {'p99(us)':>9}")
+        for backend in ("thread", "native"):
+            latencies = asyncio.run(_run_backend(backend, device.path, args.transactions))
+            total = sum(latencies)
+            p99 = statistics.quantiles(latencies, n=100)[98]
+            print(f"{backend:<8} {total:>9.3f} {len(latencies) / total:>9.0f} "
+                  f"{statistics.median(latencies) * 1e6:>9.1f} {p99 * 1e6:>9.1f}")
+    finally:
+        device.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,69 @@
+'''
+Author: nll
+Date: 2026-10-17
+Description: 终端输出触发器测试
+'''
+from app.utils.triggers import TriggerMatcher
+
+
+def _hits(matcher, lines):
+    return [(m.trigger.owner, m.trigger.id, m.line_index, m.start, m.end) for m in matcher.scan(lines)]
+
+
+def test_overlapping_rules_of_different_clients_all_fire():
+    """一个客户端的规则不能遮挡另一个客户端的规则"""
+    matcher = TriggerMatcher()
+    matcher.set_triggers("A", [{"id": "a", "pattern": "ERROR"}])
+    matcher.set_triggers("B", [{"id": "b", "pattern": "ERROR: boot"}])
+    matcher.set_triggers("C", [{"id": "c", "pattern": "boot"}])
+
+    hits = _hits(matcher, ["ERROR: boot failed\n"])
+
+    assert ("A", "a", 0, 0, 5) in hits
+    assert ("B", "b", 0, 0, 11) in hits
+    assert ("C", "c", 0, 7, 11) in hits
+    assert len(hits) == 3
+
+
+def test_matches_ordered_by_position_and_line():
+    matcher = TriggerMatcher()
+    matcher.set_triggers("A", [{"id": "ok", "pattern": "OK"}])
+    matcher.set_triggers("B", [{"id": "ver", "pattern": r"ver (\d+)", "regex": True, "ignore_case": True}])
+
+    matches = list(matcher.scan(["VER 3 OK\n", "nothing\n", "OK\n"]))
+
+    assert [(m.trigger.id, m.line_index, m.start) for m in matches] == [("ver", 0, 0), ("ok", 0, 6), ("ok", 2, 0)]
+    assert matches[0].groups == [(4, 5)]
+
+
+def test_no_match_and_remove_owner():
+    matcher = TriggerMatcher()
+    matcher.set_triggers("A", [{"id": "a", "pattern": "ERROR"}])
+    assert _hits(matcher, ["all good\n"]) == []
+
+    matcher.remove_owner("A")
+    assert not matcher
+    assert _hits(matcher, ["ERROR\n"]) == []
+
+
+def test_invalid_rule_leaves_existing_rules():
+    matcher = TriggerMatcher()
+    matcher.set_triggers("A", [{"id": "a", "pattern": "ERROR"}])
+    try:
+        matcher.set_triggers("B", [{"id": "bad", "pattern": "(", "regex": True}])
+    except ValueError:
+        pass
+    else:
+        raise AssertionError("无效正则应抛出 ValueError")
+    assert len(matcher) == 1
+
+
+def test_backreference_rule_not_lost_by_prefilter():
+    """合并预筛会给分组重新编号，带反向引用的规则不能因预筛失败而漏报"""
+    matcher = TriggerMatcher()
+    matcher.set_triggers("A", [{"id": "xy", "pattern": "(x)y", "regex": True}])
+    matcher.set_triggers("B", [{"id": "aa", "pattern": r"(a)\1", "regex": True}])
+
+    assert _hits(matcher, ["aa\n"]) == [("B", "aa", 0, 0, 2)]
+    assert _hits(matcher, ["xy aa\n"]) == [("A", "xy", 0, 0, 2), ("B", "aa", 0, 3, 5)]
+    assert _hits(matcher, ["ab\n"]) == []